@@ -5,27 +5,42 @@ import time
 
 from .vector_store import VectorStore
 from .llm_client import LLMClient
-from .database import get_db, Chunk, Document
+from .database import Chunk, Document
 from sqlalchemy import and_
 # Добавьте в HistoryRAGAgent
 from .intelligent_search import IntelligentSearch
+from .question_bank import QuestionBank
+from .structure_parser import make_scope
 
 class HistoryRAGAgent:
     def __init__(self, vector_store: VectorStore, llm_client: LLMClient):
         self.vs = vector_store
         self.llm = llm_client
         self.intelligent_search = IntelligentSearch(vector_store, llm_client)
+        self.question_bank = QuestionBank(llm_client, self.intelligent_search.context_builder)
     
-    def answer_fact(self, query: str, document_id: Optional[int] = None, top_k: int = 5) -> Dict[str, Any]:
+    def answer_fact(self, query: str, document_id: Optional[int] = None, top_k: int = 5,
+                    chapter: Optional[str] = None, paragraph: Optional[str] = None) -> Dict[str, Any]:
         """
-        Умный ответ с пониманием контекста
+        Умный ответ с пониманием контекста.
+        document_id / chapter / paragraph сужают поиск до учебника и раздела.
         """
-        # Используем интеллектуальный поиск
-        result = self.intelligent_search.answer_question(query)
-        
-        # Фильтруем по document_id если нужно
-        if document_id and result['sources']:
-            result['sources'] = [s for s in result['sources'] 
-                                if str(document_id) in str(s.get('doc_id', ''))]
-        
-        return result
\ No newline at end of file
+        scope = make_scope(document_id, chapter, paragraph)
+        return self.intelligent_search.answer_question(query, scope=scope)
+    
+    def answer_batch(self, queries: List[str], document_id: Optional[int] = None,
+                     chapter: Optional[str] = None, paragraph: Optional[str] = None):
+        """
+        Ответы на список вопросов (контрольная, домашнее задание): поиск пакетами,
+        ответы - по мере готовности, (номер вопроса, ответ или исключение).
+        """
+        scope = make_scope(document_id, chapter, paragraph)
+        return self.intelligent_search.answer_batch(queries, scope=scope)
+    
+    def generate_questions(self, document_id: int, chapter: Optional[str] = None,
+                           paragraph: Optional[str] = None, num_questions: int = 5) -> Dict[str, Any]:
+        """
+        Вопросы с ответами по параграфу (или главе, если параграф не указан):
+        из банка вопросов, LLM - только для недостающих.
+        """
+        return self.question_bank.get_questions(document_id, chapter, paragraph, num_questions)
@@ -4,21 +4,143 @@ from pathlib import Path
 # Базовая директория проекта
 BASE_DIR = Path(__file__).parent.parent
 
+# Директория данных (БД, индексы, загрузки).
+# Переопределяется переменной окружения - например, для бенчмарков во временной папке
+DATA_DIR = Path(os.getenv("HISTORY_TUTOR_DATA_DIR", BASE_DIR))
+
 # Директория для загрузок
-UPLOAD_DIR = BASE_DIR / "uploads"
+UPLOAD_DIR = DATA_DIR / "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # Параметры чанкинга
 CHUNK_SIZE = 1000  # символов на чанк
 CHUNK_OVERLAP = 200  # перекрытие между чанками
 
+# Извлечение текста из PDF (app/pdf_extraction.py): "pdfplumber" или "pypdfium2".
+# pypdfium2 в разы быстрее; переключать после сверки на настоящих учебниках
+# (python -m benchmarks.extraction_parity --pdf book.pdf)
+PDF_EXTRACTOR = "pdfplumber"
+
 # Настройки БД
-DATABASE_URL = f"sqlite:///{BASE_DIR}/history_tutor.db"
+DATABASE_URL = f"sqlite:///{DATA_DIR}/history_tutor.db"
+
+# Пул соединений SQLAlchemy
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
+DB_POOL_TIMEOUT = 30     # сек ожидания свободного соединения
+DB_POOL_RECYCLE = 1800   # сек, после которых соединение пересоздается
+
+# Потоки для блокирующих обработчиков FastAPI (БД, эмбеддинги, Ollama)
+THREADPOOL_SIZE = 40
+
+# PRAGMA для SQLite: WAL позволяет читать во время загрузки учебника
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",     # в режиме WAL безопасно и намного быстрее FULL
+    "cache_size": -64000,        # ~64 МБ страничного кэша
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,      # 256 МБ
+    "busy_timeout": 5000,        # мс ожидания блокировки вместо "database is locked"
+}
 
 # Настройки векторной БД (для FAISS)
-CHROMA_PERSIST_DIR = BASE_DIR / "chroma_db"  # оставляем для совместимости
+CHROMA_PERSIST_DIR = DATA_DIR / "chroma_db"  # оставляем для совместимости
 os.makedirs(CHROMA_PERSIST_DIR, exist_ok=True)
 
 # Модель для эмбеддингов
 # EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"  # Поддерживает русский
-EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
\ No newline at end of file
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# Дисковый кэш эмбеддингов (ключ: модель + хэш текста чанка)
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = DATA_DIR / "embedding_cache.db"
+EMBEDDING_BATCH_SIZE = 32
+
+# Двухуровневый векторный поиск: сначала разделы (центроиды чанков параграфа),
+# затем чанки только внутри выбранных разделов
+HIERARCHICAL_SEARCH = True
+HIERARCHICAL_MIN_SECTIONS = 200   # на меньшем корпусе плоский поиск дешев и точнее
+SECTION_FANOUT = 8     # сколько разделов просматривать: больше - выше полнота, дороже запрос
+SECTION_CHUNKS = 8     # чанков в разделе для текста без глав и параграфов
+
+# Индекс предложений (small-to-big): на фактологический вопрос ищутся отдельные
+# предложения, а в промпт идут они с соседями из родительского чанка
+SENTENCE_INDEX = True
+SENTENCE_MIN_CHARS = 30   # более короткие предложения не индексируются
+SENTENCE_TOP_K = 8        # предложений в выдаче (группируются по чанкам)
+SENTENCE_WINDOW = 1       # соседних предложений с каждой стороны
+
+# Текст чанков в ChromaDB (documents). False - в индексе только векторы и метаданные
+# для фильтров со ссылкой на chunks.id; текст и остальные поля найденных чанков
+# читаются из SQLite одним запросом WHERE id IN (...) - без дублирования и обрезки
+VECTOR_STORE_TEXT = False
+
+# Ответ без LLM на «когда / в каком году / кто» (app/extractive_answerer.py):
+# дата или имя из найденных предложений (нужен SENTENCE_INDEX)
+EXTRACTIVE_ANSWERS = True
+EXTRACTIVE_MIN_CONFIDENCE = 0.6   # ниже - отвечает LLM
+
+# Банк вопросов по разделам (app/question_bank.py): генерируется в фоне после загрузки
+# учебника, /generate-questions выбирает из него; LLM - только если вопросов не хватает
+QUESTION_BANK_PREFILL = True
+QUESTION_BANK_SIZE = 10        # вопросов на раздел при фоновой генерации
+QUESTIONS_PER_CALL = 5         # вопросов за один запрос к LLM (по одному фрагменту раздела)
+QUESTION_SOURCE_PREVIEW = 500  # символов текста раздела в ответе (source_text)
+
+# /ask/batch: поиск по всем вопросам - пакетами, ответы LLM - в нескольких потоках
+ASK_BATCH_MAX_QUESTIONS = 50
+ASK_BATCH_CONCURRENCY = 4   # одновременных вопросов; сверх OLLAMA_NUM_PARALLEL сервера - только очередь
+
+# Адаптивное расширение запроса: LLM переформулирует вопрос,
+# только если исходный запрос нашел чанки неуверенно
+EXPANSION_MAX_DISTANCE = 0.35    # косинусное расстояние лучшего чанка, при котором расширение не нужно
+EXPANSION_MIN_AGREEMENT = 0.5    # доля топа векторного поиска, подтвержденная лексическим поиском
+EXPANSION_AGREEMENT_TOP = 3      # глубина топа для сравнения векторного и лексического поиска
+EXPANSION_CACHE_SIZE = 1024      # вариантов расширения в памяти (по нормализованному запросу)
+
+# Источник переформулировок: "llm" - Ollama, "local" - словарь имен и морфология
+# (app/query_expansion.py), "hybrid" - оба
+QUERY_EXPANSION_MODE = "hybrid"
+# Имя из текста попадает в расширения, если встретилось хотя бы столько раз
+# (одиночные совпадения вроде «деревни Канны Ганнибал» - обычно шум)
+ALIAS_MIN_FREQUENCY = 2
+
+# Ollama (адрес можно переопределить, например, на benchmarks/fake_ollama.py)
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = "gemma3:4b"  # или "mistral", "gemma:7b"
+
+# Параметры генерации Ollama
+LLM_NUM_CTX = 2048       # окно контекста модели (токенов): промпт + ответ
+LLM_NUM_PREDICT = 300    # максимум токенов ответа
+# Сколько Ollama держит модель в памяти после запроса ("30m", "1h", -1 - всегда).
+# По умолчанию Ollama выгружает модель через 5 минут простоя, и первый
+# запрос после паузы ждет загрузки несколько секунд
+LLM_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+LLM_WARMUP = True        # загрузить модель при старте сервиса
+
+# Маршрутизация по задачам: короткие дешевые задачи - на маленькую модель,
+# основная модель остается свободной для ответов.
+# model=None - основная модель (OLLAMA_MODEL); модели нет в Ollama - тоже основная
+LLM_SMALL_MODEL = "gemma3:1b"
+LLM_ROUTES = {
+    "expand": {"model": LLM_SMALL_MODEL, "num_predict": 100, "num_ctx": 1024},
+    "rerank": {"model": LLM_SMALL_MODEL, "num_predict": 5, "num_ctx": 1024},
+    "answer": {"model": None, "num_predict": LLM_NUM_PREDICT, "num_ctx": LLM_NUM_CTX},
+    "generate-questions": {"model": None, "num_predict": 800, "num_ctx": 4096},
+}
+# Переключение на запасную модель, если очередь основной слишком долгая:
+# ожидание = время запроса - total_duration из ответа Ollama, сглаженное EWMA;
+# запрос, не дождавшийся ответа за LLM_REQUEST_TIMEOUT, считается ожиданием целиком
+LLM_REQUEST_TIMEOUT = 60.0         # сек на запрос к Ollama
+LLM_FAILOVER_MODEL = LLM_SMALL_MODEL
+LLM_FAILOVER_QUEUE_LATENCY = 5.0   # сек сглаженного ожидания в очереди
+LLM_QUEUE_EWMA_ALPHA = 0.3         # вес нового замера в EWMA
+LLM_FAILOVER_COOLDOWN = 30.0       # сек до пробного запроса к основной модели
+
+# Упаковка фрагментов учебника в промпт ответа (app/context_builder.py)
+CONTEXT_TOKEN_BUDGET = 1200   # токенов на фрагменты (дополнительно ограничено окном модели)
+CONTEXT_MAX_CHUNKS = 3        # сколько найденных чанков рассматривать
+# Токенизатор Hugging Face для подсчета токенов (только из локального кэша);
+# если недоступен - оценка по символам
+CONTEXT_TOKENIZER = "google/gemma-3-4b-it"
+CHARS_PER_TOKEN = 3.0         # оценка для русского текста без токенизатора
@@ -0,0 +1,296 @@
+# app/consistency.py
+"""
+Проверка и восстановление согласованности SQLite (chunks.embedding_id) и ChromaDB.
+
+Запуск:
+    python -m app.consistency check  [--doc-id N]
+    python -m app.consistency repair [--doc-id N] [--keep-orphans]
+    python -m app.consistency resume
+    python -m app.consistency sections [--doc-id N]
+    python -m app.consistency sentences [--doc-id N]
+
+sections пересчитывает центроиды разделов (двухуровневый поиск), sentences -
+индекс предложений (small-to-big) - например, для индекса, построенного до их
+появления или восстановленного из снапшота.
+"""
+from typing import List, Dict, Any, Optional
+import argparse
+import json
+
+from sqlalchemy import update
+
+from .config import SENTENCE_INDEX
+from .database import init_db, SessionLocal, Chunk, Document
+from .vector_store import VectorStore
+
+
+class IndexConsistencyChecker:
+    """
+    Сравнивает chunks.embedding_id с коллекцией ChromaDB:
+    - missing: чанк есть в SQL, вектора нет в Chroma
+    - orphans: вектор есть в Chroma, чанка нет в SQL
+    - unassigned: у чанка нет embedding_id
+    """
+
+    def __init__(self, vector_store: VectorStore, batch_size: int = 200):
+        self.vs = vector_store
+        self.batch_size = batch_size
+
+    # ---------- CHECK ----------
+
+    def check(self, doc_id: Optional[int] = None) -> Dict[str, Any]:
+        db = SessionLocal()
+        try:
+            query = db.query(Chunk.id, Chunk.embedding_id)
+            if doc_id is not None:
+                query = query.filter(Chunk.doc_id == doc_id)
+            rows = query.all()
+        finally:
+            db.close()
+
+        sql_ids = {emb_id for _, emb_id in rows if emb_id}
+        unassigned = [chunk_id for chunk_id, emb_id in rows if not emb_id]
+        chroma_ids = set(self.vs.get_all_ids(doc_id))
+
+        return {
+            "doc_id": doc_id,
+            "sql_chunks": len(rows),
+            "vector_count": len(chroma_ids),
+            "missing": sorted(sql_ids - chroma_ids),
+            "orphans": sorted(chroma_ids - sql_ids),
+            "unassigned": unassigned
+        }
+
+    # ---------- REPAIR ----------
+
+    def repair(self, doc_id: Optional[int] = None, remove_orphans: bool = True,
+               rebuild_derived: bool = False) -> Dict[str, Any]:
+        """
+        Доиндексирует недостающие чанки батчами и удаляет сиротские векторы.
+        rebuild_derived - пересчитать центроиды разделов и индекс предложений, даже
+        если векторы чанков все на месте (сбой после add_chunks).
+        Повторный запуск безопасен: запись идет через upsert по тем же ID.
+        """
+        self._assign_missing_embedding_ids(doc_id)
+        report = self.check(doc_id)
+
+        reembedded = self._reembed(report["missing"])
+
+        removed = 0
+        if remove_orphans and report["orphans"]:
+            self.vs.delete_ids(report["orphans"])
+            removed = len(report["orphans"])
+            print(f"🧹 Удалено сиротских векторов: {removed}")
+
+        if reembedded or removed or rebuild_derived:
+            self.vs.index_sections(doc_id)
+        sentences = 0
+        if rebuild_derived and SENTENCE_INDEX:
+            sentences = self.reindex_sentences(doc_id)
+
+        self._refresh_statuses(doc_id)
+
+        return {
+            "doc_id": doc_id,
+            "missing_before": len(report["missing"]),
+            "reembedded": reembedded,
+            "orphans_removed": removed,
+            "sentences": sentences
+        }
+
+    def reindex_sentences(self, doc_id: Optional[int] = None) -> int:
+        """Заново строит индекс предложений документа (или всех) по чанкам из SQLite"""
+        db = SessionLocal()
+        try:
+            query = db.query(Document.id)
+            if doc_id is not None:
+                query = query.filter(Document.id == doc_id)
+            doc_ids = [d.id for d in query.all()]
+        finally:
+            db.close()
+
+        total = 0
+        for d_id in doc_ids:
+            self.vs.sentence_collection.delete(where={"doc_id": str(d_id)})
+            db = SessionLocal()
+            try:
+                chunks = (
+                    db.query(Chunk)
+                    .filter(Chunk.doc_id == d_id, Chunk.embedding_id.isnot(None))
+                    .order_by(Chunk.chunk_index)
+                    .all()
+                )
+            finally:
+                db.close()
+            for i in range(0, len(chunks), self.batch_size):
+                batch = chunks[i:i + self.batch_size]
+                total += self.vs.add_sentences(
+                    [self._chunk_data(ch) for ch in batch], d_id,
+                    ids=[ch.embedding_id for ch in batch]
+                )
+        return total
+
+    def resume_pending(self) -> List[Dict[str, Any]]:
+        """
+        Доводит до конца индексацию документов, прерванную сбоем: недостающие векторы
+        чанков, затем заново центроиды разделов и предложения - сбой мог случиться
+        и после add_chunks.
+        """
+        db = SessionLocal()
+        try:
+            pending = [
+                d.id for d in db.query(Document.id)
+                .filter(Document.status.in_(["processing", "partial"]))
+                .all()
+            ]
+        finally:
+            db.close()
+
+        results = []
+        for doc_id in pending:
+            print(f"🔄 Возобновляем индексацию документа {doc_id}")
+            results.append(self.repair(doc_id, remove_orphans=False, rebuild_derived=True))
+        return results
+
+    # ---------- HELPERS ----------
+
+    def _assign_missing_embedding_ids(self, doc_id: Optional[int]):
+        """Назначает embedding_id чанкам, у которых его нет"""
+        db = SessionLocal()
+        try:
+            query = db.query(Chunk.id, Chunk.doc_id, Chunk.chunk_index).filter(
+                (Chunk.embedding_id.is_(None)) | (Chunk.embedding_id == "")
+            )
+            if doc_id is not None:
+                query = query.filter(Chunk.doc_id == doc_id)
+            rows = query.all()
+            if not rows:
+                return
+
+            db.execute(update(Chunk), [
+                {"id": chunk_id, "embedding_id": self.vs.make_embedding_id(d_id, idx)}
+                for chunk_id, d_id, idx in rows
+            ])
+            db.commit()
+            print(f"🛠️ Назначены embedding_id для {len(rows)} чанков")
+        finally:
+            db.close()
+
+    @staticmethod
+    def _chunk_data(ch: Chunk) -> Dict[str, Any]:
+        """Строка chunks -> словарь чанка в формате add_chunks"""
+        return {
+            "id": ch.id,
+            "content": ch.content,
+            "chunk_index": ch.chunk_index,
+            "page_number": ch.page_number,
+            "chapter": ch.chapter or "",
+            "paragraph": ch.paragraph or "",
+            "section_title": ch.section_title or ""
+        }
+
+    def _reembed(self, embedding_ids: List[str]) -> int:
+        """Заново векторизует чанки по их embedding_id батчами"""
+        done = 0
+        for i in range(0, len(embedding_ids), self.batch_size):
+            batch = embedding_ids[i:i + self.batch_size]
+
+            db = SessionLocal()
+            try:
+                chunks = db.query(Chunk).filter(Chunk.embedding_id.in_(batch)).all()
+            finally:
+                db.close()
+
+            # add_chunks работает в рамках одного документа
+            by_doc: Dict[int, List[Chunk]] = {}
+            for ch in chunks:
+                by_doc.setdefault(ch.doc_id, []).append(ch)
+
+            for d_id, doc_chunks in by_doc.items():
+                chunk_data = [self._chunk_data(ch) for ch in doc_chunks]
+                chunk_ids = [ch.embedding_id for ch in doc_chunks]
+                added = self.vs.add_chunks(chunk_data, d_id, ids=chunk_ids)
+                if SENTENCE_INDEX:
+                    self.vs.add_sentences(chunk_data, d_id, ids=chunk_ids)
+                done += len(added)
+
+        return done
+
+    def _derived_complete(self, doc_id: int, vector_count: int) -> bool:
+        """Центроиды разделов покрывают все векторы чанков документа, предложения - все на месте"""
+        coverage = self.vs.index_coverage(doc_id)
+        if coverage["section_chunks"] != vector_count:
+            return False
+        if not SENTENCE_INDEX:
+            return True
+        db = SessionLocal()
+        try:
+            contents = db.query(Chunk.content).filter(
+                Chunk.doc_id == doc_id, Chunk.embedding_id.isnot(None)
+            ).all()
+        finally:
+            db.close()
+        expected = sum(len(self.vs.indexable_sentences(content)) for (content,) in contents)
+        return coverage["sentences"] >= expected
+
+    def _refresh_statuses(self, doc_id: Optional[int]):
+        """
+        Проставляет документам статус по факту наличия всех векторов:
+        чанков, центроидов разделов и предложений.
+        """
+        db = SessionLocal()
+        try:
+            query = db.query(Document)
+            if doc_id is not None:
+                query = query.filter(Document.id == doc_id)
+            for document in query.all():
+                report = self.check(document.id)
+                complete = (
+                    not report["missing"] and not report["unassigned"]
+                    and self._derived_complete(document.id, report["vector_count"])
+                )
+                document.status = "indexed" if complete else "partial"
+            db.commit()
+        finally:
+            db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Согласованность SQLite и ChromaDB")
+    parser.add_argument("command", choices=["check", "repair", "resume", "sections", "sentences"])
+    parser.add_argument("--doc-id", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--keep-orphans", action="store_true",
+                        help="не удалять векторы без чанка в SQL")
+    args = parser.parse_args()
+
+    init_db()
+    checker = IndexConsistencyChecker(VectorStore(), batch_size=args.batch_size)
+
+    if args.command == "check":
+        report = checker.check(args.doc_id)
+        summary = {
+            "doc_id": report["doc_id"],
+            "sql_chunks": report["sql_chunks"],
+            "vector_count": report["vector_count"],
+            "missing": len(report["missing"]),
+            "orphans": len(report["orphans"]),
+            "unassigned": len(report["unassigned"])
+        }
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    elif args.command == "repair":
+        result = checker.repair(args.doc_id, remove_orphans=not args.keep_orphans)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    elif args.command == "sections":
+        sections = checker.vs.index_sections(args.doc_id)
+        print(json.dumps({"doc_id": args.doc_id, "sections": sections,
+                          "ready": checker.vs.sections_ready()}, ensure_ascii=False, indent=2))
+    elif args.command == "sentences":
+        sentences = checker.reindex_sentences(args.doc_id)
+        print(json.dumps({"doc_id": args.doc_id, "sentences": sentences}, ensure_ascii=False, indent=2))
+    else:
+        print(json.dumps(checker.resume_pending(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
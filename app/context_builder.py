@@ -0,0 +1,183 @@
+# app/context_builder.py
+"""
+Сборка контекста для ответа LLM в пределах бюджета токенов.
+
+Вместо «первые 1000 символов каждого из 3 чанков»:
+    - токены считаются токенизатором модели (или оценкой по символам);
+    - повторы между соседними чанками (перекрытие, одинаковые предложения) убираются;
+    - если все не помещается, берутся предложения, где есть слова вопроса,
+      с соседними предложениями для связности;
+    - результат укладывается в бюджет, который вместе с ответом
+      помещается в окно модели (num_ctx).
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from functools import lru_cache
+import math
+import re
+
+from .config import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_CHUNKS, CONTEXT_TOKENIZER, CHARS_PER_TOKEN,
+    LLM_NUM_CTX, LLM_NUM_PREDICT, CHUNK_OVERLAP
+)
+from .query_expansion import MorphNormalizer, STOP_WORDS, WORD_RE
+from .text_matching import normalize_search_text
+
+# Конец предложения: знак препинания, пробел и заглавная буква/цифра/кавычка
+# («до н. э. Цезарь» - граница, «н. э» - нет)
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?…])\s+(?=[А-ЯЁA-Z0-9«\"(—])")
+
+MIN_OVERLAP_CHARS = 20
+HEADER_TOKENS = 12
+
+
+class TokenCounter:
+    """Подсчет токенов: токенизатор модели из кэша Hugging Face или оценка по символам"""
+
+    def __init__(self, tokenizer_name: Optional[str] = CONTEXT_TOKENIZER):
+        self.tokenizer = None
+        if tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+                # Только локальный кэш: без сети при старте сервиса
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, local_files_only=True)
+                print(f"✅ Токенизатор для контекста: {tokenizer_name}")
+            except Exception as e:
+                print(f"⚠️ Токенизатор {tokenizer_name} недоступен ({type(e).__name__}), "
+                      f"оценка: {CHARS_PER_TOKEN} символа на токен")
+        self.count = lru_cache(maxsize=50000)(self._count)
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_SPLIT_RE.split(text) if s.strip()]
+
+
+def trim_overlap(previous: str, current: str, max_overlap: int = CHUNK_OVERLAP * 2) -> str:
+    """Убирает из начала current текст, которым заканчивается previous (перекрытие чанков)"""
+    limit = min(len(previous), len(current), max_overlap)
+    for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:size]):
+            return current[size:].lstrip()
+    return current
+
+
+class ContextBuilder:
+    """Упаковка найденных чанков в контекст промпта по бюджету токенов"""
+
+    def __init__(self, normalizer: Optional[MorphNormalizer] = None,
+                 token_counter: Optional[TokenCounter] = None):
+        self.normalizer = normalizer or MorphNormalizer()
+        self.tokens = token_counter or TokenCounter()
+
+    def budget_for(self, prompt_template_tokens: int,
+                   num_ctx: int = LLM_NUM_CTX, num_predict: int = LLM_NUM_PREDICT) -> int:
+        """Бюджет фрагментов: не больше настройки и не больше остатка окна модели"""
+        return max(0, min(CONTEXT_TOKEN_BUDGET, num_ctx - num_predict - prompt_template_tokens))
+
+    def _query_stems(self, query: str) -> List[str]:
+        return [
+            self.normalizer.stem(w) for w in WORD_RE.findall(query.lower())
+            if len(w) > 2 and w not in STOP_WORDS
+        ]
+
+    def _prepare(self, chunks: List[Dict]) -> List[Dict[str, Any]]:
+        """Чанки -> предложения без перекрытий и повторов"""
+        prepared = []
+        seen_sentences = set()
+        previous: Dict[Tuple[str, int], str] = {}
+
+        for rank, chunk in enumerate(chunks[:CONTEXT_MAX_CHUNKS]):
+            meta = chunk.get('metadata', {})
+            text = chunk['content']
+
+            # Соседний чанк того же документа уже в контексте - срезаем перекрытие
+            try:
+                doc_id, index = str(meta.get('doc_id')), int(meta.get('chunk_index'))
+                if (doc_id, index - 1) in previous:
+                    text = trim_overlap(previous[(doc_id, index - 1)], text)
+                previous[(doc_id, index)] = chunk['content']
+            except (TypeError, ValueError):
+                pass
+
+            sentences = []
+            for sentence in split_sentences(text):
+                key = normalize_search_text(sentence)
+                if key in seen_sentences:
+                    continue
+                seen_sentences.add(key)
+                sentences.append({"text": sentence, "search": key})
+
+            if sentences:
+                prepared.append({"rank": rank, "page": meta.get('page_number', '?'), "sentences": sentences})
+        return prepared
+
+    def _render(self, prepared: List[Dict[str, Any]], selected: Optional[set] = None) -> str:
+        parts = []
+        for item in prepared:
+            pieces = []
+            last = None
+            for i, sentence in enumerate(item["sentences"]):
+                if selected is not None and (item["rank"], i) not in selected:
+                    continue
+                if last is not None and i != last + 1:
+                    pieces.append("…")
+                pieces.append(sentence["text"])
+                last = i
+            if pieces:
+                parts.append(f"[Страница {item['page']}]\n" + " ".join(pieces))
+        return "\n\n---\n\n".join(parts)
+
+    def build(self, query: str, chunks: List[Dict], budget: int) -> Dict[str, Any]:
+        """
+        Возвращает {"context", "tokens", "sentences", "truncated"}.
+        Если все предложения помещаются - берутся целиком (без повторов).
+        """
+        prepared = self._prepare(chunks)
+        if not prepared:
+            return {"context": "", "tokens": 0, "sentences": 0, "truncated": False}
+
+        full = self._render(prepared)
+        full_tokens = self.tokens.count(full)
+        total_sentences = sum(len(item["sentences"]) for item in prepared)
+        if full_tokens <= budget:
+            return {"context": full, "tokens": full_tokens, "sentences": total_sentences, "truncated": False}
+
+        # Оценка предложений: сколько разных слов вопроса (по основам) в них есть
+        stems = list(dict.fromkeys(self._query_stems(query)))
+        scored = []
+        for item in prepared:
+            sentences = item["sentences"]
+            hits = [sum(1 for stem in stems if " " + stem in s["search"]) for s in sentences]
+            for i, sentence in enumerate(sentences):
+                # Соседи совпавших предложений - половина веса (связность текста)
+                neighbour = max(hits[i - 1] if i > 0 else 0, hits[i + 1] if i + 1 < len(sentences) else 0)
+                score = hits[i] + 0.5 * neighbour
+                scored.append((score, -item["rank"], -i, item["rank"], i, sentence["text"]))
+
+        # При равной оценке - более релевантный чанк и более ранние предложения
+        # (без совпадений это просто начало лучшего чанка)
+        scored.sort(reverse=True)
+        selected = set()
+        used = 0
+        # Запас на заголовки «[Страница N]», разделители и «…»
+        available = budget - HEADER_TOKENS * len(prepared)
+        for score, _, _, rank, i, text in scored:
+            cost = self.tokens.count(text) + 1
+            if used + cost > available:
+                continue
+            selected.add((rank, i))
+            used += cost
+
+        context = self._render(prepared, selected)
+        return {
+            "context": context,
+            "tokens": self.tokens.count(context),
+            "sentences": len(selected),
+            "truncated": True
+        }
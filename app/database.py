@@ -1,12 +1,36 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import (
+    create_engine, event, inspect, text, Boolean, Column, Integer, String, Text, DateTime, ForeignKey, Index
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import json
 
-from .config import DATABASE_URL
+from .config import (
+    DATABASE_URL, SQLITE_PRAGMAS,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
+)
+from .text_matching import normalize_search_text
+
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True
+)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Применяет PRAGMA к каждому новому соединению SQLite"""
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -19,11 +43,24 @@ class Document(Base):
     file_path = Column(String(500), nullable=False)
     upload_date = Column(DateTime, default=datetime.utcnow)
     total_chunks = Column(Integer, default=0)
+    # Статус индексации: processing -> indexed | partial (см. app/consistency.py)
+    status = Column(String(20), default="processing")
+    # Словарь имен собран (может быть и пустым) - при старте повторно не собирается
+    aliases_mined = Column(Boolean, default=False)
     
     chunks = relationship("Chunk", back_populates="document", cascade="all, delete-orphan")
+    sections = relationship("DocumentSection", back_populates="document", cascade="all, delete-orphan")
+    aliases = relationship("EntityAlias", back_populates="document", cascade="all, delete-orphan")
+    questions = relationship("QuestionBankItem", back_populates="document", cascade="all, delete-orphan")
 
 class Chunk(Base):
     __tablename__ = "chunks"
+    __table_args__ = (
+        # Покрывает выборки по документу и пагинацию по chunk_index
+        Index("ix_chunks_doc_id_chunk_index", "doc_id", "chunk_index"),
+        # Поиск в пределах раздела учебника (scope в /ask)
+        Index("ix_chunks_doc_id_chapter_paragraph", "doc_id", "chapter", "paragraph"),
+    )
     
     id = Column(Integer, primary_key=True)
     doc_id = Column(Integer, ForeignKey("documents.id"))
@@ -34,22 +71,134 @@ class Chunk(Base):
     section_title = Column(String(300))
     chunk_index = Column(Integer)
     embedding_id = Column(String(100))  # ID в векторной БД
+    search_text = Column(Text)  # normalize_search_text(content) для лексического поиска
     
     document = relationship("Document", back_populates="chunks")
 
+class DocumentSection(Base):
+    """
+    Оглавление учебника: непрерывный участок чанков с одной главой и параграфом.
+    Строится при загрузке, чтобы /structure не читал все чанки.
+    """
+    __tablename__ = "document_sections"
+    __table_args__ = (
+        Index("ix_document_sections_doc_id_position", "doc_id", "position"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    doc_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    position = Column(Integer, nullable=False)  # порядок в учебнике
+    chapter = Column(String(200))
+    paragraph = Column(String(200))
+    section_title = Column(String(300))
+    page_start = Column(Integer)
+    page_end = Column(Integer)
+    first_chunk_index = Column(Integer)
+    last_chunk_index = Column(Integer)
+    chunk_ids_json = Column(Text)  # JSON список Chunk.id
+    
+    document = relationship("Document", back_populates="sections")
+
+class EntityAlias(Base):
+    """
+    Словарь псевдонимов сущностей, собранный из текста учебника при загрузке:
+    основа слова или имени (цезар) -> полное имя (Гай Юлий Цезарь).
+    Используется локальным расширением запросов без LLM.
+    """
+    __tablename__ = "entity_aliases"
+    __table_args__ = (
+        Index("ix_entity_aliases_alias", "alias"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    doc_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    alias = Column(String(200), nullable=False)
+    canonical = Column(String(300), nullable=False)
+    frequency = Column(Integer, default=1)
+    
+    document = relationship("Document", back_populates="aliases")
+
+class QuestionBankItem(Base):
+    """
+    Банк вопросов по разделам учебника (глава + параграф): генерируется LLM
+    в фоне после загрузки, /generate-questions выбирает из него (app/question_bank.py).
+    """
+    __tablename__ = "question_bank"
+    __table_args__ = (
+        Index("ix_question_bank_doc_id_chapter_paragraph", "doc_id", "chapter", "paragraph"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    doc_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    chapter = Column(String(200))
+    paragraph = Column(String(200))
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    page = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    document = relationship("Document", back_populates="questions")
+
 def get_db():
-    """Создает и возвращает новую сессию БД"""
+    """
+    Сессия БД на время запроса (зависимость FastAPI: Depends(get_db)).
+    Вне обработчиков используйте SessionLocal() с db.close() в finally.
+    """
     db = SessionLocal()
     try:
-        return db
+        yield db
     except Exception:
-        db.close()
+        db.rollback()
         raise
+    finally:
+        db.close()
+
+def _migrate_schema():
+    """
+    Легкая миграция: добавляет в существующие таблицы колонки и индексы,
+    которые появились в моделях позже (create_all их не создает).
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {col_type}'))
+                print(f"🛠️ Добавлена колонка {table.name}.{column.name}")
+            
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+    
+    _backfill_search_text()
+
+def _backfill_search_text(batch_size: int = 1000):
+    """Заполняет Chunk.search_text у чанков, загруженных до появления колонки"""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text("SELECT id, content FROM chunks WHERE search_text IS NULL LIMIT :limit"),
+                {"limit": batch_size}
+            ).fetchall()
+            if not rows:
+                break
+            conn.execute(
+                text("UPDATE chunks SET search_text = :search_text WHERE id = :id"),
+                [{"id": row.id, "search_text": normalize_search_text(row.content)} for row in rows]
+            )
+        total += len(rows)
+    if total:
+        print(f"🛠️ Заполнен search_text для {total} чанков")
 
 def init_db():
-    """Инициализация БД - создает таблицы и возвращает функцию для получения сессий"""
+    """Инициализация БД - создает таблицы и добавляет недостающие колонки и индексы"""
     Base.metadata.create_all(bind=engine)
-    return get_db  # Возвращаем функцию, а не класс
+    _migrate_schema()
 
 class QALog(Base):
     __tablename__ = "qa_logs"
@@ -1,8 +1,12 @@
 # app/document_processor.py
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 import re
-import pdfplumber
+import time
+
+from .pdf_extraction import get_extractor
+from .structure_parser import StructureParser
+from .tracing import span, record_stage
 
 class DocumentProcessor:
     """
@@ -11,6 +15,7 @@ class DocumentProcessor:
     - удаление шума
     - semantic chunking
     - абзацная логика
+    - главы и параграфы (чанк не пересекает границу раздела)
     - подготовка данных под fact-based RAG
     """
 
@@ -61,7 +66,8 @@ class DocumentProcessor:
 
     # ---------------- SEMANTIC CHUNKING ----------------
 
-    def semantic_chunking(self, text: str) -> List[str]:
+    def semantic_chunking(self, text: str, keep_tail: bool = False) -> List[str]:
+        """keep_tail - короткий конец текста не теряется (конец раздела учебника)"""
         paragraphs = re.split(r"\n{2,}", text)
 
         chunks = []
@@ -81,53 +87,106 @@ class DocumentProcessor:
 
         if buffer and len(buffer) >= self.min_chunk_len:
             chunks.append(buffer.strip())
+        elif buffer.strip() and keep_tail:
+            # Короткий конец раздела - к предыдущему чанку раздела или отдельным чанком
+            if chunks:
+                chunks[-1] += " " + buffer.strip()
+            else:
+                chunks.append(buffer.strip())
 
         return chunks
 
     # ---------------- MAIN PIPELINE ----------------
 
-    def process_document(self, file_path: str, filename: str) -> Dict:
-        pages_text = []
-
-        with pdfplumber.open(file_path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                raw_text = page.extract_text() or ""
-
-                cleaned = self.clean_text(raw_text)
+    def process_document(self, file_path: str, filename: str, extractor: Optional[str] = None) -> Dict:
+        """extractor - бэкенд извлечения текста (по умолчанию PDF_EXTRACTOR из config)"""
+        backend = get_extractor(extractor)
+        parser = StructureParser()
+
+        # Разделы подряд: {chapter, paragraph, section_title, pages: [{page, text}]}
+        sections: List[Dict] = []
+        pages_with_text = set()
+
+        # Стадии по страницам чередуются - время копим и пишем одной записью
+        timings = {"extract": 0.0, "structure": 0.0, "clean": 0.0, "normalize": 0.0}
+
+        # Страницы извлекаются лениво: время extract - ожидание следующей страницы
+        t0 = time.perf_counter()
+        for i, raw_text in enumerate(backend.extract_pages(file_path)):
+            t1 = time.perf_counter()
+            segments = parser.split_page(raw_text)
+            t2 = time.perf_counter()
+            timings["extract"] += t1 - t0
+            timings["structure"] += t2 - t1
+
+            for segment in segments:
+                t2 = time.perf_counter()
+                cleaned = self.clean_text(segment["text"])
+                t3 = time.perf_counter()
                 normalized = self.normalize_text(cleaned)
-
-                if normalized:
-                    pages_text.append({
-                        "page": i + 1,
-                        "text": normalized
+                t4 = time.perf_counter()
+                timings["clean"] += t3 - t2
+                timings["normalize"] += t4 - t3
+
+                if not normalized:
+                    continue
+                pages_with_text.add(i + 1)
+                key = (segment["chapter"], segment["paragraph"])
+                if not sections or sections[-1]["key"] != key:
+                    sections.append({
+                        "key": key,
+                        "chapter": segment["chapter"],
+                        "paragraph": segment["paragraph"],
+                        "section_title": segment["section_title"],
+                        "pages": []
                     })
+                sections[-1]["pages"].append({"page": i + 1, "text": normalized})
+            t0 = time.perf_counter()
 
-        all_text = "\n\n".join([p["text"] for p in pages_text])
+        for stage, seconds in timings.items():
+            record_stage(stage, seconds)
 
-        chunks = self.semantic_chunking(all_text)
+        # Чанки - внутри раздела; без заголовков в документе весь текст - один раздел
+        structured = len(sections) > 1
+        with span("chunk"):
+            for section in sections:
+                section_text = "\n\n".join(p["text"] for p in section["pages"])
+                section["chunks"] = self.semantic_chunking(section_text, keep_tail=structured)
 
         processed_chunks = []
-        for idx, ch in enumerate(chunks):
-            processed_chunks.append({
-                "chunk_index": idx,
-                "content": ch,
-                "page_number": self.find_page(ch, pages_text),
-                "chapter": "",
-                "paragraph": "",
-                "section_title": ""
-            })
+        with span("find_page"):
+            for section in sections:
+                for ch in section["chunks"]:
+                    processed_chunks.append({
+                        "chunk_index": len(processed_chunks),
+                        "content": ch,
+                        "page_number": self.find_page(ch, section["pages"], section["pages"][0]["page"]),
+                        "chapter": section["chapter"],
+                        "paragraph": section["paragraph"],
+                        "section_title": section["section_title"]
+                    })
+
+        chapters = list(dict.fromkeys(s["chapter"] for s in sections if s["chapter"]))
+        paragraphs = [
+            {"chapter": s["chapter"], "paragraph": s["paragraph"], "title": s["section_title"]}
+            for s in sections if s["paragraph"]
+        ]
 
         return {
             "filename": filename,
-            "total_pages": len(pages_text),
+            "extractor": backend.name,
+            "total_pages": len(pages_with_text),
             "total_chunks": len(processed_chunks),
+            "chapters": chapters,
+            "paragraphs": paragraphs,
+            "toc": parser.toc,
             "chunks": processed_chunks
         }
 
     # ---------------- PAGE MAPPING ----------------
 
-    def find_page(self, chunk_text: str, pages_text: List[Dict]) -> int:
+    def find_page(self, chunk_text: str, pages_text: List[Dict], default: int = 1) -> int:
         for p in pages_text:
             if chunk_text[:100] in p["text"]:
                 return p["page"]
-        return 1
+        return default
@@ -0,0 +1,107 @@
+# app/embedding_cache.py
+from typing import Dict, Iterable, List, Optional
+from pathlib import Path
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов (SQLite).
+
+    Ключ - (имя модели, sha256 текста), значение - вектор float32.
+    При смене EMBEDDING_MODEL векторы разных моделей не смешиваются,
+    а пересборка индекса сводится к чтению с диска вместо инференса.
+    """
+
+    # Ограничение SQLite на число параметров в одном запросе
+    _QUERY_BATCH = 500
+
+    def __init__(self, path: Path, model_name: str):
+        self.path = Path(path)
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, content_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """Хэш содержимого чанка"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """Возвращает найденные в кэше векторы: {hash: vector}"""
+        unique = list(dict.fromkeys(hashes))
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            for i in range(0, len(unique), self._QUERY_BATCH):
+                batch = unique[i:i + self._QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND content_hash IN ({placeholders})",
+                    [self.model_name, *batch]
+                ).fetchall()
+                for content_hash, blob in rows:
+                    found[content_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        self.hits += len(found)
+        self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Сохраняет векторы в кэш"""
+        if not items:
+            return
+
+        rows = []
+        for content_hash, vector in items.items():
+            arr = np.asarray(vector, dtype=np.float32)
+            rows.append((self.model_name, content_hash, int(arr.shape[0]), arr.tobytes()))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, dim, vector) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def get_stats(self) -> Dict[str, Optional[int]]:
+        """Статистика кэша для текущей модели"""
+        with self._lock:
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?",
+                (self.model_name,)
+            ).fetchone()[0]
+        return {
+            "model": self.model_name,
+            "cached_vectors": count,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
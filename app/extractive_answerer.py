@@ -0,0 +1,245 @@
+# app/extractive_answerer.py
+"""
+Ответ без LLM на вопросы «когда / в каком году / кто».
+
+Из найденных предложений (индекс предложений, VectorStore.search_sentences)
+берутся кандидаты - годы, даты и века или имена людей. Каждый кандидат
+получает голоса предложений, в которых он встречается: чем больше слов
+вопроса в предложении (и, с меньшим весом, в соседних) и чем выше оно
+в выдаче, тем весомее голос. Имена и названия из вопроса весят вдвое.
+Уверенность - полнота совпадения лучшего предложения с вопросом
+и отрыв победителя от следующего кандидата.
+
+При низкой уверенности отвечает LLM (IntelligentSearch.extract_answer).
+"""
+from typing import List, Dict, Any, Optional, Tuple
+import re
+
+from .context_builder import split_sentences
+from .query_expansion import (
+    LocalQueryExpander, STOP_WORDS, WORD_RE, CAPITALIZED_RE, NAME_RE, _at_sentence_start
+)
+
+DATE_QUESTION_RE = re.compile(
+    r"^\s*(?:когда|в\s+каком\s+(?:году|веке)|какого\s+числа|в\s+какие\s+годы|как(?:ой|ом)\s+(?:год|век|году|веке))\b",
+    re.IGNORECASE
+)
+# «Кто такие викинги?» - вопрос об определении, не об имени
+PERSON_QUESTION_RE = re.compile(
+    r"^\s*(?:кто(?!\s+так(?:ой|ая|ое|ие)\b)|кем|кого|кому|как\s+звали)\b",
+    re.IGNORECASE
+)
+CENTURY_QUESTION_RE = re.compile(r"\bвек", re.IGNORECASE)
+
+MONTHS = (
+    "января|февраля|марта|апреля|мая|июня|июля|августа|"
+    "сентября|октября|ноября|декабря"
+)
+ERA_RE = r"(?:\s*до\s+н\.\s*э\.?)"
+# 1242 году, 44 г. до н. э., 1914-1918 гг., в 988
+YEAR_RE = re.compile(
+    r"(?:(\d{1,2})\s+(" + MONTHS + r")\s+)?"
+    r"\b(\d{3,4}|\d{1,2}(?=\s*(?:г\.|год)))(?:\s*[-–—]\s*(\d{2,4}))?"
+    r"(\s*(?:гг?\.|год(?:а|у|ом|ах)?))?(" + ERA_RE + r")?"
+)
+CENTURY_RE = re.compile(r"\b([IVXLC]+)(?:\s*[-–—]\s*([IVXLC]+))?\s+(?:вв?\.|век(?:а|е|ах)?)(" + ERA_RE + r")?")
+# Без «г.» и «до н. э.» четырехзначное число считается годом только в этих пределах
+BARE_YEAR_RANGE = (800, 2100)
+
+# Предложение кончается сокращением - продолжение идет следующим «предложением»
+ABBREVIATION_END_RE = re.compile(r"(?:н\.\s*э|гг?|вв?)\.$")
+# «Этот год считается ...», «Это событие ...» - о том же, что предыдущее предложение
+DEMONSTRATIVE_RE = re.compile(r"^(?:Эт(?:от|а|о|и)|В\s+эт(?:ом|от|у)|Тогда)\b")
+
+# Вопросительные и служебные слова вопроса не учитываются при сравнении
+QUESTION_WORDS = STOP_WORDS | {"кем", "кого", "кому", "звали", "числа", "веке", "век", "годы", "год"}
+
+
+class ExtractiveAnswerer:
+    """Короткий ответ (дата или имя) с цитатой из учебника и уверенностью 0..1"""
+
+    def __init__(self, expander: LocalQueryExpander):
+        self.expander = expander
+        self.normalizer = expander.normalizer
+
+    @staticmethod
+    def classify(query: str) -> Optional[str]:
+        """date | person | None (вопрос не для извлечения)"""
+        if DATE_QUESTION_RE.match(query):
+            return "date"
+        if PERSON_QUESTION_RE.match(query):
+            return "person"
+        return None
+
+    def _query_terms(self, query: str) -> Dict[str, float]:
+        """Основы значимых слов вопроса и их вес: имена и названия (с заглавной) - двойной"""
+        terms: Dict[str, float] = {}
+        for i, match in enumerate(WORD_RE.finditer(query)):
+            word = match.group(0)
+            if len(word) <= 2 or word.lower() in QUESTION_WORDS:
+                continue
+            weight = 2.0 if i > 0 and word[0].isupper() else 1.0
+            stem = self.normalizer.stem(word)
+            terms[stem] = max(terms.get(stem, 0.0), weight)
+        return terms
+
+    @staticmethod
+    def _same_stem(a: str, b: str) -> bool:
+        """Основы одного слова: одна продолжает другую или общее начало от 4 букв (афинян/афинск)"""
+        if a.startswith(b) or b.startswith(a):
+            return True
+        prefix = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            prefix += 1
+        return prefix >= 4
+
+    def _matched(self, sentence: str, terms: Dict[str, float]) -> set:
+        stems = {self.normalizer.stem(w) for w in WORD_RE.findall(sentence.lower()) if len(w) > 2}
+        return {term for term in terms if any(self._same_stem(term, s) for s in stems)}
+
+    @staticmethod
+    def _sentences(text: str) -> List[str]:
+        """
+        Предложения фрагмента. «В 49 году до н. э. Цезарь перешел Рубикон» -
+        одно предложение, хотя split_sentences режет после «н. э.» перед заглавной.
+        """
+        merged: List[str] = []
+        for sentence in split_sentences(text.replace(" … ", " ")):
+            if merged and ABBREVIATION_END_RE.search(merged[-1]):
+                merged[-1] += " " + sentence
+            else:
+                merged.append(sentence)
+        return merged
+
+    # ---------- КАНДИДАТЫ ----------
+
+    @staticmethod
+    def _date_candidates(sentence: str, century: bool) -> List[Tuple[str, str]]:
+        """[(ключ для голосования, текст ответа)]"""
+        found = []
+        if century:
+            for m in CENTURY_RE.finditer(sentence):
+                era = " до н. э." if m.group(3) else ""
+                span = m.group(1) + (f"-{m.group(2)}" if m.group(2) else "")
+                found.append((f"c{span}{era}", f"{span} в.{era}"))
+            return found
+
+        for m in YEAR_RE.finditer(sentence):
+            day, month, year, year_end, marker, era = m.groups()
+            if not marker and not era and not (BARE_YEAR_RANGE[0] <= int(year) <= BARE_YEAR_RANGE[1]):
+                continue  # «300 спартанцев», «12 легионов»
+            era = " до н. э." if era else ""
+            span = year + (f"-{year_end}" if year_end else "")
+            suffix = " гг." if year_end else " г."
+            text = (f"{day} {month} " if day else "") + span + suffix + era
+            found.append((f"y{span}{era}", text))
+        return found
+
+    def _person_candidates(self, sentence: str, terms: Dict[str, float]) -> List[Tuple[str, str]]:
+        found = []
+        taken = []
+        for regex in (NAME_RE, CAPITALIZED_RE):
+            for m in regex.finditer(sentence):
+                if any(start <= m.start() < end for start, end in taken):
+                    continue
+                tokens = m.group(0).split()
+                if _at_sentence_start(sentence, m.start()) and not self.expander.is_entity(tokens[0]):
+                    tokens = tokens[1:]  # «Тогда Брут ...» - первое слово предложения
+                if not tokens or not any(self.normalizer.is_person_name(t) for t in tokens):
+                    continue
+                stems = [self.normalizer.stem(t) for t in tokens]
+                if any(self._same_stem(term, stem) for term in terms for stem in stems):
+                    continue  # о ком (чем) спрашивают, тот не ответ
+                taken.append((m.start(), m.end()))
+                surface = " ".join(tokens)
+                # Полное имя из словаря учебника: «Брутом» -> «Марк Юний Брут»
+                canonical = self.expander.canonical_names(tokens[-1], limit=1)
+                if canonical and not any(
+                        self._same_stem(term, self.normalizer.stem(t))
+                        for term in terms for t in canonical[0].split()):
+                    found.append((canonical[0], canonical[0], surface))
+                else:
+                    found.append((" ".join(stems), surface, surface))
+        return found
+
+    # ---------- ОТВЕТ ----------
+
+    def answer(self, query: str, passages: List[Dict]) -> Optional[Dict[str, Any]]:
+        """
+        passages - найденные фрагменты (content, metadata) в порядке релевантности.
+        Возвращает {answer, short_answer, type, confidence, sentence, metadata} или None.
+        """
+        kind = self.classify(query)
+        terms = self._query_terms(query)
+        if kind is None or not terms or not passages:
+            return None
+        century = kind == "date" and bool(CENTURY_QUESTION_RE.search(query))
+        total_weight = sum(terms.values())
+
+        # ключ -> {score, text, surface, best: (полнота, предложение, метаданные)}
+        candidates: Dict[str, Dict[str, Any]] = {}
+        for rank, passage in enumerate(passages):
+            rank_weight = 1.0 / (1.0 + 0.5 * rank)
+            sentences = self._sentences(passage["content"])
+            matched = [self._matched(sentence, terms) for sentence in sentences]
+            for i, sentence in enumerate(sentences):
+                # Слова вопроса в соседних предложениях - с половинным весом;
+                # «Этот год считается концом ...» относится к предыдущему целиком
+                credit = {term: 1.0 for term in matched[i]}
+                neighbours = []
+                if i > 0:
+                    neighbours.append((matched[i - 1], 0.5))
+                if i + 1 < len(sentences):
+                    neighbours.append((matched[i + 1], 1.0 if DEMONSTRATIVE_RE.match(sentences[i + 1]) else 0.5))
+                for neighbour, weight in neighbours:
+                    for term in neighbour:
+                        credit[term] = max(credit.get(term, 0.0), weight)
+                coverage = sum(terms[term] * value for term, value in credit.items()) / total_weight
+                if not coverage:
+                    continue
+
+                if kind == "date":
+                    found = [(key, text, text) for key, text in self._date_candidates(sentence, century)]
+                else:
+                    found = self._person_candidates(sentence, terms)
+                for key, text, surface in {item[0]: item for item in found}.values():
+                    candidate = candidates.setdefault(
+                        key, {"score": 0.0, "text": text, "surface": surface, "best": (0.0, "", {})}
+                    )
+                    candidate["score"] += coverage * rank_weight
+                    if coverage > candidate["best"][0]:
+                        candidate["best"] = (coverage, sentence, passage["metadata"])
+                        candidate["surface"] = surface
+                    if len(text) > len(candidate["text"]):
+                        candidate["text"] = text  # дата с числом и месяцем полнее
+
+        if not candidates:
+            return None
+
+        ranked = sorted(candidates.values(), key=lambda c: c["score"], reverse=True)
+        top = ranked[0]
+        coverage, sentence, metadata = top["best"]
+        # Перечисление в одном предложении - один ответ: «Марк Брут и Гай Кассий»
+        winners = [top]
+        if kind == "person":
+            for candidate in ranked[1:]:
+                joined = re.escape(winners[-1]["surface"]) + r"\s*(?:,|и)\s*" + re.escape(candidate["surface"])
+                if candidate["best"][1] == sentence and re.search(joined, sentence):
+                    winners.append(candidate)
+        rest = [c for c in ranked if c not in winners]
+        runner_up = rest[0]["score"] if rest else 0.0
+        margin = top["score"] / (top["score"] + runner_up)
+        confidence = round(coverage * margin, 3)
+
+        short = " и ".join(c["text"] for c in winners)
+        page = metadata.get("page_number", "?")
+        return {
+            "answer": f"{short}\n\nПо учебнику: «{sentence}» (стр. {page})",
+            "short_answer": short,
+            "type": kind,
+            "confidence": confidence,
+            "sentence": sentence,
+            "metadata": metadata
+        }
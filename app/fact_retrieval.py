@@ -1,11 +1,31 @@
 # app/fact_retrieval.py
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from functools import lru_cache
 import re
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
 
-from .database import Chunk, get_db
+from .database import Chunk, SessionLocal
 from .vector_store import VectorStore
+from .text_matching import LIKE_ESCAPE, get_matcher, like_pattern, normalize_term
+from .tracing import span
+
+NAME_RE = re.compile(r"[А-ЯЁ][а-яё]+")
+YEAR_RE = re.compile(r"\b\d{3,4}\b")
+
+
+@lru_cache(maxsize=4096)
+def _extract_entities(query: str) -> Tuple[str, ...]:
+    # Имена собственные (Цезарь, Наполеон, Сталин)
+    names = NAME_RE.findall(query)
+
+    # Даты
+    years = YEAR_RE.findall(query)
+
+    # Ключевые слова
+    keywords = [word for word in query.lower().split() if len(word) > 4]
+
+    return tuple(sorted(set(names + years + keywords)))
 
 
 class FactRetrievalEngine:
@@ -23,51 +43,41 @@ class FactRetrievalEngine:
         """
         Простейший NER:
         Ищет имена собственные, даты, ключевые слова.
+        Результат кэшируется по тексту запроса.
         """
-        # Имена собственные (Цезарь, Наполеон, Сталин)
-        names = re.findall(r"[А-ЯЁ][а-яё]+", query)
-
-        # Даты
-        years = re.findall(r"\b\d{3,4}\b", query)
-
-        # Ключевые слова
-        keywords = []
-        for word in query.lower().split():
-            if len(word) > 4:
-                keywords.append(word)
-
-        entities = list(set(names + years + keywords))
-        return entities
+        return list(_extract_entities(query))
 
     # ---------- SQL LEXICAL SEARCH ----------
 
-    def sql_lexical_search(self, db: Session, entities: List[str], limit: int = 50) -> List[Chunk]:
+    def sql_lexical_search(self, db: Session, entities: List[str], limit: int = 50,
+                           scope: Optional[Dict[str, str]] = None) -> List[Chunk]:
         """
-        Жёсткий поиск по SQL (LIKE)
+        Жёсткий поиск по SQL (LIKE по нормализованной колонке search_text)
         """
-        if not entities:
+        terms = [t for t in dict.fromkeys(normalize_term(ent) for ent in entities) if t]
+        if not terms:
             return []
 
-        filters = []
-        for ent in entities:
-            filters.append(Chunk.content.ilike(f"%{ent}%"))
+        filters = [Chunk.search_text.like(like_pattern(term), escape=LIKE_ESCAPE) for term in terms]
 
-        results = (
-            db.query(Chunk)
-            .filter(or_(*filters))
-            .limit(limit)
-            .all()
-        )
+        with span("lexical_query"):
+            results = (
+                db.query(Chunk)
+                .filter(or_(*filters), *self.vs.scope_filters(scope))
+                .limit(limit)
+                .all()
+            )
 
         return results
 
     # ---------- SEMANTIC SEARCH ----------
 
-    def semantic_search(self, query: str, n_results: int = 20) -> List[Dict[str, Any]]:
+    def semantic_search(self, query: str, n_results: int = 20,
+                        scope: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
         """
         Поиск по векторному хранилищу
         """
-        results = self.vs.search(query, n_results=n_results)
+        results = self.vs.search(query, n_results=n_results, scope=scope)
 
         chunks = []
 
@@ -97,6 +107,11 @@ class FactRetrievalEngine:
         """
         merged = []
 
+        # Все сущности - одним скомпилированным матчером; дубли после lower()
+        # сохраняются, чтобы вес совпадал с поштучной проверкой
+        entities_lower = [ent.lower() for ent in entities]
+        matcher = get_matcher(entities_lower)
+
         # SQL chunks -> dict
         sql_map = {}
         for ch in sql_chunks:
@@ -113,9 +128,8 @@ class FactRetrievalEngine:
                 score = 0
 
                 # Entity score
-                for ent in entities:
-                    if ent.lower() in text.lower():
-                        score += 2
+                found = matcher.scan(text.lower())
+                score += 2 * sum(1 for ent in entities_lower if ent in found)
 
                 # Distance score
                 score += max(0, 1 - sem["distance"])
@@ -146,20 +160,29 @@ class FactRetrievalEngine:
 
     # ---------- MAIN PIPELINE ----------
 
-    def retrieve(self, query: str) -> List[Dict[str, Any]]:
+    def retrieve(self, query: str, db: Optional[Session] = None,
+                 scope: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
         """
-        Главный метод retrieval
+        Главный метод retrieval.
+        db - сессия запроса; если не передана, открывается своя.
+        scope - область поиска (документ, глава, параграф).
         """
-        db = get_db()
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
         try:
             entities = self.extract_entities(query)
+            # Основы слов и части имен из словаря - находят другие падежи и формы имени
+            entities += self.vs.query_expander.keyword_variants(entities)
 
-            sql_chunks = self.sql_lexical_search(db, entities, limit=50)
-            semantic_chunks = self.semantic_search(query, n_results=20)
+            sql_chunks = self.sql_lexical_search(db, entities, limit=50, scope=scope)
+            semantic_chunks = self.semantic_search(query, n_results=20, scope=scope)
 
-            merged = self.merge_results(sql_chunks, semantic_chunks, entities)
+            with span("merge"):
+                merged = self.merge_results(sql_chunks, semantic_chunks, entities)
 
             return merged
 
         finally:
-            db.close()
+            if own_session:
+                db.close()
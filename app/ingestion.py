@@ -0,0 +1,104 @@
+# app/ingestion.py
+from typing import List, Dict, Any
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from .config import SENTENCE_INDEX
+from .database import Document, Chunk, EntityAlias
+from .outline import build_document_outline
+from .query_expansion import mine_aliases
+from .text_matching import normalize_search_text
+from .tracing import span
+from .vector_store import VectorStore
+
+
+def ingest_chunks(
+    db: Session,
+    vector_store: VectorStore,
+    filename: str,
+    file_path: str,
+    chunks: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Записывает обработанный документ: строка документа, чанки (bulk insert),
+    оглавление и словарь имен - одной транзакцией, затем векторы с заранее
+    назначенными ID, центроиды разделов и индекс предложений документа.
+
+    При сбое на этапе векторов документ остается в статусе partial (ошибка - в error)
+    и доиндексируется командой: python -m app.consistency resume
+    """
+    with span("sql_write"):
+        document = Document(
+            filename=filename,
+            file_path=file_path,
+            total_chunks=len(chunks),
+            status="processing",
+            aliases_mined=True
+        )
+        db.add(document)
+        db.flush()  # получаем document.id, не завершая транзакцию
+
+        # ID эмбеддингов назначаем до записи - без UPDATE по каждому чанку
+        embedding_ids = [
+            vector_store.make_embedding_id(document.id, chunk_data["chunk_index"])
+            for chunk_data in chunks
+        ]
+
+        if chunks:
+            db.execute(insert(Chunk), [
+                {
+                    "doc_id": document.id,
+                    "content": chunk_data["content"],
+                    "search_text": normalize_search_text(chunk_data["content"]),
+                    "page_number": chunk_data.get("page_number", 1),
+                    "chapter": chunk_data.get("chapter", ""),
+                    "paragraph": chunk_data.get("paragraph", ""),
+                    "section_title": chunk_data.get("section_title", ""),
+                    "chunk_index": chunk_data["chunk_index"],
+                    "embedding_id": emb_id
+                }
+                for chunk_data, emb_id in zip(chunks, embedding_ids)
+            ])
+
+            # chunks.id - ссылка из векторного индекса на текст чанка
+            chunk_ids = dict(db.execute(
+                select(Chunk.chunk_index, Chunk.id).where(Chunk.doc_id == document.id)
+            ).all())
+            chunks = [dict(chunk_data, id=chunk_ids[chunk_data["chunk_index"]]) for chunk_data in chunks]
+
+        # Оглавление и словарь имен строим в той же транзакции
+        build_document_outline(db, document.id)
+        aliases = mine_aliases(
+            [chunk_data["content"] for chunk_data in chunks],
+            vector_store.query_expander.normalizer
+        )
+        if aliases:
+            db.execute(insert(EntityAlias), [dict(row, doc_id=document.id) for row in aliases])
+        db.commit()
+
+    vector_store.query_expander.add_aliases(aliases)
+
+    # Документ и чанки уже в SQLite: сбой векторов не откатывается, а оставляет
+    # документ в статусе partial для python -m app.consistency resume
+    added_ids: List[str] = []
+    error = None
+    try:
+        added_ids = vector_store.add_chunks(chunks, document.id, ids=embedding_ids)
+        vector_store.index_sections(document.id)
+        if SENTENCE_INDEX:
+            expected = sum(len(vector_store.indexable_sentences(c["content"])) for c in chunks)
+            written = vector_store.add_sentences(chunks, document.id, ids=embedding_ids)
+            if written < expected:
+                error = f"Предложений в индексе: {written}/{expected}"
+    except Exception as e:
+        print(f"❌ Индексация векторов документа {document.id} прервана: {e}")
+        error = str(e)
+    document.status = "indexed" if error is None and len(added_ids) == len(chunks) else "partial"
+    db.commit()
+
+    return {
+        "document": document,
+        "indexed_chunks": len(added_ids),
+        "error": error
+    }
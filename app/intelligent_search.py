@@ -1,7 +1,62 @@
 # intelligent_search.py
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
+import re
+import threading
 import time
 
+from .config import (
+    EXPANSION_MAX_DISTANCE, EXPANSION_MIN_AGREEMENT,
+    EXPANSION_AGREEMENT_TOP, EXPANSION_CACHE_SIZE, QUERY_EXPANSION_MODE,
+    LLM_ROUTES, SENTENCE_INDEX, EXTRACTIVE_ANSWERS, EXTRACTIVE_MIN_CONFIDENCE,
+    ASK_BATCH_CONCURRENCY
+)
+from .context_builder import ContextBuilder
+from .extractive_answerer import ExtractiveAnswerer
+from .tracing import span
+
+# Все промпты начинаются с одного и того же системного сообщения, затем идут
+# неизменные инструкции задачи и только в конце - вопрос и фрагменты.
+# Ollama переиспользует KV-кэш для совпадающего начала промпта, поэтому
+# общий префикс не пересчитывается от запроса к запросу.
+SYSTEM_PROMPT = """Ты - помощник по учебнику истории.
+Отвечай кратко, по-русски, строго по тексту учебника и без вступлений."""
+
+EXPAND_PROMPT = """Переформулируй вопрос в 3 разных варианта для поиска в учебнике истории.
+Сохрани смысл, но используй разные формулировки. Выведи только варианты.
+
+Пример:
+Вопрос: "Как умер Цезарь?"
+Варианты:
+- смерть Гая Юлия Цезаря
+- убийство Цезаря
+- обстоятельства гибели Цезаря
+
+Исходный вопрос: {query}
+Варианты:"""
+
+ANSWER_PROMPT = """Ответь на вопрос по фрагментам учебника.
+Используй ТОЛЬКО информацию из текста.
+Если точного ответа нет, но есть связанная информация - напиши что нашел.
+Если информации нет совсем - скажи "Информация отсутствует в учебнике".
+
+Фрагменты учебника:
+{context}
+
+Вопрос: {query}
+
+Ответ:"""
+
+# Фактологический вопрос: ответ - имя, дата, место или число из одного-двух предложений
+FACT_QUESTION_RE = re.compile(
+    r"^\s*(?:кто|кого|кем|кому|когда|где|куда|откуда|сколько|"
+    r"в\s+как(?:ом|ой|ие)\s+(?:году|веке|веков|городе|месте|битве|стране)|"
+    r"как\s+звали|какого\s+числа|как(?:ой|ая|ое)\s+(?:год|век|город|дата))\b",
+    re.IGNORECASE
+)
+
 class IntelligentSearch:
     """
     Интеллектуальный поиск с пониманием контекста через LLM
@@ -10,30 +65,66 @@ class IntelligentSearch:
     def __init__(self, vector_store, llm_client):
         self.vs = vector_store
         self.llm = llm_client
+        # Кэш расширений: нормализованный запрос -> варианты без оригинала
+        self._expansion_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._expansion_lock = threading.Lock()
+        self.expansion_stats = {"skipped": 0, "cached": 0, "expanded": 0}
+        self.answer_stats = {"extractive": 0, "llm": 0}
+        self.context_builder = ContextBuilder(vector_store.query_expander.normalizer)
+        self.extractive = ExtractiveAnswerer(vector_store.query_expander)
+    
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Ключ кэша: регистр, ё, пунктуация и лишние пробелы не важны"""
+        text = query.lower().replace("ё", "е")
+        text = re.sub(r"[^\w\s]", " ", text)
+        return " ".join(text.split())
+    
+    def expand_query(self, query: str, mode: str = QUERY_EXPANSION_MODE) -> List[str]:
+        """
+        Варианты запроса (оригинал - первым) по режиму:
+        llm - переформулировки Ollama, local - словарь имен и морфология, hybrid - оба.
+        """
+        variants = [query]
+        if mode in ("local", "hybrid"):
+            variants += self.vs.query_expander.expand(query)
+        if mode in ("llm", "hybrid"):
+            variants += self.expand_query_llm_cached(query)[1:]
+        return list(dict.fromkeys(variants))
+    
+    def expand_query_llm_cached(self, query: str) -> List[str]:
+        """
+        Расширение запроса через LLM с кэшем по нормализованной формулировке.
+        Неудачные расширения (только оригинал) не кэшируются.
+        """
+        key = self.normalize_query(query)
+        with self._expansion_lock:
+            cached = self._expansion_cache.get(key)
+            if cached is not None:
+                self._expansion_cache.move_to_end(key)
+                self.expansion_stats["cached"] += 1
+                return [query] + cached
+        
+        variants = self.expand_query_with_llm(query)
+        with self._expansion_lock:
+            self.expansion_stats["expanded"] += 1
+            if len(variants) > 1:
+                self._expansion_cache[key] = variants[1:]
+                self._expansion_cache.move_to_end(key)
+                while len(self._expansion_cache) > EXPANSION_CACHE_SIZE:
+                    self._expansion_cache.popitem(last=False)
+        return variants
     
     def expand_query_with_llm(self, query: str) -> List[str]:
         """
         Использует LLM для интеллектуального расширения запроса
         """
-        prompt = f"""Переформулируй вопрос в 3 разных варианта для поиска в учебнике истории.
-Сохрани смысл, но используй разные формулировки.
-
-Исходный вопрос: {query}
-
-Пример:
-Вопрос: "Как умер Цезарь?"
-Варианты:
-- смерть Гая Юлия Цезаря
-- убийство Цезаря
-- обстоятельства гибели Цезаря
-
-Теперь для твоего вопроса:"""
-
         try:
             response = self.llm.generate(
-                prompt=prompt,
-                system_message="Ты помогаешь улучшить поиск. Отвечай кратко, только варианты.",
-                temperature=0.3
+                prompt=EXPAND_PROMPT.format(query=query),
+                system_message=SYSTEM_PROMPT,
+                temperature=0.3,
+                task="expand"
             )
             
             # Парсим ответ
@@ -53,40 +144,94 @@ class IntelligentSearch:
             print(f"⚠️ Ошибка расширения запроса: {e}")
             return [query]
     
-    def intelligent_search(self, query: str, n_results: int = 3) -> List[Dict]:
+    @staticmethod
+    def _chunk_key(meta: Dict[str, Any]) -> Tuple[str, str]:
+        return str(meta.get('doc_id', '')), str(meta.get('chunk_index', meta.get('id', '')))
+    
+    def _collect(self, results: Optional[Dict], variant: str,
+                 all_results: List[Dict], seen_chunks: set):
+        """Добавляет результаты векторного поиска, пропуская уже найденные чанки"""
+        if not results or not results.get('documents'):
+            return
+        for i, doc in enumerate(results['documents'][0]):
+            meta = results['metadatas'][0][i]
+            chunk_key = self._chunk_key(meta)
+            if chunk_key in seen_chunks:
+                continue
+            seen_chunks.add(chunk_key)
+            all_results.append({
+                'content': doc,
+                'metadata': meta,
+                'distance': results['distances'][0][i] if results.get('distances') else 1.0,
+                'query': variant
+            })
+    
+    def is_confident(self, query: str, results: List[Dict],
+                     scope: Optional[Dict[str, str]] = None,
+                     lexical: Optional[List[Dict]] = None) -> bool:
         """
-        Интеллектуальный поиск с переформулировкой запроса
+        Достаточно ли результатов исходного запроса, чтобы не звать LLM:
+        лучший чанк достаточно близок, либо лексический поиск подтверждает
+        заметную часть векторного топа.
+        lexical - готовый лексический топ (answer_batch), иначе - запрос к SQLite.
         """
-        # 1. Получаем разные формулировки того же вопроса
-        variants = self.expand_query_with_llm(query)
-        print(f"🔄 Варианты запроса: {variants}")
+        if not results:
+            return False
+        if results[0]['distance'] <= EXPANSION_MAX_DISTANCE:
+            return True
         
-        # 2. Ищем по каждому варианту
+        top = EXPANSION_AGREEMENT_TOP
+        if lexical is None:
+            keywords = self.vs._extract_keywords(query)
+            lexical = self.vs._keyword_search_sql(keywords, top, scope=scope)
+        if not lexical:
+            return False
+        vector_keys = {self._chunk_key(r['metadata']) for r in results[:top]}
+        lexical_keys = {self._chunk_key(r['metadata']) for r in lexical[:top]}
+        agreement = len(vector_keys & lexical_keys) / min(top, len(vector_keys))
+        return agreement >= EXPANSION_MIN_AGREEMENT
+    
+    def intelligent_search(self, query: str, n_results: int = 3,
+                           scope: Optional[Dict[str, str]] = None,
+                           initial: Optional[Dict] = None,
+                           lexical: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Двухфазный поиск: сначала исходный запрос; переформулировки через LLM -
+        только если найденное неубедительно.
+        scope - область поиска (документ, глава, параграф).
+        initial / lexical - уже найденное по исходному запросу (n_results * 2 чанков
+        векторного поиска и лексический топ) при пакетной обработке.
+        """
         all_results = []
         seen_chunks = set()
         
-        for variant in variants:
-            # Векторный поиск
-            results = self.vs.search(variant, n_results=n_results * 2)
-            
-            if results and results.get('documents'):
-                for i, doc in enumerate(results['documents'][0]):
-                    # Создаем уникальный ID для чанка
-                    meta = results['metadatas'][0][i]
-                    chunk_id = f"{meta.get('doc_id', '')}_{meta.get('page_number', '')}_{i}"
-                    
-                    if chunk_id not in seen_chunks:
-                        seen_chunks.add(chunk_id)
-                        all_results.append({
-                            'content': doc,
-                            'metadata': meta,
-                            'distance': results['distances'][0][i] if results.get('distances') else 1.0,
-                            'query': variant
-                        })
-        
-        # 3. Сортируем по близости (меньше расстояние = лучше)
+        # 1. Исходный запрос
+        results = initial if initial is not None else self.vs.search(query, n_results=n_results * 2, scope=scope)
+        self._collect(results, query, all_results, seen_chunks)
         all_results.sort(key=lambda x: x['distance'])
         
+        with span("confidence"):
+            confident = self.is_confident(query, all_results, scope, lexical=lexical)
+        
+        if confident:
+            with self._expansion_lock:
+                self.expansion_stats["skipped"] += 1
+            return all_results[:n_results]
+        
+        # 2. Разные формулировки того же вопроса
+        with span("expand"):
+            variants = self.expand_query(query)
+        print(f"🔄 Варианты запроса: {variants}")
+        
+        # 3. Ищем по каждому новому варианту
+        for variant in variants[1:]:
+            results = self.vs.search(variant, n_results=n_results * 2, scope=scope)
+            self._collect(results, variant, all_results, seen_chunks)
+        
+        # 4. Сортируем по близости (меньше расстояние = лучше)
+        with span("merge"):
+            all_results.sort(key=lambda x: x['distance'])
+        
         return all_results[:n_results]
     
     def extract_answer(self, query: str, chunks: List[Dict]) -> str:
@@ -96,56 +241,107 @@ class IntelligentSearch:
         if not chunks:
             return "Информация не найдена"
         
-        # Собираем контекст
-        context_parts = []
-        for i, chunk in enumerate(chunks[:3]):  # Максимум 3 чанка
-            page = chunk['metadata'].get('page_number', '?')
-            text = chunk['content'][:1000]  # Ограничиваем длину
-            context_parts.append(f"[Страница {page}]\n{text}")
-        
-        context = "\n\n---\n\n".join(context_parts)
+        # Собираем контекст по бюджету токенов: промпт + ответ должны поместиться в num_ctx
+        template = ANSWER_PROMPT.format(query=query, context="")
+        route = LLM_ROUTES["answer"]
+        budget = self.context_builder.budget_for(
+            self.context_builder.tokens.count(template) + self.context_builder.tokens.count(SYSTEM_PROMPT),
+            num_ctx=route["num_ctx"], num_predict=route["num_predict"]
+        )
+        with span("context"):
+            packed = self.context_builder.build(query, chunks, budget)
         
-        prompt = f"""Прочитай фрагменты учебника и ответь на вопрос.
-
-Вопрос: {query}
-
-Фрагменты учебника:
-{context}
-
-Ответь на вопрос, используя ТОЛЬКО информацию из текста.
-Если точного ответа нет, но есть связанная информация - напиши что нашел.
-Если информации нет совсем - скажи "Информация отсутствует в учебнике".
-
-Ответ:"""
+        prompt = ANSWER_PROMPT.format(query=query, context=packed["context"])
         
         try:
-            answer = self.llm.generate(
-                prompt=prompt,
-                system_message="Ты отвечаешь строго по тексту учебника.",
-                temperature=0.0
-            )
+            with span("generate"):
+                answer = self.llm.generate(
+                    prompt=prompt,
+                    system_message=SYSTEM_PROMPT,
+                    temperature=0.0,
+                    task="answer"
+                )
             return answer.strip()
         except Exception as e:
             print(f"⚠️ Ошибка извлечения ответа: {e}")
             # Возвращаем первый чанк как запасной вариант
             return chunks[0]['content'][:300] + "..."
     
-    def answer_question(self, query: str) -> Dict[str, Any]:
+    @staticmethod
+    def is_fact_question(query: str) -> bool:
+        return bool(FACT_QUESTION_RE.match(query))
+    
+    def answer_question(self, query: str, scope: Optional[Dict[str, str]] = None,
+                        passages: Optional[List[Dict]] = None,
+                        initial: Optional[Dict] = None,
+                        lexical: Optional[List[Dict]] = None) -> Dict[str, Any]:
         """
-        Полный цикл ответа на вопрос
+        Полный цикл ответа на вопрос (scope - область поиска).
+        На фактологический вопрос в промпт идут найденные предложения
+        с соседями (индекс предложений), а не чанки целиком; дату или имя
+        из этих предложений можно взять и без LLM (ExtractiveAnswerer).
+        passages / initial / lexical - результаты пакетного поиска (answer_batch).
         """
         start_time = time.time()
         
-        # 1. Интеллектуальный поиск
-        chunks = self.intelligent_search(query, n_results=3)
+        # 1. Small-to-big: точные предложения и окно вокруг них из родительских чанков
+        if passages is None:
+            passages = []
+            if SENTENCE_INDEX and self.is_fact_question(query):
+                with span("sentence_search"):
+                    passages = self.vs.search_sentences(query, scope=scope)
         
-        # 2. Извлечение ответа
-        answer = self.extract_answer(query, chunks)
+        # 2. Быстрый путь: уверенно извлеченная дата или имя - без расширения и генерации
+        extracted = self.answer_extractive(query, passages, start_time)
+        if extracted:
+            return extracted
         
-        # 3. Подготовка источников
+        return self._answer_llm(query, scope, passages, initial, lexical, start_time)
+    
+    def answer_extractive(self, query: str, passages: List[Dict],
+                          start_time: float) -> Optional[Dict[str, Any]]:
+        """Ответ без LLM по найденным предложениям или None, если извлечение неуверенно"""
+        if not (EXTRACTIVE_ANSWERS and passages):
+            return None
+        with span("extractive"):
+            extracted = self.extractive.answer(query, passages)
+        if not extracted or extracted["confidence"] < EXTRACTIVE_MIN_CONFIDENCE:
+            return None
+        with self._expansion_lock:
+            self.answer_stats["extractive"] += 1
+        meta = extracted["metadata"]
+        return {
+            'answer': extracted["answer"],
+            'sources': [{
+                'doc_id': meta.get('doc_id'),
+                'page': meta.get('page_number'),
+                'chapter': meta.get('chapter'),
+                'paragraph': meta.get('paragraph'),
+                'text_preview': extracted["sentence"]
+            }],
+            'confidence': extracted["confidence"],
+            'processing_time': time.time() - start_time,
+            'mode': 'extractive'
+        }
+    
+    def _answer_llm(self, query: str, scope: Optional[Dict[str, str]], passages: List[Dict],
+                    initial: Optional[Dict], lexical: Optional[List[Dict]],
+                    start_time: float) -> Dict[str, Any]:
+        """Ответ модели: интеллектуальный поиск, затем генерация по найденному"""
+        # 3. Интеллектуальный поиск
+        chunks = self.intelligent_search(query, n_results=3, scope=scope, initial=initial, lexical=lexical)
+        context_chunks = passages or chunks
+        
+        # 4. Извлечение ответа
+        answer = self.extract_answer(query, context_chunks)
+        with self._expansion_lock:
+            self.answer_stats["llm"] += 1
+        
+        # 5. Подготовка источников
         sources = []
-        for chunk in chunks[:2]:  # Топ-2 источника
+        for chunk in context_chunks[:2]:  # Топ-2 источника
             sources.append({
+                'doc_id': chunk['metadata'].get('doc_id'),
                 'page': chunk['metadata'].get('page_number'),
                 'chapter': chunk['metadata'].get('chapter'),
                 'paragraph': chunk['metadata'].get('paragraph'),
@@ -158,5 +354,83 @@ class IntelligentSearch:
             'answer': answer,
             'sources': sources,
             'confidence': 1.0 - chunks[0]['distance'] if chunks else 0,
-            'processing_time': processing_time
-        }
\ No newline at end of file
+            'processing_time': processing_time,
+            'mode': 'llm'
+        }
+    
+    def answer_batch(self, queries: List[str], scope: Optional[Dict[str, str]] = None,
+                     concurrency: int = ASK_BATCH_CONCURRENCY) -> Iterator[Tuple[int, Any]]:
+        """
+        Ответы на список вопросов по одной области поиска.
+        Поиск - пакетами: эмбеддинги всех вопросов одним вызовом модели, предложения -
+        одним запросом к ChromaDB на весь список. Извлеченные без LLM ответы отдаются
+        сразу; для остальных вопросов - пакетный векторный поиск чанков и лексический
+        топ (только там, где без него не решить, нужно ли расширение), затем ответ
+        модели в пуле из concurrency потоков (трасса запроса - в контексте потока).
+        Отдает (номер вопроса, ответ или исключение) по мере готовности.
+        """
+        if not queries:
+            return
+        start_time = time.time()
+        
+        with span("batch_retrieval"):
+            embeddings = self.vs.embed_queries(queries)
+            
+            fact = [i for i, query in enumerate(queries) if SENTENCE_INDEX and self.is_fact_question(query)]
+            passages: List[List[Dict]] = [[] for _ in queries]
+            found = self.vs.search_sentences_batch(
+                [queries[i] for i in fact], scope=scope, embeddings=[embeddings[i] for i in fact]
+            )
+            for i, items in zip(fact, found):
+                passages[i] = items
+        
+        pending = []
+        for i, query in enumerate(queries):
+            try:
+                extracted = self.answer_extractive(query, passages[i], start_time)
+            except Exception as e:
+                yield i, e
+                continue
+            if extracted:
+                yield i, extracted
+            else:
+                pending.append(i)
+        if not pending:
+            return
+        
+        with span("batch_retrieval"):
+            # n_results * 2 при n_results = 3, как в answer_question
+            found = self.vs.search_batch(
+                [queries[i] for i in pending], n_results=6, scope=scope,
+                embeddings=[embeddings[i] for i in pending]
+            )
+            initial = {i: results or {} for i, results in zip(pending, found)}
+            
+            # Лексический топ нужен is_confident, только если лучший чанк не прошел порог расстояния
+            uncertain = [
+                i for i in pending
+                if initial[i].get('distances') and initial[i]['distances'][0]
+                and min(initial[i]['distances'][0]) > EXPANSION_MAX_DISTANCE
+            ]
+            lexical = dict(zip(uncertain, self.vs._keyword_search_sql_batch(
+                [self.vs._extract_keywords(queries[i]) for i in uncertain], EXPANSION_AGREEMENT_TOP, scope=scope
+            ))) if uncertain else {}
+        
+        # Без with: клиент отключился - генератор закрыт, ждать очередь вызовов LLM незачем
+        pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        try:
+            # Своя копия контекста на задачу: один Context нельзя войти из двух потоков.
+            # processing_time - от начала пакета, как у /ask: с поиском и очередью
+            futures = {
+                pool.submit(contextvars.copy_context().run, self._answer_llm, queries[i], scope,
+                            passages[i], initial[i], lexical.get(i), start_time): i
+                for i in pending
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    yield i, future.result()
+                except Exception as e:
+                    yield i, e
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
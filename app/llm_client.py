@@ -1,22 +1,85 @@
 import requests
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+import threading
 import time
 
+from .config import (
+    LLM_NUM_CTX, LLM_NUM_PREDICT, LLM_KEEP_ALIVE, LLM_ROUTES, LLM_REQUEST_TIMEOUT,
+    LLM_FAILOVER_MODEL, LLM_FAILOVER_QUEUE_LATENCY, LLM_QUEUE_EWMA_ALPHA, LLM_FAILOVER_COOLDOWN
+)
+from .tracing import metrics
+
+# Длительности в ответе Ollama (наносекунды) -> метрики в секундах
+OLLAMA_DURATIONS = {
+    "load_duration": "llm_load_duration_seconds",
+    "prompt_eval_duration": "llm_prompt_eval_duration_seconds",
+    "eval_duration": "llm_eval_duration_seconds",
+    "total_duration": "llm_total_duration_seconds",
+}
+
+
+class QueueLatency:
+    """
+    Сглаженное (EWMA) ожидание в очереди Ollama для одной модели и состояние
+    переключения: пока модель перегружена, запросы идут на запасную, а после
+    паузы один запрос пробует основную - его замер заменяет старое среднее.
+    """
+
+    def __init__(self, alpha: float = LLM_QUEUE_EWMA_ALPHA):
+        self.alpha = alpha
+        self.ewma: Optional[float] = None
+        self.failover_until = 0.0
+        self.probe_started = 0.0
+
+    def observe(self, seconds: float):
+        if self.ewma is None or self.probe_started:
+            self.ewma = seconds
+            self.probe_started = 0.0
+        else:
+            self.ewma = self.alpha * seconds + (1 - self.alpha) * self.ewma
+
+    def overloaded(self, threshold: float) -> bool:
+        now = time.time()
+        # Идет пауза или пробный запрос еще не вернулся (зависший - не дольше паузы)
+        if now < self.failover_until or now - self.probe_started < LLM_FAILOVER_COOLDOWN:
+            return True
+        if self.ewma is None or self.ewma <= threshold:
+            self.failover_until = 0.0
+            return False
+        if self.failover_until:
+            # Пауза прошла: этот запрос - пробный к основной модели
+            self.failover_until = 0.0
+            self.probe_started = now
+            return False
+        self.failover_until = now + LLM_FAILOVER_COOLDOWN
+        return True
+
+
 class LLMClient:
     """Клиент для работы с локальными моделями через Ollama"""
     
-    def __init__(self, model_name: str = "llama3", base_url: str = "http://localhost:11434"):
+    def __init__(self, model_name: str = "llama3", base_url: str = "http://localhost:11434",
+                 keep_alive: Any = LLM_KEEP_ALIVE, routes: Optional[Dict[str, Dict[str, Any]]] = None):
         """
         Инициализация клиента Ollama
         
         Args:
             model_name: Имя модели в Ollama (llama3, mistral, gemma, etc.)
             base_url: Адрес Ollama API
+            keep_alive: Сколько Ollama держит модель загруженной после запроса
+            routes: Задача -> модель и параметры генерации (по умолчанию LLM_ROUTES)
         """
         self.model_name = model_name
         self.base_url = base_url
+        self.keep_alive = keep_alive
+        self.routes = routes if routes is not None else LLM_ROUTES
         self.use_mock = False
+        self.available_models: List[str] = []
+        # Тайминги последнего ответа Ollama (секунды и счетчики токенов)
+        self.last_stats: Dict[str, Any] = {}
+        self._queue: Dict[str, QueueLatency] = {}
+        self._queue_lock = threading.Lock()
         
         # Проверяем доступность Ollama
         try:
@@ -24,6 +87,7 @@ class LLMClient:
             if response.status_code == 200:
                 models = response.json().get('models', [])
                 available_models = [m['name'] for m in models]
+                self.available_models = available_models
                 print(f"✅ Ollama доступна. Модели: {available_models}")
                 
                 # Проверяем, есть ли запрошенная модель
@@ -40,13 +104,61 @@ class LLMClient:
             print("🔄 Используется режим заглушки (mock)")
             self.use_mock = True
     
-    def generate(self, prompt: str, system_message: str = "", temperature: float = 0.0) -> str:
+    def has_model(self, name: str) -> bool:
+        return any(name in m for m in self.available_models)
+    
+    def route(self, task: Optional[str]) -> Dict[str, Any]:
+        """
+        Модель и параметры генерации для задачи. Модель маршрута, которой нет
+        в Ollama, заменяется основной.
+        """
+        route = dict(self.routes.get(task) or {}) if task else {}
+        model = route.get("model") or self.model_name
+        if model != self.model_name and self.available_models and not self.has_model(model):
+            model = self.model_name
+        route["model"] = model
+        route.setdefault("num_predict", LLM_NUM_PREDICT)
+        route.setdefault("num_ctx", LLM_NUM_CTX)
+        return route
+    
+    def _queue_for(self, model: str) -> QueueLatency:
+        with self._queue_lock:
+            tracker = self._queue.get(model)
+            if tracker is None:
+                tracker = self._queue[model] = QueueLatency()
+            return tracker
+    
+    def _choose_model(self, model: str) -> str:
+        """Основная модель или запасная, если очередь основной слишком долгая"""
+        fallback = LLM_FAILOVER_MODEL
+        if not fallback or fallback == model or (self.available_models and not self.has_model(fallback)):
+            return model
+        tracker = self._queue_for(model)
+        with self._queue_lock:
+            paused_until = tracker.failover_until
+            overloaded = tracker.overloaded(LLM_FAILOVER_QUEUE_LATENCY)
+            switched = overloaded and tracker.failover_until != paused_until
+        if switched:
+            print(f"🔀 Очередь {model} ~{tracker.ewma:.1f} сек: запросы на {fallback} "
+                  f"({LLM_FAILOVER_COOLDOWN:.0f} сек)")
+        return fallback if overloaded else model
+    
+    def generate(self, prompt: str, system_message: str = "", temperature: float = 0.0,
+                 num_predict: Optional[int] = None, num_ctx: Optional[int] = None,
+                 task: Optional[str] = None) -> str:
         """
-        Отправляет запрос в локальную модель Ollama
+        Отправляет запрос в локальную модель Ollama.
+        task - тип задачи (expand, rerank, answer, generate-questions): модель
+        и num_predict / num_ctx берутся из LLM_ROUTES; явные num_predict / num_ctx
+        важнее маршрута. Без задачи - основная модель и LLM_NUM_PREDICT / LLM_NUM_CTX.
         """
         if self.use_mock:
             return self._mock_response(prompt)
         
+        route = self.route(task)
+        model = self._choose_model(route["model"])
+        started = time.perf_counter()  # до запроса: таймаут тоже замер очереди
+        
         try:
             # Формируем запрос для Ollama
             messages = []
@@ -55,14 +167,15 @@ class LLMClient:
             messages.append({"role": "user", "content": prompt})
             
             payload = {
-                "model": self.model_name,
+                "model": model,
                 "messages": messages,
                 "stream": False,
+                "keep_alive": self.keep_alive,
                 "options": {
                     "temperature": temperature,
                     "top_p": 0.9,
-                    "num_predict": 300,  # БЫЛО 1000 - слишком много!
-                    "num_ctx": 2048,     # Контекст поменьше
+                    "num_predict": num_predict or route["num_predict"],
+                    "num_ctx": num_ctx or route["num_ctx"],
                 }
             }
             
@@ -70,11 +183,12 @@ class LLMClient:
             response = requests.post(
                 f"{self.base_url}/api/chat",
                 json=payload,
-                timeout=60  # Таймаут 60 секунд
+                timeout=LLM_REQUEST_TIMEOUT
             )
             
             if response.status_code == 200:
                 result = response.json()
+                self._record_stats(result, model, task, time.perf_counter() - started)
                 return result['message']['content']
             else:
                 print(f"❌ Ollama ошибка: {response.status_code} - {response.text}")
@@ -82,11 +196,76 @@ class LLMClient:
                 
         except requests.exceptions.Timeout:
             print("❌ Таймаут Ollama (модель слишком долго думает)")
+            # Перегруженная модель не отвечает вовсе: без замера EWMA не растет и переключения нет
+            self._observe_queue(model, max(time.perf_counter() - started, LLM_REQUEST_TIMEOUT))
             return "Извините, модель слишком долго обрабатывает запрос. Попробуйте упростить вопрос."
         except Exception as e:
             print(f"❌ Ошибка Ollama: {e}")
             return f"Ошибка при обращении к Ollama: {str(e)}"
     
+    def warm_up(self) -> bool:
+        """
+        Загружает в память основную модель и модели маршрутов заранее:
+        запрос без сообщений Ollama воспринимает как команду загрузки
+        (ничего не генерирует).
+        """
+        if self.use_mock:
+            return False
+        models = list(dict.fromkeys([self.model_name] + [self.route(task)["model"] for task in self.routes]))
+        loaded = True
+        for model in models:
+            started = time.perf_counter()
+            try:
+                response = requests.post(
+                    f"{self.base_url}/api/chat",
+                    json={"model": model, "messages": [], "keep_alive": self.keep_alive},
+                    timeout=120
+                )
+                if response.status_code != 200:
+                    print(f"⚠️ Не удалось загрузить модель {model}: {response.status_code}")
+                    loaded = False
+                    continue
+                self._record_stats(response.json(), model)
+                print(f"🔥 Модель {model} загружена за {time.perf_counter() - started:.1f} сек "
+                      f"(keep_alive={self.keep_alive})")
+            except Exception as e:
+                print(f"⚠️ Ошибка загрузки модели {model}: {e}")
+                loaded = False
+        return loaded
+    
+    def _record_stats(self, result: Dict[str, Any], model: str,
+                      task: Optional[str] = None, elapsed: Optional[float] = None):
+        """Тайминги из ответа Ollama -> last_stats и гистограммы на /metrics"""
+        stats: Dict[str, Any] = {"model": model, "task": task}
+        labels = {"model": model}
+        for field, metric in OLLAMA_DURATIONS.items():
+            if result.get(field) is None:
+                continue
+            seconds = result[field] / 1e9
+            stats[field] = round(seconds, 4)
+            metrics.observe(metric, seconds, labels, f"Ollama {field}")
+        for field in ("prompt_eval_count", "eval_count"):
+            if result.get(field) is not None:
+                stats[field] = result[field]
+        # prompt_eval_count меньше токенов промпта, если префикс взят из кэша Ollama
+        if stats.get("prompt_eval_duration") and stats.get("prompt_eval_count"):
+            stats["prompt_eval_tps"] = round(stats["prompt_eval_count"] / stats["prompt_eval_duration"], 1)
+        
+        # Ожидание в очереди: все, что не покрыто total_duration самой Ollama
+        if elapsed is not None and result.get("total_duration") is not None:
+            queue = max(0.0, elapsed - result["total_duration"] / 1e9)
+            stats["queue_duration"] = round(queue, 4)
+            self._observe_queue(model, queue)
+        self.last_stats = stats
+    
+    def _observe_queue(self, model: str, seconds: float):
+        """Замер ожидания в очереди модели -> /metrics и EWMA для переключения на запасную"""
+        metrics.observe("llm_queue_duration_seconds", seconds, {"model": model},
+                        "Ожидание запроса в очереди Ollama")
+        tracker = self._queue_for(model)
+        with self._queue_lock:
+            tracker.observe(seconds)
+    
     def _mock_response(self, prompt: str) -> str:
         """Заглушка для тестирования без Ollama"""
         print("⚠️ Используется режим заглушки (mock)")
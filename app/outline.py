@@ -0,0 +1,93 @@
+# app/outline.py
+from typing import List, Dict, Any, Optional
+import json
+
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+from .database import Chunk, Document, DocumentSection
+
+
+def build_document_outline(db: Session, doc_id: int) -> int:
+    """
+    Строит оглавление документа (глава -> параграф -> страницы -> чанки)
+    по уже записанным чанкам. Коммит - на стороне вызывающего.
+    Возвращает число секций.
+    """
+    rows = (
+        db.query(
+            Chunk.id, Chunk.chunk_index, Chunk.page_number,
+            Chunk.chapter, Chunk.paragraph, Chunk.section_title
+        )
+        .filter(Chunk.doc_id == doc_id)
+        .order_by(Chunk.chunk_index)
+        .all()
+    )
+
+    sections: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+
+    for chunk_id, chunk_index, page, chapter, paragraph, title in rows:
+        chapter = chapter or ""
+        paragraph = paragraph or ""
+        page = page or 1
+
+        # Новая секция - при смене главы или параграфа
+        if current is None or (current["chapter"], current["paragraph"]) != (chapter, paragraph):
+            current = {
+                "doc_id": doc_id,
+                "position": len(sections),
+                "chapter": chapter,
+                "paragraph": paragraph,
+                "section_title": title or "",
+                "page_start": page,
+                "page_end": page,
+                "first_chunk_index": chunk_index,
+                "last_chunk_index": chunk_index,
+                "chunk_ids": []
+            }
+            sections.append(current)
+
+        current["page_start"] = min(current["page_start"], page)
+        current["page_end"] = max(current["page_end"], page)
+        current["last_chunk_index"] = chunk_index
+        current["chunk_ids"].append(chunk_id)
+
+    db.execute(delete(DocumentSection).where(DocumentSection.doc_id == doc_id))
+    if sections:
+        for section in sections:
+            section["chunk_ids_json"] = json.dumps(section.pop("chunk_ids"))
+        db.execute(insert(DocumentSection), sections)
+
+    return len(sections)
+
+
+def get_document_outline(db: Session, doc_id: int) -> Optional[List[DocumentSection]]:
+    """
+    Оглавление документа в порядке следования.
+    Для документов, загруженных до появления оглавления, строит его один раз.
+    None - если документа нет.
+    """
+    document = db.query(Document.id, Document.total_chunks).filter(Document.id == doc_id).first()
+    if document is None:
+        return None
+
+    sections = (
+        db.query(DocumentSection)
+        .filter(DocumentSection.doc_id == doc_id)
+        .order_by(DocumentSection.position)
+        .all()
+    )
+
+    if not sections and document.total_chunks:
+        print(f"🛠️ Строим оглавление документа {doc_id}")
+        build_document_outline(db, doc_id)
+        db.commit()
+        sections = (
+            db.query(DocumentSection)
+            .filter(DocumentSection.doc_id == doc_id)
+            .order_by(DocumentSection.position)
+            .all()
+        )
+
+    return sections
@@ -0,0 +1,84 @@
+# app/pdf_extraction.py
+"""
+Извлечение текста из PDF: взаимозаменяемые бэкенды.
+
+- pdfplumber: разбор раскладки на Python поверх pdfminer (эталон, медленно);
+- pypdfium2: текстовый слой PDFium (C++), в разы быстрее.
+
+Бэкенд выбирается в config (PDF_EXTRACTOR) или при загрузке учебника.
+Совпадение текста проверяется на своих PDF:
+    python -m benchmarks.extraction_parity --pdf book.pdf
+"""
+from typing import Dict, Iterator, List, Optional, Type
+
+from .config import PDF_EXTRACTOR
+
+
+class PdfExtractor:
+    """Бэкенд извлечения: текст страниц по порядку (строки разделены \\n)"""
+
+    name = ""
+
+    def extract_pages(self, file_path: str) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class PdfplumberExtractor(PdfExtractor):
+    name = "pdfplumber"
+
+    def extract_pages(self, file_path: str) -> Iterator[str]:
+        import pdfplumber
+
+        with pdfplumber.open(file_path) as pdf:
+            for page in pdf.pages:
+                yield page.extract_text() or ""
+
+
+class PdfiumExtractor(PdfExtractor):
+    name = "pypdfium2"
+
+    def extract_pages(self, file_path: str) -> Iterator[str]:
+        import pypdfium2 as pdfium
+
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
+                    page.close()
+                yield self.normalize(text)
+        finally:
+            pdf.close()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        Приводит вывод PDFium к виду pdfplumber: переводы строк \\r\\n -> \\n,
+        мягкий перенос в конце строки (PDFium отдает его как \\x02 или \\ufffe) -> дефис,
+        который потом склеивает normalize_text.
+        """
+        return text.replace("\r\n", "\n").replace("\r", "\n").replace("\x02", "-").replace("\ufffe", "-")
+
+
+EXTRACTORS: Dict[str, Type[PdfExtractor]] = {
+    PdfplumberExtractor.name: PdfplumberExtractor,
+    PdfiumExtractor.name: PdfiumExtractor,
+}
+
+
+def available_extractors() -> List[str]:
+    return list(EXTRACTORS)
+
+
+def get_extractor(name: Optional[str] = None) -> PdfExtractor:
+    """Бэкенд по имени (по умолчанию PDF_EXTRACTOR из config)"""
+    name = name or PDF_EXTRACTOR
+    if name not in EXTRACTORS:
+        raise ValueError(
+            f"Неизвестный бэкенд извлечения PDF: {name}. Доступны: {', '.join(EXTRACTORS)}"
+        )
+    return EXTRACTORS[name]()
@@ -0,0 +1,311 @@
+# app/query_expansion.py
+"""
+Локальное расширение запросов без LLM.
+
+- MorphNormalizer: основы слов (Snowball из nltk или встроенный суффиксный
+  стеммер) и, если установлен pymorphy3/pymorphy2, леммы и словоформы.
+- mine_aliases: словарь имен из текста учебника (Гай Юлий Цезарь <- цезар, юл)
+  строится при загрузке и хранится в таблице entity_aliases.
+- LocalQueryExpander: варианты запроса и ключевые слова для лексического поиска
+  за микросекунды - словарные операции вместо вызова Ollama.
+"""
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+from collections import Counter, defaultdict
+from functools import lru_cache
+import re
+import threading
+
+from .config import ALIAS_MIN_FREQUENCY
+
+# Стоп-слова (вопросительные и частотные) - не участвуют в поиске
+STOP_WORDS = {
+    'когда', 'где', 'какой', 'какая', 'какое', 'какие', 'что', 'кто',
+    'как', 'почему', 'зачем', 'сколько', 'этот', 'эта', 'это', 'эти',
+    'весь', 'вся', 'все', 'был', 'была', 'было', 'были', 'при', 'для',
+    'чтобы', 'чрез', 'через', 'около', 'почти', 'уже', 'еще', 'ещё',
+    'каком', 'какую', 'каким', 'каких', 'какого', 'какому', 'куда', 'откуда',
+    'году', 'годы'
+}
+
+WORD_RE = re.compile(r"\w+")
+CAPITALIZED_RE = re.compile(r"\b[А-ЯЁ][а-яё]{2,}\b")
+# 2-3 слова с заглавной подряд: Гай Юлий Цезарь, Александр Македонский
+NAME_RE = re.compile(r"\b[А-ЯЁ][а-яё]{2,}(?:\s+[А-ЯЁ][а-яё]{2,}){1,2}\b")
+# Прилагательные окончания: «Западной Римской» - не имя человека
+ADJECTIVE_RE = re.compile(r"(?:ой|ий|ый|ая|ое|ые|ей|ого|его|ому|ему|ую|юю|их|ых|ими|ыми)$")
+
+# Окончания для встроенного стеммера (длинные - первыми)
+_ENDINGS = sorted({
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией",
+    "ов", "ев", "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ие", "ые",
+    "ам", "ям", "ах", "ях", "ом", "ем", "им", "ым", "ую", "юю", "ию", "ия",
+    "ья", "ью", "ь", "а", "я", "о", "е", "ы", "и", "у", "ю", "й"
+}, key=len, reverse=True)
+
+MIN_STEM_LEN = 3
+
+
+def _suffix_stem(word: str) -> str:
+    """Грубый стеммер: отрезает самое длинное окончание, оставляя основу от 3 букв"""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LEN:
+            return word[:-len(ending)]
+    return word
+
+
+def _at_sentence_start(text: str, pos: int) -> bool:
+    i = pos - 1
+    while i >= 0 and (text[i].isspace() or text[i] in "»\")"):
+        i -= 1  # закрывающие кавычки: «И ты, дитя мое!» Так ...
+    return i < 0 or text[i] in ".!?…«\"("
+
+
+class MorphNormalizer:
+    """Нормализация русских слов: основа (всегда) и лемма/формы (если есть pymorphy)"""
+
+    def __init__(self):
+        self.morph = None
+        try:
+            import pymorphy3 as pymorphy
+        except ImportError:
+            try:
+                import pymorphy2 as pymorphy
+            except ImportError:
+                pymorphy = None
+        if pymorphy is not None:
+            try:
+                self.morph = pymorphy.MorphAnalyzer()
+            except Exception as e:
+                print(f"⚠️ pymorphy не инициализирован: {e}")
+
+        self.stemmer = None
+        try:
+            from nltk.stem.snowball import SnowballStemmer
+            self.stemmer = SnowballStemmer("russian")
+        except ImportError:
+            pass
+
+        # Кэш на экземпляр: словарь запросов и учебников ограничен
+        self.stem = lru_cache(maxsize=100000)(self._stem)
+        self.lemma = lru_cache(maxsize=100000)(self._lemma)
+        self.form_stems = lru_cache(maxsize=100000)(self._form_stems)
+
+    def _stem(self, word: str) -> str:
+        word = word.lower().replace("ё", "е")
+        if self.stemmer is not None:
+            return self.stemmer.stem(word)
+        return _suffix_stem(word)
+
+    def _lemma(self, word: str) -> str:
+        if self.morph is None:
+            return word.lower()
+        return self.morph.parse(word)[0].normal_form
+
+    def forms(self, word: str) -> List[str]:
+        """Словоформы (только с pymorphy)"""
+        if self.morph is None:
+            return []
+        return list(dict.fromkeys(f.word for f in self.morph.parse(word)[0].lexeme))
+
+    def _form_stems(self, word: str) -> Tuple[str, ...]:
+        """
+        Основы словоформ, которые не начинаются с основы самого слова: беглые гласные
+        и чередования (отец -> отц-, лев -> льв-) - их не поймает поиск подстроки по основе.
+        """
+        stem = self.stem(word)
+        return tuple(dict.fromkeys(
+            self.stem(form) for form in self.forms(word)
+            if not form.replace("ё", "е").startswith(stem) and len(self.stem(form)) >= MIN_STEM_LEN
+        ))
+
+    def is_person_name(self, token: str) -> bool:
+        if self.morph is not None:
+            tags = self.morph.parse(token)[0].tag
+            return any(g in tags for g in ("Name", "Surn", "Patr"))
+        return not ADJECTIVE_RE.search(token.lower())
+
+
+def mine_aliases(texts: Iterable[str], normalizer: MorphNormalizer) -> List[Dict[str, Any]]:
+    """
+    Собирает имена из текста: последовательности слов с заглавной буквы.
+    Первое слово в начале предложения берется, только если это слово
+    встречается с заглавной и внутри предложения (т. е. имя собственное).
+    Возвращает строки для entity_aliases: alias, canonical, frequency.
+    """
+    texts = list(texts)
+
+    proper_stems = set()
+    for text in texts:
+        for match in CAPITALIZED_RE.finditer(text):
+            if not _at_sentence_start(text, match.start()):
+                proper_stems.add(normalizer.stem(match.group(0)))
+
+    phrases: Dict[Tuple[str, ...], Counter] = defaultdict(Counter)
+    for text in texts:
+        for match in NAME_RE.finditer(text):
+            tokens = match.group(0).split()
+            if _at_sentence_start(text, match.start()) and normalizer.stem(tokens[0]) not in proper_stems:
+                tokens = tokens[1:]
+            if len(tokens) < 2:
+                continue
+            if not any(normalizer.is_person_name(t) for t in tokens):
+                continue
+            key = tuple(normalizer.stem(t) for t in tokens)
+            phrases[key][" ".join(tokens)] += 1
+
+    aliases: Dict[Tuple[str, str], int] = Counter()
+    for key, surfaces in phrases.items():
+        canonical, _ = surfaces.most_common(1)[0]
+        frequency = sum(surfaces.values())
+        aliases[(" ".join(key), canonical)] += frequency
+        for stem in key:
+            if len(stem) >= MIN_STEM_LEN and stem not in STOP_WORDS:
+                aliases[(stem, canonical)] += frequency
+
+    return [
+        {"alias": alias, "canonical": canonical, "frequency": frequency}
+        for (alias, canonical), frequency in aliases.items()
+    ]
+
+
+class LocalQueryExpander:
+    """
+    Варианты запроса без LLM: имена из словаря псевдонимов, леммы и словоформы.
+    Словарь загружается из entity_aliases при первом обращении
+    и пополняется при загрузке учебников. Читается из потоков обработчиков:
+    load собирает новый словарь и подменяет его под _lock целиком.
+    """
+
+    def __init__(self, normalizer: Optional[MorphNormalizer] = None):
+        self.normalizer = normalizer or MorphNormalizer()
+        self._aliases: Dict[str, Counter] = defaultdict(Counter)
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    # ---------- СЛОВАРЬ ----------
+
+    def add_aliases(self, rows: Iterable[Dict[str, Any]]):
+        with self._lock:
+            for row in rows:
+                self._aliases[row["alias"]][row["canonical"]] += row.get("frequency") or 1
+
+    def load(self, db=None):
+        """
+        Загружает словарь из БД. Для учебников, загруженных до появления
+        словаря, один раз собирает псевдонимы из их чанков и сохраняет
+        (documents.aliases_mined - и для учебников без единого имени).
+        """
+        from sqlalchemy import insert, update
+        from .database import SessionLocal, Document, Chunk, EntityAlias
+
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            pending = [
+                doc_id for (doc_id,) in
+                db.query(Document.id).filter(Document.aliases_mined.isnot(True)).all()
+            ]
+            with_aliases = {
+                doc_id for (doc_id,) in
+                db.query(EntityAlias.doc_id).filter(EntityAlias.doc_id.in_(pending)).distinct()
+            } if pending else set()
+            for doc_id in pending:
+                if doc_id in with_aliases:
+                    continue  # словарь собран до появления отметки
+                contents = [c for (c,) in db.query(Chunk.content).filter(Chunk.doc_id == doc_id)]
+                rows = mine_aliases(contents, self.normalizer)
+                if rows:
+                    db.execute(insert(EntityAlias), [dict(row, doc_id=doc_id) for row in rows])
+            if pending:
+                db.execute(update(Document).where(Document.id.in_(pending)).values(aliases_mined=True))
+                db.commit()
+
+            # Чтение и подмена - под блокировкой: имена учебника, загружаемого параллельно,
+            # либо уже в таблице, либо add_aliases применит их к новому словарю
+            with self._lock:
+                aliases: Dict[str, Counter] = defaultdict(Counter)
+                for alias, canonical, frequency in db.query(
+                    EntityAlias.alias, EntityAlias.canonical, EntityAlias.frequency
+                ):
+                    aliases[alias][canonical] += frequency or 1
+                self._aliases = aliases
+            self._loaded = True
+            print(f"📖 Словарь псевдонимов: {len(self._aliases)} ключей")
+        except Exception as e:
+            print(f"⚠️ Не удалось загрузить словарь псевдонимов: {e}")
+            self._loaded = True
+        finally:
+            if own_session:
+                db.close()
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.load()
+
+    def canonical_names(self, word: str, limit: int = 3) -> List[str]:
+        """Полные имена, к которым относится слово (по основе)"""
+        self._ensure_loaded()
+        stem = self.normalizer.stem(word)
+        with self._lock:
+            names = self._aliases.get(stem)
+            if not names:
+                return []
+            common = names.most_common(limit)
+        return [name for name, frequency in common if frequency >= ALIAS_MIN_FREQUENCY]
+
+    def is_entity(self, word: str) -> bool:
+        return bool(self.canonical_names(word, limit=1))
+
+    # ---------- РАСШИРЕНИЕ ----------
+
+    def keyword_variants(self, words: List[str]) -> List[str]:
+        """
+        Дополнительные слова для лексического поиска: основы (ловят любые
+        падежи при поиске подстроки), основы словоформ с беглой гласной или
+        чередованием (с pymorphy) и основы остальных частей имени.
+        """
+        variants = []
+        for word in words:
+            stem = self.normalizer.stem(word)
+            if len(stem) >= MIN_STEM_LEN:
+                variants.append(stem)
+            variants.extend(self.normalizer.form_stems(word))
+            for name in self.canonical_names(word):
+                for token in name.split():
+                    token_stem = self.normalizer.stem(token)
+                    if len(token_stem) >= MIN_STEM_LEN:
+                        variants.append(token_stem)
+        return [v for v in dict.fromkeys(variants) if v not in words]
+
+    def expand(self, query: str, limit: int = 2) -> List[str]:
+        """
+        Переформулировки запроса (без оригинала): слово заменяется полным
+        именем из словаря, плюс запрос из лемм значимых слов (если есть pymorphy).
+        """
+        variants = []
+        query_stems = {self.normalizer.stem(w) for w in WORD_RE.findall(query)}
+
+        for match in WORD_RE.finditer(query):
+            word = match.group(0)
+            if len(word) <= 3 or word.lower() in STOP_WORDS:
+                continue
+            for name in self.canonical_names(word):
+                name_stems = {self.normalizer.stem(t) for t in name.split()}
+                if name_stems <= query_stems:
+                    continue  # имя уже полностью в запросе
+                variants.append(query[:match.start()] + name + query[match.end():])
+
+        if self.normalizer.morph is not None:
+            lemmas = [
+                self.normalizer.lemma(w) for w in WORD_RE.findall(query)
+                if w.lower() not in STOP_WORDS
+            ]
+            if lemmas:
+                variants.append(" ".join(lemmas))
+
+        variants = [v for v in dict.fromkeys(variants) if v != query]
+        return variants[:limit]
@@ -0,0 +1,360 @@
+# app/question_bank.py
+"""
+Вопросы для самопроверки по разделам учебника (глава + параграф).
+
+Раздел берется из оглавления (DocumentSection), его чанки делятся на фрагменты
+по бюджету токенов, по каждому фрагменту LLM составляет вопросы с ответами.
+Вопросы хранятся в SQLite (question_bank): после загрузки учебника банк
+заполняется в фоне, /generate-questions выбирает из него случайные вопросы
+и обращается к LLM, только если в банке их меньше, чем просят.
+
+Запуск для учебников, загруженных до появления банка:
+    python -m app.question_bank [--doc-id N]
+"""
+from typing import List, Dict, Any, Optional, Tuple
+import argparse
+import json
+import random
+import re
+import threading
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from .config import LLM_ROUTES, QUESTION_BANK_SIZE, QUESTIONS_PER_CALL, QUESTION_SOURCE_PREVIEW
+from .context_builder import ContextBuilder, trim_overlap
+from .database import init_db, SessionLocal, Chunk, Document, QuestionBankItem
+from .intelligent_search import SYSTEM_PROMPT
+from .outline import get_document_outline
+from .structure_parser import normalize_chapter, normalize_paragraph
+from .text_matching import normalize_search_text
+from .tracing import span
+
+# Неизменные инструкции - в начале (KV-кэш Ollama), фрагмент - в конце
+QUESTIONS_PROMPT = """Составь вопросы для проверки знаний по фрагменту учебника истории.
+Каждый вопрос - о конкретном факте из текста: дата, имя, событие, причина или итог.
+Ответ - одно-два предложения строго по тексту, в конце - страница в квадратных скобках.
+Формат:
+ВОПРОСЫ:
+1. <вопрос>
+ОТВЕТЫ:
+1. <ответ> [стр. N]
+
+Количество вопросов: {count}
+
+Фрагмент учебника:
+{context}
+"""
+
+ANSWERS_HEADER_RE = re.compile(r"^\s*\**\s*ОТВЕТЫ\s*\**\s*:?", re.IGNORECASE | re.MULTILINE)
+NUMBERED_RE = re.compile(r"^\s*(\d{1,2})\s*[.)]\s*(.+)$")
+PAGE_RE = re.compile(r"\s*\[?\s*стр\.?\s*(\d{1,4})\s*\]?\s*\.?\s*$", re.IGNORECASE)
+
+
+def _numbered(text: str) -> Dict[int, str]:
+    """«1. ...» построчно -> {1: ...}; строки без номера продолжают предыдущий пункт"""
+    items: Dict[int, str] = {}
+    current = None
+    for line in text.split("\n"):
+        match = NUMBERED_RE.match(line)
+        if match:
+            current = int(match.group(1))
+            items[current] = match.group(2).strip()
+        elif current is not None and line.strip() and not line.strip().endswith(":"):
+            items[current] += " " + line.strip()
+    return items
+
+
+def parse_questions(response: str) -> List[Dict[str, Any]]:
+    """Ответ LLM -> [{question, answer, page}]; page - None, если страница не указана"""
+    parts = ANSWERS_HEADER_RE.split(response, maxsplit=1)
+    if len(parts) < 2:
+        return []
+    questions, answers = _numbered(parts[0]), _numbered(parts[1])
+
+    parsed = []
+    for number, question in sorted(questions.items()):
+        answer = answers.get(number)
+        if not answer:
+            continue
+        page_match = PAGE_RE.search(answer)
+        page = int(page_match.group(1)) if page_match else None
+        if page_match:
+            answer = answer[:page_match.start()].strip()
+        if question and answer:
+            parsed.append({"question": question, "answer": answer, "page": page})
+    return parsed
+
+
+class QuestionBank:
+    """Банк вопросов по разделам: выборка из SQLite, генерация LLM для недостающих"""
+
+    def __init__(self, llm_client, context_builder: ContextBuilder):
+        self.llm = llm_client
+        self.context_builder = context_builder
+        self.stats = {"served": 0, "generated": 0, "llm_calls": 0}
+        # Один раздел не генерируется параллельно (фоновая загрузка и запрос учителя)
+        self._locks: Dict[Tuple[int, str, str], threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, key: Tuple[int, str, str]) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    # ---------- РАЗДЕЛЫ ----------
+
+    @staticmethod
+    def _group_sections(sections: List[Any]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Секции оглавления -> разделы по (глава, параграф) в порядке учебника"""
+        groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for section in sections:
+            key = (section.chapter or "", section.paragraph or "")
+            group = groups.setdefault(key, {"chapter": key[0], "paragraph": key[1], "chunk_ids": []})
+            group["chunk_ids"].extend(json.loads(section.chunk_ids_json or "[]"))
+        return groups
+
+    @staticmethod
+    def _match(groups: Dict[Tuple[str, str], Dict[str, Any]],
+               chapter: str, paragraph: str) -> List[Dict[str, Any]]:
+        """
+        Разделы запроса: параграф (в главе, если она указана) или вся глава без параграфа.
+        Номера параграфов могут повторяться в разных главах - без главы берется первая.
+        """
+        if paragraph:
+            matched = [
+                g for g in groups.values()
+                if normalize_paragraph(g["paragraph"]) == paragraph
+                and (not chapter or not g["chapter"] or normalize_chapter(g["chapter"]) == chapter)
+            ]
+            return matched[:1]
+        return [g for g in groups.values() if chapter and normalize_chapter(g["chapter"]) == chapter]
+
+    def _windows(self, db: Session, chunk_ids: List[int]) -> List[Dict[str, Any]]:
+        """Текст раздела -> фрагменты по бюджету токенов: [{context, pages}]"""
+        if not chunk_ids:
+            return []
+        rows = (
+            db.query(Chunk.page_number, Chunk.content)
+            .filter(Chunk.id.in_(chunk_ids))
+            .order_by(Chunk.chunk_index)
+            .all()
+        )
+        route = LLM_ROUTES["generate-questions"]
+        template = QUESTIONS_PROMPT.format(count=QUESTIONS_PER_CALL, context="")
+        tokens = self.context_builder.tokens
+        budget = self.context_builder.budget_for(
+            tokens.count(template) + tokens.count(SYSTEM_PROMPT),
+            num_ctx=route["num_ctx"], num_predict=route["num_predict"]
+        )
+
+        windows: List[Dict[str, Any]] = []
+        current: Optional[Dict[str, Any]] = None
+        previous = ""
+        for page, content in rows:
+            page = page or 1
+            text = trim_overlap(previous, content) if previous else content
+            previous = content
+            if not text:
+                continue
+            cost = tokens.count(text)
+            if current is None or (current["tokens"] + cost > budget and current["parts"]):
+                current = {"parts": [], "pages": [], "tokens": 0}
+                windows.append(current)
+            current["parts"].append(f"[Страница {page}]\n{text}")
+            current["pages"].append(page)
+            current["tokens"] += cost
+
+        return [{"context": "\n\n".join(w["parts"]), "pages": w["pages"]} for w in windows]
+
+    # ---------- ГЕНЕРАЦИЯ ----------
+
+    def _generate(self, window: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+        with span("generate_questions"):
+            response = self.llm.generate(
+                prompt=QUESTIONS_PROMPT.format(count=count, context=window["context"]),
+                system_message=SYSTEM_PROMPT,
+                temperature=0.5,
+                task="generate-questions"
+            )
+        with self._locks_guard:
+            self.stats["llm_calls"] += 1
+        items = parse_questions(response)[:count]
+        # Страница вне фрагмента - ошибка модели: берется первая страница фрагмента
+        for item in items:
+            if item["page"] not in window["pages"]:
+                item["page"] = window["pages"][0]
+        return items
+
+    def _fill(self, db: Session, doc_id: int, group: Dict[str, Any], target: int) -> int:
+        """
+        Догенерирует вопросы раздела до target. Фрагменты перебираются по кругу
+        с того, на котором остановились, - новые вопросы по другой части текста.
+        Возвращает число добавленных вопросов.
+        """
+        key = (doc_id, group["chapter"], group["paragraph"])
+        with self._lock_for(key):
+            existing = {
+                normalize_search_text(question) for (question,) in
+                db.query(QuestionBankItem.question).filter(
+                    QuestionBankItem.doc_id == doc_id,
+                    QuestionBankItem.chapter == group["chapter"],
+                    QuestionBankItem.paragraph == group["paragraph"]
+                ).all()
+            }
+            if len(existing) >= target:
+                return 0
+            windows = self._windows(db, group["chunk_ids"])
+            if not windows:
+                return 0
+
+            added = 0
+            start = (len(existing) // QUESTIONS_PER_CALL) % len(windows)
+            for offset in range(len(windows)):
+                need = target - len(existing)
+                if need <= 0:
+                    break
+                # На последние фрагменты - сколько осталось, чтобы хватило за один проход
+                count = max(min(need, QUESTIONS_PER_CALL), -(-need // (len(windows) - offset)))
+                window = windows[(start + offset) % len(windows)]
+                rows = []
+                for item in self._generate(window, count):
+                    normalized = normalize_search_text(item["question"])
+                    if normalized in existing:
+                        continue
+                    existing.add(normalized)
+                    rows.append(dict(item, doc_id=doc_id, chapter=group["chapter"], paragraph=group["paragraph"]))
+                if rows:
+                    db.execute(insert(QuestionBankItem), rows)
+                    db.commit()
+                    added += len(rows)
+            with self._locks_guard:
+                self.stats["generated"] += added
+            return added
+
+    def prefill(self, doc_id: int, size: int = QUESTION_BANK_SIZE, db: Optional[Session] = None) -> int:
+        """
+        Заполняет банк вопросов всех разделов документа (фоновая задача после загрузки).
+        Возвращает число новых вопросов.
+        """
+        if self.llm.use_mock:
+            print("⚠️ Ollama недоступна, банк вопросов не заполняется")
+            return 0
+
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            sections = get_document_outline(db, doc_id)
+            if not sections:
+                return 0
+            groups = self._group_sections(sections)
+            added = 0
+            with span("question_bank"):
+                for group in groups.values():
+                    try:
+                        added += self._fill(db, doc_id, group, size)
+                    except Exception as e:
+                        db.rollback()
+                        print(f"⚠️ Вопросы раздела {group['chapter']} {group['paragraph']}: {e}")
+            print(f"❓ Банк вопросов документа {doc_id}: +{added} по {len(groups)} разделам")
+            return added
+        finally:
+            if own_session:
+                db.close()
+
+    # ---------- ВЫДАЧА ----------
+
+    def get_questions(self, doc_id: int, chapter: Optional[str] = None, paragraph: Optional[str] = None,
+                      num_questions: int = 5, db: Optional[Session] = None) -> Dict[str, Any]:
+        """
+        Случайные вопросы параграфа (или всей главы, если параграф не указан) из банка;
+        недостающие генерируются и сохраняются. Возвращает {questions, source_text} или {error}.
+        """
+        chapter = normalize_chapter(chapter)
+        paragraph = normalize_paragraph(paragraph)
+        if not chapter and not paragraph:
+            return {"error": "Не указан раздел: глава или параграф"}
+
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            sections = get_document_outline(db, doc_id)
+            if sections is None:
+                return {"error": f"Документ {doc_id} не найден"}
+            groups = self._match(self._group_sections(sections), chapter, paragraph)
+            if not groups:
+                return {"error": f"Раздел не найден: {chapter} {paragraph}".strip()}
+
+            def load() -> List[QuestionBankItem]:
+                items = []
+                for group in groups:
+                    items += db.query(QuestionBankItem).filter(
+                        QuestionBankItem.doc_id == doc_id,
+                        QuestionBankItem.chapter == group["chapter"],
+                        QuestionBankItem.paragraph == group["paragraph"]
+                    ).all()
+                return items
+
+            items = load()
+            if len(items) < num_questions:
+                # Промах: догенерировать недостающее поровну по разделам главы,
+                # чтобы вопросы не сосредоточились в первом параграфе
+                missing = num_questions - len(items)
+                for left, group in zip(range(len(groups), 0, -1), groups):
+                    share = -(-missing // left)
+                    have = sum(1 for i in items if (i.chapter, i.paragraph) == (group["chapter"], group["paragraph"]))
+                    missing -= self._fill(db, doc_id, group, have + share)
+                    if missing <= 0:
+                        break
+                items = load()
+
+            picked = random.sample(items, min(num_questions, len(items)))
+            with self._locks_guard:
+                self.stats["served"] += len(picked)
+
+            first = groups[0]["chunk_ids"][:1]
+            source = db.query(Chunk.content).filter(Chunk.id.in_(first)).scalar() if first else ""
+            return {
+                "questions": [
+                    {
+                        "question": item.question,
+                        "answer": item.answer,
+                        "page": item.page or 1,
+                        "chapter": item.chapter,
+                        "paragraph": item.paragraph
+                    }
+                    for item in picked
+                ],
+                "source_text": (source or "")[:QUESTION_SOURCE_PREVIEW]
+            }
+        finally:
+            if own_session:
+                db.close()
+
+
+def main():
+    from .llm_client import LLMClient
+    from .config import OLLAMA_MODEL, OLLAMA_BASE_URL
+
+    parser = argparse.ArgumentParser(description="Банк вопросов по разделам учебника")
+    parser.add_argument("--doc-id", type=int, default=None, help="по умолчанию - все документы")
+    parser.add_argument("--size", type=int, default=QUESTION_BANK_SIZE, help="вопросов на раздел")
+    args = parser.parse_args()
+
+    init_db()
+    bank = QuestionBank(LLMClient(model_name=OLLAMA_MODEL, base_url=OLLAMA_BASE_URL), ContextBuilder())
+    db = SessionLocal()
+    try:
+        doc_ids = [args.doc_id] if args.doc_id is not None else [d for (d,) in db.query(Document.id).all()]
+    finally:
+        db.close()
+    result = {str(doc_id): bank.prefill(doc_id, size=args.size) for doc_id in doc_ids}
+    print(json.dumps({"added": result, "llm_calls": bank.stats["llm_calls"]}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,10 @@ class QuestionRequest(BaseModel):
     """Запрос на фактологический вопрос"""
     query: str
     document_id: Optional[int] = None  # Если None - ищем по всем
+    chapter: Optional[str] = None      # «Глава 2» или «2» - искать только в главе
+    paragraph: Optional[str] = None    # «§ 5» или «5» - искать только в параграфе
     top_k: int = 2
+    include_timings: bool = False  # Вернуть время по стадиям в ответе
 
 class QuestionResponse(BaseModel):
     """Ответ на фактологический вопрос"""
@@ -13,12 +16,28 @@ class QuestionResponse(BaseModel):
     sources: List[Dict[str, Any]]
     confidence: Optional[float] = None
     processing_time: Optional[float] = None
+    mode: Optional[str] = None  # extractive - без LLM, llm - ответ модели
+    timings: Optional[Dict[str, float]] = None  # стадия -> секунды
+
+class BatchQuestionRequest(BaseModel):
+    """Список вопросов по одной области поиска (/ask/batch)"""
+    queries: List[str]
+    document_id: Optional[int] = None
+    chapter: Optional[str] = None
+    paragraph: Optional[str] = None
+
+class BatchAnswerItem(BaseModel):
+    """Строка NDJSON ответа /ask/batch: ответ на один вопрос или ошибка"""
+    index: int                     # номер вопроса в запросе
+    query: str
+    result: Optional[QuestionResponse] = None
+    error: Optional[str] = None
 
 class GenerateQuestionsRequest(BaseModel):
-    """Запрос на генерацию вопросов по параграфу"""
+    """Запрос на генерацию вопросов по параграфу или по всей главе"""
     document_id: int
-    chapter: str
-    paragraph: str
+    chapter: Optional[str] = None      # «Глава 2» или «2»; без параграфа - вся глава
+    paragraph: Optional[str] = None    # «§ 5» или «5»
     num_questions: int = 5
 
 class QuestionItem(BaseModel):
@@ -0,0 +1,433 @@
+# app/snapshot.py
+"""
+Снапшот индекса для быстрого запуска новых реплик.
+
+Архив (tar.gz) содержит:
+    history_tutor.db  - SQLite целиком
+    vectors.f32       - матрица эмбеддингов float32 (count x dim), построчно
+    vector_ids.json   - ID эмбеддингов в порядке строк матрицы
+    sentence_vectors.f32, sentence_ids.json, sentence_metadata.json -
+                        то же для индекса предложений (с метаданными: ссылка на чанк)
+    manifest.json     - модель эмбеддингов, размерность, sha256 файлов
+
+Запуск:
+    python -m app.snapshot export snapshot.tar.gz
+    python -m app.snapshot restore snapshot.tar.gz [--force]
+
+Экспорт пишет архив потоком: файлы не копируются во временную директорию,
+векторы читаются из ChromaDB страницами прямо в архив. Центроиды разделов
+не экспортируются - при восстановлении они пересчитываются по векторам чанков.
+Во время экспорта запись в SQLite заблокирована (читатели работают).
+"""
+from typing import Dict, Any, List, Optional, BinaryIO
+from pathlib import Path
+from datetime import datetime
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tarfile
+import time
+
+import chromadb
+import numpy as np
+
+from .config import CHROMA_PERSIST_DIR, SENTENCE_INDEX, VECTOR_STORE_TEXT
+from .database import engine
+from .vector_store import (
+    VectorStore, COLLECTION_NAME, COLLECTION_METADATA, SECTIONS_COLLECTION_NAME, SENTENCES_COLLECTION_NAME,
+    collection_ids, index_sections
+)
+
+SNAPSHOT_FORMAT = 2
+# Формат 1 - без индекса предложений: после восстановления его строит consistency sentences
+SUPPORTED_FORMATS = (1, 2)
+DB_MEMBER = "history_tutor.db"
+VECTORS_MEMBER = "vectors.f32"
+IDS_MEMBER = "vector_ids.json"
+SENTENCE_VECTORS_MEMBER = "sentence_vectors.f32"
+SENTENCE_IDS_MEMBER = "sentence_ids.json"
+SENTENCE_METADATA_MEMBER = "sentence_metadata.json"
+MANIFEST_MEMBER = "manifest.json"
+
+READ_BLOCK = 1024 * 1024
+
+
+class _HashingReader(io.RawIOBase):
+    """Файлоподобный объект: отдает байты источника и считает sha256 на лету"""
+
+    def __init__(self, source: BinaryIO):
+        self.source = source
+        self.sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class _VectorStreamReader(io.RawIOBase):
+    """
+    Отдает эмбеддинги коллекции как поток float32-байт, подгружая их страницами.
+    metadatas - список, в который складываются метаданные тех же страниц (по порядку ids).
+    """
+
+    def __init__(self, collection, ids: List[str], dim: int, page_size: int = 1000,
+                 metadatas: Optional[List[Dict[str, Any]]] = None):
+        self.collection = collection
+        self.ids = ids
+        self.dim = dim
+        self.page_size = page_size
+        self.metadatas = metadatas
+        self.position = 0
+        self.buffer = b""
+        self.sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def _next_page(self) -> bytes:
+        page_ids = self.ids[self.position:self.position + self.page_size]
+        if not page_ids:
+            return b""
+        include = ["embeddings", "metadatas"] if self.metadatas is not None else ["embeddings"]
+        result = self.collection.get(ids=page_ids, include=include)
+        # Chroma не гарантирует порядок - восстанавливаем по ID
+        by_id = dict(zip(result["ids"], result["embeddings"]))
+        missing = [i for i in page_ids if i not in by_id]
+        if missing:
+            raise RuntimeError(f"Векторы исчезли во время экспорта: {missing[:5]}")
+        if self.metadatas is not None:
+            meta_by_id = dict(zip(result["ids"], result["metadatas"]))
+            self.metadatas.extend(meta_by_id[i] for i in page_ids)
+        matrix = np.asarray([by_id[i] for i in page_ids], dtype=np.float32)
+        if matrix.shape[1] != self.dim:
+            raise RuntimeError(f"Неожиданная размерность {matrix.shape[1]} (ожидалась {self.dim})")
+        self.position += len(page_ids)
+        return matrix.tobytes()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = self._next_page()
+            if not chunk:
+                break
+            self.buffer += chunk
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.sha256.update(data)
+        return data
+
+
+def _db_path() -> Path:
+    return Path(engine.url.database)
+
+
+def _lock_checkpointed_db(db_path: Path, attempts: int = 10) -> sqlite3.Connection:
+    """
+    Переносит WAL в основной файл и берет блокировку записи.
+    Если между checkpoint и блокировкой кто-то успел записать - повторяет.
+    """
+    wal_path = Path(str(db_path) + "-wal")
+    conn = sqlite3.connect(str(db_path), isolation_level=None, timeout=30)
+    for _ in range(attempts):
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("BEGIN IMMEDIATE")
+        if not wal_path.exists() or wal_path.stat().st_size == 0:
+            return conn
+        conn.execute("ROLLBACK")
+        time.sleep(0.5)
+    conn.close()
+    raise RuntimeError("Не удалось получить согласованное состояние SQLite (идет активная запись)")
+
+
+def _add_stream(tar: tarfile.TarFile, name: str, size: int, fileobj):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    tar.addfile(info, fileobj)
+
+
+def _add_json(tar: tarfile.TarFile, name: str, value: Any, files: Dict[str, Dict[str, Any]]):
+    data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+    _add_stream(tar, name, len(data), io.BytesIO(data))
+    files[name] = {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def _add_vectors(tar: tarfile.TarFile, name: str, collection, ids: List[str], dim: int,
+                 files: Dict[str, Dict[str, Any]], metadatas: Optional[List[Dict[str, Any]]] = None):
+    size = len(ids) * dim * 4
+    reader = _VectorStreamReader(collection, ids, dim, metadatas=metadatas)
+    _add_stream(tar, name, size, reader)
+    files[name] = {"size": size, "sha256": reader.sha256.hexdigest()}
+
+
+def _collection_dim(collection, ids: List[str]) -> int:
+    if not ids:
+        return 0
+    probe = collection.get(ids=ids[:1], include=["embeddings"])
+    return len(probe["embeddings"][0])
+
+
+# ---------------- EXPORT ----------------
+
+def export_snapshot(archive_path: Path, vector_store: Optional[VectorStore] = None) -> Dict[str, Any]:
+    """
+    vector_store - для имени фактически загруженной модели эмбеддингов
+    (VectorStore может откатиться на запасную); по умолчанию создается свой.
+    """
+    model_name = (vector_store or VectorStore()).embedding_model_name
+    db_path = _db_path()
+    chroma_client = chromadb.PersistentClient(path=str(CHROMA_PERSIST_DIR))
+    collection = chroma_client.get_collection(COLLECTION_NAME)
+    sentence_collection = chroma_client.get_or_create_collection(
+        name=SENTENCES_COLLECTION_NAME, metadata=COLLECTION_METADATA
+    )
+
+    lock_conn = _lock_checkpointed_db(db_path)
+
+    try:
+        ids = collection_ids(collection)
+        dim = _collection_dim(collection, ids)
+        sentence_ids = collection_ids(sentence_collection)
+        sentence_dim = _collection_dim(sentence_collection, sentence_ids)
+
+        files: Dict[str, Dict[str, Any]] = {}
+
+        with tarfile.open(str(archive_path), mode="w|gz") as tar:
+            # 1. SQLite
+            db_size = db_path.stat().st_size
+            with open(db_path, "rb") as f:
+                reader = _HashingReader(f)
+                _add_stream(tar, DB_MEMBER, db_size, reader)
+            files[DB_MEMBER] = {"size": db_size, "sha256": reader.sha256.hexdigest()}
+
+            # 2. Векторы и их ID
+            _add_vectors(tar, VECTORS_MEMBER, collection, ids, dim, files)
+            _add_json(tar, IDS_MEMBER, ids, files)
+
+            # 3. Индекс предложений: без него восстановление заново векторизует все предложения
+            sentence_metadatas: List[Dict[str, Any]] = []
+            _add_vectors(tar, SENTENCE_VECTORS_MEMBER, sentence_collection, sentence_ids, sentence_dim,
+                         files, metadatas=sentence_metadatas)
+            _add_json(tar, SENTENCE_IDS_MEMBER, sentence_ids, files)
+            _add_json(tar, SENTENCE_METADATA_MEMBER, sentence_metadatas, files)
+
+            # 4. Манифест (последним - в нем контрольные суммы)
+            manifest = {
+                "format": SNAPSHOT_FORMAT,
+                "created_at": datetime.utcnow().isoformat(),
+                "embedding_model": model_name,
+                "dim": dim,
+                "vector_count": len(ids),
+                "sentence_dim": sentence_dim,
+                "sentence_count": len(sentence_ids),
+                "files": files
+            }
+            manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+            _add_stream(tar, MANIFEST_MEMBER, len(manifest_bytes), io.BytesIO(manifest_bytes))
+    finally:
+        lock_conn.execute("ROLLBACK")
+        lock_conn.close()
+
+    print(f"✅ Снапшот сохранен: {archive_path} ({len(ids)} векторов, "
+          f"{len(sentence_ids)} предложений, dim={dim})")
+    return manifest
+
+
+# ---------------- RESTORE ----------------
+
+def restore_snapshot(archive_path: Path, force: bool = False, batch_size: int = 1000,
+                     vector_store: Optional[VectorStore] = None) -> Dict[str, Any]:
+    """
+    vector_store - для сверки модели эмбеддингов снапшота с фактически
+    загруженной (по умолчанию создается свой).
+    """
+    db_path = _db_path()
+    staging_dir = db_path.parent / ".snapshot_restore"
+    if staging_dir.exists():
+        shutil.rmtree(staging_dir)
+    staging_dir.mkdir(parents=True)
+
+    try:
+        # 1. Распаковка потоком с подсчетом sha256
+        digests: Dict[str, str] = {}
+        manifest: Optional[Dict[str, Any]] = None
+
+        with tarfile.open(str(archive_path), mode="r|gz") as tar:
+            for member in tar:
+                if not member.isfile() or "/" in member.name or member.name.startswith("."):
+                    raise RuntimeError(f"Недопустимый элемент архива: {member.name}")
+                source = tar.extractfile(member)
+                if member.name == MANIFEST_MEMBER:
+                    manifest = json.loads(source.read().decode("utf-8"))
+                    continue
+                digest = hashlib.sha256()
+                with open(staging_dir / member.name, "wb") as out:
+                    for block in iter(lambda: source.read(READ_BLOCK), b""):
+                        digest.update(block)
+                        out.write(block)
+                digests[member.name] = digest.hexdigest()
+
+        # 2. Проверка манифеста и контрольных сумм
+        if manifest is None:
+            raise RuntimeError("В архиве нет manifest.json")
+        if manifest.get("format") not in SUPPORTED_FORMATS:
+            raise RuntimeError(f"Неподдерживаемый формат снапшота: {manifest.get('format')}")
+        for name, info in manifest["files"].items():
+            if digests.get(name) != info["sha256"]:
+                raise RuntimeError(f"Контрольная сумма не совпадает: {name}")
+        print("✅ Контрольные суммы совпадают")
+
+        # Сравнивается загруженная модель, а не EMBEDDING_MODEL: при ошибке загрузки
+        # VectorStore работает на запасной, и векторы запросов были бы из другой модели
+        model_name = (vector_store or VectorStore()).embedding_model_name
+        if manifest["embedding_model"] != model_name and not force:
+            raise RuntimeError(
+                f"Снапшот построен моделью {manifest['embedding_model']}, "
+                f"а загружена {model_name}. Используйте --force, если это ожидаемо"
+            )
+
+        # 3. Векторная БД: пустая коллекция
+        chroma_client = chromadb.PersistentClient(path=str(CHROMA_PERSIST_DIR))
+        existing = [c.name for c in chroma_client.list_collections()]
+        if COLLECTION_NAME in existing:
+            if chroma_client.get_collection(COLLECTION_NAME).count() and not force:
+                raise RuntimeError("Коллекция уже содержит данные. Используйте --force для перезаписи")
+            chroma_client.delete_collection(COLLECTION_NAME)
+        collection = chroma_client.create_collection(name=COLLECTION_NAME, metadata=COLLECTION_METADATA)
+
+        # 4. SQLite на место (атомарно), старые WAL/SHM удаляем
+        for suffix in ("-wal", "-shm"):
+            stale = Path(str(db_path) + suffix)
+            if stale.exists():
+                stale.unlink()
+        os.replace(staging_dir / DB_MEMBER, db_path)
+
+        # 5. Векторы через memmap - без загрузки всей матрицы в память
+        ids = json.loads((staging_dir / IDS_MEMBER).read_text(encoding="utf-8"))
+        count, dim = manifest["vector_count"], manifest["dim"]
+        restored = 0
+        chunks_by_id = _load_chunk_rows(db_path)
+        if count:
+            vectors = np.memmap(staging_dir / VECTORS_MEMBER, dtype=np.float32, mode="r", shape=(count, dim))
+
+            for start in range(0, count, batch_size):
+                batch_ids, batch_vectors, metadatas, documents = [], [], [], []
+                for row in range(start, min(start + batch_size, count)):
+                    chunk = chunks_by_id.get(ids[row])
+                    if chunk is None:
+                        continue  # вектор без чанка - не переносим
+                    batch_ids.append(ids[row])
+                    batch_vectors.append(vectors[row].tolist())
+                    metadatas.append(VectorStore.chunk_metadata(chunk, chunk["doc_id"], chunk["chunk_index"]))
+                    documents.append(VectorStore.chunk_document(chunk))
+                if batch_ids:
+                    collection.add(ids=batch_ids, embeddings=batch_vectors, metadatas=metadatas,
+                                   documents=documents if VECTOR_STORE_TEXT else None)
+                    restored += len(batch_ids)
+            del vectors
+
+        print(f"✅ Восстановлено {restored}/{count} векторов")
+
+        # 6. Центроиды разделов в архив не входят - строятся по восстановленным векторам
+        if SECTIONS_COLLECTION_NAME in existing:
+            chroma_client.delete_collection(SECTIONS_COLLECTION_NAME)
+        sections = chroma_client.create_collection(name=SECTIONS_COLLECTION_NAME, metadata=COLLECTION_METADATA)
+        section_count = index_sections(collection, sections)
+        print(f"✅ Разделов: {section_count}")
+
+        # 7. Индекс предложений: старый не соответствует новой SQLite - заменяется архивным
+        if SENTENCES_COLLECTION_NAME in existing:
+            chroma_client.delete_collection(SENTENCES_COLLECTION_NAME)
+        sentence_collection = chroma_client.create_collection(
+            name=SENTENCES_COLLECTION_NAME, metadata=COLLECTION_METADATA
+        )
+        sentences = _restore_sentences(staging_dir, manifest, sentence_collection, chunks_by_id, batch_size)
+        if manifest.get("sentence_count") is None and SENTENCE_INDEX:
+            print("ℹ️ Снапшот без индекса предложений: python -m app.consistency sentences")
+        else:
+            print(f"✅ Восстановлено {sentences}/{manifest['sentence_count']} предложений")
+        return {"restored_vectors": restored, "sections": section_count,
+                "restored_sentences": sentences, "manifest": manifest}
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def _restore_sentences(staging_dir: Path, manifest: Dict[str, Any], collection,
+                       chunks_by_id: Dict[str, Dict[str, Any]], batch_size: int) -> int:
+    """Векторы предложений из архива (upsert); предложения без родительского чанка пропускаются"""
+    count, dim = manifest.get("sentence_count") or 0, manifest.get("sentence_dim") or 0
+    if not count:
+        return 0
+    ids = json.loads((staging_dir / SENTENCE_IDS_MEMBER).read_text(encoding="utf-8"))
+    metadatas = json.loads((staging_dir / SENTENCE_METADATA_MEMBER).read_text(encoding="utf-8"))
+    vectors = np.memmap(staging_dir / SENTENCE_VECTORS_MEMBER, dtype=np.float32, mode="r", shape=(count, dim))
+    restored = 0
+    try:
+        for start in range(0, count, batch_size):
+            rows = [
+                row for row in range(start, min(start + batch_size, count))
+                if metadatas[row].get("parent_id") in chunks_by_id
+            ]
+            if rows:
+                collection.upsert(
+                    ids=[ids[row] for row in rows],
+                    embeddings=[vectors[row].tolist() for row in rows],
+                    metadatas=[metadatas[row] for row in rows]
+                )
+                restored += len(rows)
+    finally:
+        del vectors
+    return restored
+
+
+def _load_chunk_rows(db_path: Path) -> Dict[str, Dict[str, Any]]:
+    """Чанки из восстановленной SQLite по embedding_id"""
+    conn = sqlite3.connect(str(db_path))
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            "SELECT id, doc_id, content, page_number, chapter, paragraph, section_title, "
+            "chunk_index, embedding_id FROM chunks WHERE embedding_id IS NOT NULL"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {
+        row["embedding_id"]: {
+            "id": row["id"],
+            "doc_id": row["doc_id"],
+            "content": row["content"],
+            "page_number": row["page_number"] or 1,
+            "chapter": row["chapter"] or "",
+            "paragraph": row["paragraph"] or "",
+            "section_title": row["section_title"] or "",
+            "chunk_index": row["chunk_index"]
+        }
+        for row in rows
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Снапшот SQLite + векторного индекса")
+    parser.add_argument("command", choices=["export", "restore"])
+    parser.add_argument("archive", type=Path)
+    parser.add_argument("--force", action="store_true",
+                        help="перезаписать непустую коллекцию / игнорировать смену модели")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_snapshot(args.archive)
+    else:
+        restore_snapshot(args.archive, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
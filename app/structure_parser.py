@@ -0,0 +1,209 @@
+# app/structure_parser.py
+"""
+Структура учебника: главы и параграфы.
+
+StructureParser читает страницы по порядку и делит текст на куски
+по заголовкам «Глава N» и «§ N». Каждый кусок несет главу, параграф
+и название раздела - они попадают в каждый чанк (SQL и метаданные ChromaDB).
+Оглавление распознается отдельно: его строки не считаются заголовками,
+а названия из него подставляются, если в тексте у заголовка нет названия.
+
+make_scope строит фильтр поиска по документу, главе и параграфу.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+import re
+
+CHAPTER_RE = re.compile(r"^\s*(?:ГЛАВА|Глава)\s+([IVXLC]+|\d{1,3})\b\.?\s*(.*)$")
+PARAGRAPH_RE = re.compile(r"^\s*§\s*(\d{1,3})\b\.?\s*(.*)$")
+TOC_TITLE_RE = re.compile(r"^\s*(?:ОГЛАВЛЕНИЕ|Оглавление|СОДЕРЖАНИЕ|Содержание)\s*$")
+# Название и номер страницы в строке оглавления: «§ 3. Рим ........ 24»
+TOC_ENTRY_RE = re.compile(r"^(.*?\w.*?)[\s.…]*(?:\.{2,}|…|\s)\s*(\d{1,3})\s*$")
+
+# Строк оглавления на странице, чтобы считать ее оглавлением
+TOC_MIN_ENTRIES = 3
+# Название на следующей строке: короткая строка с заглавной без точки в конце
+TITLE_MAX_LEN = 60
+
+ROMAN = {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100}
+
+
+def _roman_to_int(value: str) -> int:
+    total = 0
+    for i, ch in enumerate(value):
+        number = ROMAN[ch]
+        if i + 1 < len(value) and ROMAN[value[i + 1]] > number:
+            total -= number
+        else:
+            total += number
+    return total
+
+
+def normalize_chapter(value: Optional[str]) -> str:
+    """«2», «глава 2», «Глава II.» -> «Глава 2»; без номера - как есть"""
+    if not value:
+        return ""
+    value = value.strip()
+    match = re.match(r"^(?:глава\s*)?([IVXLC]+|\d{1,3})\b", value, re.IGNORECASE)
+    if not match:
+        return value
+    number = match.group(1)
+    if not number.isdigit():
+        number = str(_roman_to_int(number.upper()))
+    return f"Глава {int(number)}"
+
+
+def normalize_paragraph(value: Optional[str]) -> str:
+    """«5», «§5», «§ 5. Рим» -> «§ 5»; без номера - как есть"""
+    if not value:
+        return ""
+    value = value.strip()
+    match = re.match(r"^§?\s*(\d{1,3})\b", value)
+    if not match:
+        return value
+    return f"§ {int(match.group(1))}"
+
+
+def make_scope(document_id: Optional[int] = None, chapter: Optional[str] = None,
+               paragraph: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """
+    Область поиска в терминах метаданных чанка (doc_id, chapter, paragraph).
+    None - искать по всем учебникам.
+    """
+    scope = {}
+    if document_id is not None:
+        scope["doc_id"] = str(document_id)
+    if chapter:
+        scope["chapter"] = normalize_chapter(chapter)
+    if paragraph:
+        scope["paragraph"] = normalize_paragraph(paragraph)
+    return scope or None
+
+
+class StructureParser:
+    """Заголовки глав и параграфов; текущий раздел переходит со страницы на страницу"""
+
+    def __init__(self):
+        self.chapter = ""
+        self.paragraph = ""
+        self.title = ""
+        self.toc: List[Dict[str, Any]] = []
+        self._toc_titles: Dict[Tuple[str, str], str] = {}
+        self._in_toc = False
+
+    @staticmethod
+    def match_heading(line: str) -> Optional[Tuple[str, str, str]]:
+        """Строка -> (chapter|paragraph, нормализованный ключ, название) или None"""
+        match = CHAPTER_RE.match(line)
+        if match:
+            return "chapter", normalize_chapter(match.group(1)), match.group(2).strip()
+        match = PARAGRAPH_RE.match(line)
+        if match:
+            return "paragraph", normalize_paragraph(match.group(1)), match.group(2).strip()
+        return None
+
+    # ---------- ОГЛАВЛЕНИЕ ----------
+
+    def _toc_entries(self, lines: List[str]) -> List[Dict[str, Any]]:
+        entries = []
+        chapter = ""
+        for line in lines:
+            heading = self.match_heading(line)
+            if heading is None:
+                continue
+            kind, key, title = heading
+            # Строка оглавления - заголовок с названием и номером страницы после него
+            entry = TOC_ENTRY_RE.match(title)
+            if entry is None:
+                continue
+            title, page = entry.group(1).strip(), entry.group(2)
+            if kind == "chapter":
+                chapter = key
+            entries.append({
+                "chapter": key if kind == "chapter" else chapter,
+                "paragraph": key if kind == "paragraph" else "",
+                "title": title,
+                "page": int(page)
+            })
+        return entries
+
+    def _read_toc(self, lines: List[str]) -> bool:
+        """Страница оглавления (или его продолжение): записывает строки, True - если это оглавление"""
+        has_title = any(TOC_TITLE_RE.match(line) for line in lines)
+        entries = self._toc_entries(lines)
+        is_toc = has_title or len(entries) >= TOC_MIN_ENTRIES or (self._in_toc and len(entries) >= 2)
+        self._in_toc = is_toc
+        if not is_toc:
+            return False
+
+        # В продолжении оглавления глава берется из предыдущей страницы
+        last_chapter = self.toc[-1]["chapter"] if self.toc else ""
+        for entry in entries:
+            if not entry["chapter"]:
+                entry["chapter"] = last_chapter
+            last_chapter = entry["chapter"]
+            self.toc.append(entry)
+            if entry["title"]:
+                self._toc_titles[(entry["chapter"], entry["paragraph"])] = entry["title"]
+                if entry["paragraph"]:
+                    self._toc_titles.setdefault(("", entry["paragraph"]), entry["title"])
+        return True
+
+    def _toc_title(self, chapter: str, paragraph: str) -> str:
+        return self._toc_titles.get((chapter, paragraph)) or self._toc_titles.get(("", paragraph), "")
+
+    # ---------- СТРАНИЦЫ ----------
+
+    def split_page(self, text: str) -> List[Dict[str, str]]:
+        """
+        Текст страницы -> куски [{chapter, paragraph, section_title, text}].
+        Строки заголовков в текст не входят; оглавление - пустой список.
+        """
+        lines = text.split("\n")
+        if self._read_toc(lines):
+            return []
+
+        segments = []
+        buffer: List[str] = []
+
+        def flush():
+            if any(line.strip() for line in buffer):
+                segments.append({
+                    "chapter": self.chapter,
+                    "paragraph": self.paragraph,
+                    "section_title": self.title,
+                    "text": "\n".join(buffer)
+                })
+            buffer.clear()
+
+        i = 0
+        while i < len(lines):
+            heading = self.match_heading(lines[i])
+            if heading is None:
+                buffer.append(lines[i])
+                i += 1
+                continue
+
+            kind, key, title = heading
+            # Название на следующей строке («Глава 3» / «Древний Рим»)
+            if not title and i + 1 < len(lines):
+                candidate = lines[i + 1].strip()
+                if (candidate and len(candidate) <= TITLE_MAX_LEN and candidate[0].isupper()
+                        and candidate[-1] not in ".,;:-" and self.match_heading(candidate) is None):
+                    title = candidate
+                    i += 1
+            i += 1
+
+            if kind == "chapter":
+                if key == self.chapter:
+                    continue  # колонтитул с названием текущей главы
+                flush()
+                self.chapter, self.paragraph = key, ""
+            else:
+                if key == self.paragraph:
+                    continue  # колонтитул с текущим параграфом
+                flush()
+                self.paragraph = key
+            self.title = title or self._toc_title(self.chapter, self.paragraph)
+
+        flush()
+        return segments
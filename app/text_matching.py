@@ -0,0 +1,146 @@
+# app/text_matching.py
+"""
+Поиск набора терминов в тексте: счетчики и позиции всех терминов за один вызов.
+
+Текст приводится к нижнему регистру один раз (а не на каждый термин),
+точное совпадение слова проверяется по позициям без склейки строк.
+Матчеры кэшируются по набору терминов - на запрос подготовка выполняется
+один раз.
+
+Стратегия выбирается по числу терминов: у re в CPython каждая позиция
+текста проверяется в Python-машине регулярных выражений, поэтому для
+типичного запроса (до нескольких десятков терминов) быстрее str.find
+на C; общий regex с префиксным деревом выигрывает на больших наборах.
+"""
+from typing import Dict, Iterable, List, Tuple
+from functools import lru_cache
+import re
+
+# С какого числа терминов один regex быстрее поиска str.find по каждому
+REGEX_MIN_TERMS = 64
+
+
+def _trie_pattern(terms: Iterable[str]) -> str:
+    """Альтернатива с общими префиксами: цезар(?:ь)? вместо цезарь|цезар"""
+    trie: Dict[str, dict] = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        is_end = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 and not is_end else "(?:" + "|".join(branches) + ")"
+        return body + "?" if is_end else body
+
+    return build(trie)
+
+
+class TermMatcher:
+    """
+    Находит все вхождения терминов (позиции) в тексте в нижнем регистре.
+    Вхождения считаются как у `term in text`: термин внутри более длинного
+    (цезар в цезарь) тоже найден.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self.terms: Tuple[str, ...] = tuple(sorted({t.lower() for t in terms if t}))
+        self.pattern = None
+        self.nested: Dict[str, List[str]] = {}
+
+        if len(self.terms) >= REGEX_MIN_TERMS:
+            # Опережающая проверка: совпадения ищутся с каждой позиции, в том числе
+            # перекрывающиеся (арома: аро и ром)
+            self.pattern = re.compile("(?=(" + _trie_pattern(self.terms) + "))")
+            # В одной позиции regex отдает самый длинный термин -
+            # его префиксы-термины (цезар для цезарь) добавляются отсюда
+            for term in self.terms:
+                prefixes = [other for other in self.terms if other != term and term.startswith(other)]
+                if prefixes:
+                    self.nested[term] = prefixes
+
+    def scan(self, text_lower: str) -> Dict[str, List[int]]:
+        """Термин -> позиции вхождений. Текст должен быть уже в нижнем регистре"""
+        found: Dict[str, List[int]] = {}
+
+        if self.pattern is None:
+            for term in self.terms:
+                start = text_lower.find(term)
+                if start == -1:
+                    continue
+                positions = found[term] = []
+                while start != -1:
+                    positions.append(start)
+                    start = text_lower.find(term, start + 1)
+            return found
+
+        for match in self.pattern.finditer(text_lower):
+            term = match.group(1)
+            start = match.start()
+            found.setdefault(term, []).append(start)
+            for prefix in self.nested.get(term, ()):
+                found.setdefault(prefix, []).append(start)
+        return found
+
+    @staticmethod
+    def is_whole_word(text_lower: str, term: str, positions: List[int]) -> bool:
+        """Есть ли вхождение, окруженное пробелами или границами текста"""
+        end_limit = len(text_lower)
+        for pos in positions:
+            end = pos + len(term)
+            if (pos == 0 or text_lower[pos - 1].isspace()) and (end == end_limit or text_lower[end].isspace()):
+                return True
+        return False
+
+
+_HYPHENATION_RE = re.compile(r"(\w)[-\u00ad]\s+(\w)")
+_NON_WORD_RE = re.compile(r"[^\w\s]|_")
+
+
+def normalize_search_text(text: str) -> str:
+    """
+    Нормализованный текст для лексического поиска (колонка Chunk.search_text):
+    нижний регистр, ё -> е, склеенные переносы, пунктуация -> пробел,
+    одиночные пробелы и пробел по краям (' слово ' - поиск целого слова).
+
+    SQLite сам не приводит кириллицу к нижнему регистру (ilike/lower только для ASCII),
+    поэтому регистр снимается один раз при записи, а запросы идут обычным LIKE.
+    """
+    text = text.lower().replace("ё", "е")
+    # Сначала переносы на границе строки (в том числе мягкие), потом мягкие внутри слова
+    text = _HYPHENATION_RE.sub(r"\1\2", text).replace("\u00ad", "")
+    text = _NON_WORD_RE.sub(" ", text)
+    return " " + " ".join(text.split()) + " "
+
+
+def normalize_term(term: str) -> str:
+    """Термин запроса в той же нормализации, что и search_text (без краевых пробелов)"""
+    return normalize_search_text(term).strip()
+
+
+LIKE_ESCAPE = "\\"
+
+
+def like_pattern(term: str) -> str:
+    """
+    Шаблон LIKE «содержит term» для column.like(..., escape=LIKE_ESCAPE):
+    % и _ - обычные символы, а не маски. normalize_term их и так убирает,
+    но термин, минуя нормализацию, не должен превращаться в маску.
+    """
+    for char in (LIKE_ESCAPE, "%", "_"):
+        term = term.replace(char, LIKE_ESCAPE + char)
+    return f"%{term}%"
+
+
+@lru_cache(maxsize=1024)
+def _cached_matcher(terms: Tuple[str, ...]) -> TermMatcher:
+    return TermMatcher(terms)
+
+
+def get_matcher(terms: Iterable[str]) -> TermMatcher:
+    """Матчер для набора терминов (кэшируется по набору)"""
+    return _cached_matcher(tuple(sorted({t.lower() for t in terms if t})))
@@ -0,0 +1,158 @@
+# app/tracing.py
+"""
+Трассировка запросов по стадиям и агрегированные метрики латентности.
+
+    with start_trace("ask") as trace:
+        with span("embed"):
+            ...
+    trace.as_dict()  # {"embed": 0.012, ...}
+
+Каждый span пишется в текущую трассу (contextvars) и в гистограмму
+stage_duration_seconds{stage=...}, которая отдается на /metrics в формате Prometheus.
+"""
+from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger("history_tutor.trace")
+
+# Границы корзин гистограмм (секунды): от миллисекунд до долгих ответов LLM
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Кумулятивная гистограмма в стиле Prometheus"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """Потокобезопасный реестр гистограмм: имя + метки -> Histogram"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None, help_text: str = ""):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if name not in self._help:
+                self._help[name] = help_text
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                if self._help.get(name):
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    base = [f'{k}="{_escape(v)}"' for k, v in key]
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        labels = ",".join(base + [f'le="{bound}"'])
+                        lines.append(f"{name}_bucket{{{labels}}} {count}")
+                    labels = ",".join(base + ['le="+Inf"'])
+                    lines.append(f"{name}_bucket{{{labels}}} {histogram.total}")
+                    suffix = "{" + ",".join(base) + "}" if base else ""
+                    lines.append(f"{name}_sum{suffix} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{suffix} {histogram.total}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = MetricsRegistry()
+
+
+class Trace:
+    """
+    Стадии одного запроса: имя стадии -> суммарное время (сек).
+    Стадии могут приходить из нескольких потоков (пул /ask/batch).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.total: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            result = {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+        if self.total is not None:
+            result["total"] = round(self.total, 4)
+        return result
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name: str):
+    """Открывает трассу запроса; по выходу пишет итог в метрики и лог"""
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.total = time.perf_counter() - trace.started
+        metrics.observe(
+            "request_duration_seconds", trace.total, {"request": name},
+            "Полное время обработки запроса"
+        )
+        logger.info(json.dumps({"trace": name, "stages": trace.as_dict()}, ensure_ascii=False))
+
+
+def record_stage(stage: str, seconds: float):
+    """Записывает уже измеренное время стадии (например, накопленное в цикле)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+    metrics.observe(
+        "stage_duration_seconds", seconds, {"stage": stage},
+        "Время стадии обработки запроса"
+    )
+
+
+@contextmanager
+def span(stage: str):
+    """Замеряет стадию; время попадает в текущую трассу и в гистограмму стадии"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
@@ -1,12 +1,120 @@
 import chromadb
 from sentence_transformers import SentenceTransformer
 from typing import List, Dict, Any, Optional
-import uuid
+import hashlib
 import os
 import re
 from collections import Counter
 
-from .config import CHROMA_PERSIST_DIR, EMBEDDING_MODEL
+import numpy as np
+
+from .config import (
+    CHROMA_PERSIST_DIR, EMBEDDING_MODEL,
+    EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_PATH, EMBEDDING_BATCH_SIZE,
+    HIERARCHICAL_SEARCH, HIERARCHICAL_MIN_SECTIONS, SECTION_FANOUT, SECTION_CHUNKS,
+    SENTENCE_MIN_CHARS, SENTENCE_TOP_K, SENTENCE_WINDOW, VECTOR_STORE_TEXT
+)
+from .context_builder import split_sentences
+from .embedding_cache import EmbeddingCache
+from .query_expansion import LocalQueryExpander, STOP_WORDS
+from .text_matching import LIKE_ESCAPE, get_matcher, like_pattern, normalize_term
+from .tracing import span
+
+COLLECTION_NAME = "history_textbooks"
+COLLECTION_METADATA = {"hnsw:space": "cosine"}
+# Центроиды разделов (параграфов) - первый уровень поиска
+SECTIONS_COLLECTION_NAME = "history_sections"
+# Предложения чанков со ссылкой на родительский чанк (small-to-big)
+SENTENCES_COLLECTION_NAME = "history_sentences"
+
+
+def collection_ids(collection, where: Optional[Dict] = None, page_size: int = 5000) -> List[str]:
+    """Все ID коллекции ChromaDB (с фильтром where) постранично"""
+    all_ids = []
+    offset = 0
+    while True:
+        page = collection.get(where=where, include=[], limit=page_size, offset=offset)
+        page_ids = page.get("ids") or []
+        all_ids.extend(page_ids)
+        if len(page_ids) < page_size:
+            break
+        offset += page_size
+    return all_ids
+
+
+def index_sections(collection, sections, doc_id: Optional[int] = None, page_size: int = 1000) -> int:
+    """
+    Пересчитывает центроиды разделов по векторам чанков документа (или всех документов):
+    нормированное среднее векторов чанков раздела.
+    Чанкам, проиндексированным до появления разделов, section_id дописывается в метаданные.
+    Возвращает число разделов.
+    """
+    where = {"doc_id": str(doc_id)} if doc_id is not None else None
+    sums: Dict[str, np.ndarray] = {}
+    section_meta: Dict[str, Dict[str, Any]] = {}
+
+    offset = 0
+    while True:
+        page = collection.get(where=where, include=["embeddings", "metadatas"],
+                              limit=page_size, offset=offset)
+        page_ids = page.get("ids") or []
+        backfill_ids, backfill_metadatas = [], []
+        for emb_id, vector, meta in zip(page_ids, page["embeddings"], page["metadatas"]):
+            sec_id = meta.get("section_id")
+            if not sec_id:
+                sec_id = VectorStore.make_section_id(
+                    meta.get("doc_id"), meta.get("chapter", ""), meta.get("paragraph", ""),
+                    int(meta.get("chunk_index", 0))
+                )
+                backfill_ids.append(emb_id)
+                backfill_metadatas.append(dict(meta, section_id=sec_id))
+
+            vector = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector = vector / norm
+            if sec_id in sums:
+                sums[sec_id] += vector
+                section_meta[sec_id]["chunk_count"] += 1
+            else:
+                sums[sec_id] = vector.copy()
+                section_meta[sec_id] = {
+                    "doc_id": meta.get("doc_id", ""),
+                    "chapter": meta.get("chapter", ""),
+                    "paragraph": meta.get("paragraph", ""),
+                    "section_title": meta.get("section_title", ""),
+                    "chunk_count": 1
+                }
+        if backfill_ids:
+            collection.update(ids=backfill_ids, metadatas=backfill_metadatas)
+        if len(page_ids) < page_size:
+            break
+        offset += page_size
+
+    # Разделы, которых больше нет (документ переиндексирован или удален частично)
+    stale = set(collection_ids(sections, where=where)) - set(sums)
+    if stale:
+        sections.delete(ids=list(stale))
+
+    section_ids = list(sums)
+    batch_size = 500
+    for i in range(0, len(section_ids), batch_size):
+        batch = section_ids[i:i + batch_size]
+        embeddings = []
+        for sec_id in batch:
+            centroid = sums[sec_id]
+            norm = np.linalg.norm(centroid)
+            embeddings.append((centroid / norm if norm else centroid).tolist())
+        sections.upsert(
+            ids=batch,
+            embeddings=embeddings,
+            metadatas=[
+                {key: str(value) for key, value in section_meta[sec_id].items()}
+                for sec_id in batch
+            ]
+        )
+    return len(section_ids)
+
 
 class VectorStore:
     def __init__(self):
@@ -26,64 +134,281 @@ class VectorStore:
         
         # Пробуем получить существующую коллекцию или создаем новую
         try:
-            self.collection = self.chroma_client.get_collection("history_textbooks")
+            self.collection = self.chroma_client.get_collection(COLLECTION_NAME)
             print(f"📚 Загружена существующая коллекция, чанков: {self.collection.count()}")
         except:
             self.collection = self.chroma_client.create_collection(
-                name="history_textbooks",
-                metadata={"hnsw:space": "cosine"}
+                name=COLLECTION_NAME,
+                metadata=COLLECTION_METADATA
             )
             print("✅ Создана новая коллекция")
         
+        # Центроиды разделов для двухуровневого поиска
+        self.section_collection = self.chroma_client.get_or_create_collection(
+            name=SECTIONS_COLLECTION_NAME,
+            metadata=COLLECTION_METADATA
+        )
+        # (число чанков, число разделов) -> готовы ли разделы; см. sections_ready
+        self._sections_state = None
+        # Предложения чанков: вектор и ссылка на родительский чанк, текст - в SQLite
+        self.sentence_collection = self.chroma_client.get_or_create_collection(
+            name=SENTENCES_COLLECTION_NAME,
+            metadata=COLLECTION_METADATA
+        )
+        
         # Инициализируем модель для эмбеддингов
         print(f"🔄 Загружаем модель эмбеддингов: {EMBEDDING_MODEL}")
         try:
             self.embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+            self.embedding_model_name = EMBEDDING_MODEL
             print(f"✅ Модель загружена, размерность: {self.embedding_model.get_sentence_embedding_dimension()}")
         except Exception as e:
             print(f"⚠️ Ошибка загрузки модели: {e}")
             print("🔄 Пробуем загрузить английскую модель...")
             self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.embedding_model_name = 'all-MiniLM-L6-v2'
             print("✅ Загружена английская модель")
+        
+        # Кэш эмбеддингов привязан к фактически загруженной модели
+        self.embedding_cache = None
+        if EMBEDDING_CACHE_ENABLED:
+            try:
+                self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, self.embedding_model_name)
+                print(f"✅ Кэш эмбеддингов: {EMBEDDING_CACHE_PATH}")
+            except Exception as e:
+                print(f"⚠️ Кэш эмбеддингов недоступен: {e}")
+        
+        # Локальное расширение запросов (словарь имен загружается лениво)
+        self.query_expander = LocalQueryExpander()
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        Возвращает эмбеддинги текстов.
+        Сначала ищет их в дисковом кэше, модель вызывается только для промахов (одним батчем).
+        """
+        if not texts:
+            return []
+        
+        if self.embedding_cache is None:
+            return self.embedding_model.encode(
+                texts, batch_size=EMBEDDING_BATCH_SIZE, show_progress_bar=False
+            ).tolist()
+        
+        hashes = [EmbeddingCache.content_hash(t) for t in texts]
+        cached = self.embedding_cache.get_many(hashes)
+        
+        # Уникальные тексты, которых нет в кэше
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        
+        if missing:
+            encoded = self.embedding_model.encode(
+                list(missing.values()), batch_size=EMBEDDING_BATCH_SIZE, show_progress_bar=False
+            ).tolist()
+            new_vectors = dict(zip(missing.keys(), encoded))
+            self.embedding_cache.put_many(new_vectors)
+            cached.update(new_vectors)
+        
+        print(f"  💾 Кэш эмбеддингов: {len(texts) - len(missing)}/{len(texts)} из кэша")
+        return [cached[h] for h in hashes]
+    
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Эмбеддинги вопросов одним вызовом модели (без дискового кэша - он для чанков)"""
+        if not queries:
+            return []
+        with span("embed"):
+            return self.embedding_model.encode(
+                queries, batch_size=EMBEDDING_BATCH_SIZE, show_progress_bar=False
+            ).tolist()
+    
+    @staticmethod
+    def make_embedding_id(doc_id: int, chunk_index: int) -> str:
+        """
+        ID эмбеддинга чанка.
+        Детерминирован, поэтому повторная индексация того же чанка идемпотентна.
+        """
+        return f"doc{doc_id}_chunk{chunk_index}"
+    
+    @staticmethod
+    def make_section_id(doc_id, chapter: str, paragraph: str, chunk_index: int) -> str:
+        """
+        ID раздела чанка: глава и параграф, а в тексте без них - блок
+        из SECTION_CHUNKS чанков подряд. Считается по одному чанку,
+        поэтому доиндексация части документа попадает в те же разделы.
+        """
+        if chapter or paragraph:
+            key = hashlib.md5(f"{chapter}|{paragraph}".encode("utf-8")).hexdigest()[:10]
+            return f"doc{doc_id}_sec{key}"
+        return f"doc{doc_id}_block{chunk_index // SECTION_CHUNKS}"
+    
+    @staticmethod
+    def make_sentence_id(parent_id: str, sentence_index: int) -> str:
+        """ID предложения: ID эмбеддинга чанка и номер предложения в нем (split_sentences)"""
+        return f"{parent_id}_s{sentence_index}"
+    
+    @staticmethod
+    def chunk_metadata(chunk: Dict[str, Any], doc_id: int, chunk_index: int) -> Dict[str, str]:
+        """
+        Метаданные чанка для ChromaDB (все значения должны быть строками).
+        chunk_id (chunks.id) - в обоих режимах: по нему читаются строки из SQLite
+        и склеиваются дубли гибридного поиска (merge_key).
+        Без текста в индексе (VECTOR_STORE_TEXT = False) - только поля фильтров
+        и chunk_id: страница и название раздела читаются из SQLite.
+        """
+        chapter = str(chunk.get("chapter", ""))[:100]
+        paragraph = str(chunk.get("paragraph", ""))[:100]
+        metadata = {
+            "doc_id": str(doc_id),
+            "chunk_index": str(chunk_index),
+            "chapter": chapter,
+            "paragraph": paragraph,
+            "section_id": VectorStore.make_section_id(doc_id, chapter, paragraph, chunk_index)
+        }
+        if chunk.get("id") is not None:
+            metadata["chunk_id"] = str(chunk["id"])
+        if VECTOR_STORE_TEXT:
+            metadata.update({
+                "page_number": str(chunk.get("page_number", 1)),
+                "section_title": str(chunk.get("section_title", ""))[:200],
+                "id": str(chunk.get("id", chunk_index))  # как id в result_metadata
+            })
+        return metadata
+    
+    @staticmethod
+    def chunk_document(chunk: Dict[str, Any]) -> Optional[str]:
+        """Текст чанка, который хранится в ChromaDB (None - текст только в SQLite)"""
+        if not VECTOR_STORE_TEXT:
+            return None
+        return chunk["content"][:1000]  # Ограничиваем длину для ChromaDB
     
-    def add_chunks(self, chunks: List[Dict[str, Any]], doc_id: int) -> List[str]:
+    @staticmethod
+    def result_metadata(chunk) -> Dict[str, Any]:
+        """Метаданные найденного чанка по строке chunks (как у лексического поиска)"""
+        return {
+            'doc_id': str(chunk.doc_id),
+            'chunk_index': str(chunk.chunk_index),
+            'page_number': str(chunk.page_number),
+            'chapter': chunk.chapter or '',
+            'paragraph': chunk.paragraph or '',
+            'section_title': chunk.section_title or '',
+            'id': chunk.id,
+            'chunk_id': str(chunk.id)
+        }
+    
+    @staticmethod
+    def merge_key(meta: Dict[str, Any]) -> tuple:
+        """
+        Ключ чанка для склейки результатов разных поисков: chunks.id,
+        для векторов старого индекса без chunk_id - (doc_id, chunk_index)
+        """
+        if meta.get('chunk_id'):
+            return ('chunk', str(meta['chunk_id']))
+        return ('position', str(meta.get('doc_id', '')), str(meta.get('chunk_index', '')))
+    
+    def load_chunks(self, metadatas: List[Dict[str, Any]], db=None) -> List[Any]:
+        """
+        Строки chunks для метаданных ChromaDB (по порядку, None - строки нет):
+        по chunk_id одним WHERE id IN (...); для индекса без chunk_id -
+        по (doc_id, chunk_index).
+        db - сессия запроса; если не передана, открывается своя.
+        """
+        from .database import SessionLocal, Chunk
+        from sqlalchemy import tuple_
+        
+        chunk_ids = {int(m["chunk_id"]) for m in metadatas if m.get("chunk_id")}
+        positions = {
+            (int(m["doc_id"]), int(m["chunk_index"])) for m in metadatas if not m.get("chunk_id")
+        }
+        
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            by_id, by_position = {}, {}
+            if chunk_ids:
+                for chunk in db.query(Chunk).filter(Chunk.id.in_(chunk_ids)).all():
+                    by_id[chunk.id] = chunk
+            if positions:
+                rows = db.query(Chunk).filter(tuple_(Chunk.doc_id, Chunk.chunk_index).in_(positions)).all()
+                for chunk in rows:
+                    by_position[(chunk.doc_id, chunk.chunk_index)] = chunk
+        finally:
+            if own_session:
+                db.close()
+        
+        return [
+            by_id.get(int(m["chunk_id"])) if m.get("chunk_id")
+            else by_position.get((int(m["doc_id"]), int(m["chunk_index"])))
+            for m in metadatas
+        ]
+    
+    def hydrate_results(self, results: Dict, db=None) -> Dict:
+        """
+        Результат запроса ChromaDB -> тексты и метаданные чанков из SQLite.
+        Векторы без строки в chunks (сироты) из выдачи убираются.
+        Результат запроса с несколькими эмбеддингами читается одним запросом к SQLite.
+        """
+        with span("hydrate"):
+            rows = self.load_chunks([m for metas in results["metadatas"] for m in metas], db=db)
+        hydrated = {"ids": [], "documents": [], "metadatas": []}
+        if results.get("distances"):
+            hydrated["distances"] = []
+        offset = 0
+        for r, metas in enumerate(results["metadatas"]):
+            chunks = rows[offset:offset + len(metas)]
+            offset += len(metas)
+            keep = [i for i, row in enumerate(chunks) if row is not None]
+            hydrated["ids"].append([results["ids"][r][i] for i in keep])
+            hydrated["documents"].append([chunks[i].content for i in keep])
+            hydrated["metadatas"].append([self.result_metadata(chunks[i]) for i in keep])
+            if "distances" in hydrated:
+                hydrated["distances"].append([results["distances"][r][i] for i in keep])
+        return hydrated
+    
+    @staticmethod
+    def split_results(results: Optional[Dict], count: int) -> List[Optional[Dict]]:
+        """Результат запроса с count эмбеддингами -> count результатов в формате search"""
+        if not results:
+            return [None] * count
+        keys = [key for key in ("ids", "documents", "metadatas", "distances") if results.get(key) is not None]
+        return [{key: [results[key][i]] for key in keys} for i in range(count)]
+    
+    def add_chunks(self, chunks: List[Dict[str, Any]], doc_id: int,
+                   ids: Optional[List[str]] = None) -> List[str]:
         """
-        Добавляет чанки в векторную БД.
-        Возвращает список ID эмбеддингов.
+        Добавляет (upsert) чанки в векторную БД.
+        ids - заранее назначенные ID эмбеддингов (по одному на чанк).
+        Возвращает ID эмбеддингов, которые действительно записаны в коллекцию.
         """
         if not chunks:
             return []
         
         embeddings = []
         metadatas = []
-        ids = []
+        chunk_ids = []
         documents = []
         
         print(f"🔄 Добавляем {len(chunks)} чанков в ChromaDB...")
         
+        # Эмбеддинги всех чанков одним батчем (с учетом кэша)
+        with span("embed_chunks"):
+            chunk_embeddings = self.embed_texts([chunk["content"] for chunk in chunks])
+        
         for i, chunk in enumerate(chunks):
             try:
-                # Генерируем уникальный ID
-                chunk_id = f"doc{doc_id}_chunk{i}_{uuid.uuid4().hex[:8]}"
+                chunk_index = chunk.get("chunk_index", i)
                 
-                # Создаем эмбеддинг
-                embedding = self.embedding_model.encode(chunk["content"]).tolist()
+                # Берем заранее назначенный ID или строим его по номеру чанка
+                chunk_id = ids[i] if ids else self.make_embedding_id(doc_id, chunk_index)
                 
-                # Подготавливаем метаданные (все значения должны быть строками)
-                metadata = {
-                    "doc_id": str(doc_id),
-                    "chunk_index": str(i),
-                    "page_number": str(chunk.get("page_number", 1)),
-                    "chapter": str(chunk.get("chapter", ""))[:100],
-                    "paragraph": str(chunk.get("paragraph", ""))[:100],
-                    "section_title": str(chunk.get("section_title", ""))[:200],
-                    "id": str(i)  # Добавляем ID для поиска
-                }
+                embedding = chunk_embeddings[i]
                 
                 embeddings.append(embedding)
-                metadatas.append(metadata)
-                ids.append(chunk_id)
-                documents.append(chunk["content"][:1000])  # Ограничиваем длину для ChromaDB
+                metadatas.append(self.chunk_metadata(chunk, doc_id, chunk_index))
+                chunk_ids.append(chunk_id)
+                documents.append(self.chunk_document(chunk))
                 
                 if i % 50 == 0 and i > 0:
                     print(f"  ⏳ Обработано {i}/{len(chunks)} чанков")
@@ -91,38 +416,145 @@ class VectorStore:
             except Exception as e:
                 print(f"⚠️ Ошибка подготовки чанка {i}: {e}")
         
-        # Добавляем в коллекцию батчами по 100
+        # Добавляем в коллекцию батчами по 100.
+        # upsert вместо add: повторный запуск после сбоя не падает на существующих ID
         batch_size = 100
-        added_count = 0
+        added_ids = []
         
-        for i in range(0, len(embeddings), batch_size):
-            try:
+        with span("vector_upsert"):
+            for i in range(0, len(embeddings), batch_size):
                 batch_end = min(i + batch_size, len(embeddings))
-                self.collection.add(
-                    embeddings=embeddings[i:batch_end],
-                    metadatas=metadatas[i:batch_end],
-                    ids=ids[i:batch_end],
-                    documents=documents[i:batch_end]
-                )
-                added_count += (batch_end - i)
-                print(f"  ✓ Добавлен батч {i//batch_size + 1}/{(len(embeddings)-1)//batch_size + 1}")
-            except Exception as e:
-                print(f"  ✗ Ошибка добавления батча: {e}")
-                # Пробуем добавить по одному
-                for j in range(i, min(i + batch_size, len(embeddings))):
-                    try:
-                        self.collection.add(
-                            embeddings=[embeddings[j]],
-                            metadatas=[metadatas[j]],
-                            ids=[ids[j]],
-                            documents=[documents[j]]
-                        )
-                        added_count += 1
-                    except Exception as e2:
-                        print(f"    ✗ Ошибка добавления чанка {j}: {e2}")
-        
-        print(f"✅ Успешно добавлено {added_count}/{len(chunks)} чанков в ChromaDB")
-        return ids[:added_count]
+                try:
+                    self.collection.upsert(
+                        embeddings=embeddings[i:batch_end],
+                        metadatas=metadatas[i:batch_end],
+                        ids=chunk_ids[i:batch_end],
+                        documents=documents[i:batch_end] if VECTOR_STORE_TEXT else None
+                    )
+                    added_ids.extend(chunk_ids[i:batch_end])
+                    print(f"  ✓ Добавлен батч {i//batch_size + 1}/{(len(embeddings)-1)//batch_size + 1}")
+                except Exception as e:
+                    print(f"  ✗ Ошибка добавления батча: {e}")
+                    # Пробуем добавить по одному
+                    for j in range(i, batch_end):
+                        try:
+                            self.collection.upsert(
+                                embeddings=[embeddings[j]],
+                                metadatas=[metadatas[j]],
+                                ids=[chunk_ids[j]],
+                                documents=[documents[j]] if VECTOR_STORE_TEXT else None
+                            )
+                            added_ids.append(chunk_ids[j])
+                        except Exception as e2:
+                            print(f"    ✗ Ошибка добавления чанка {j}: {e2}")
+        
+        print(f"✅ Успешно добавлено {len(added_ids)}/{len(chunks)} чанков в ChromaDB")
+        return added_ids
+    
+    def add_sentences(self, chunks: List[Dict[str, Any]], doc_id: int,
+                      ids: Optional[List[str]] = None) -> int:
+        """
+        Индексирует предложения чанков (upsert) для поиска small-to-big.
+        В метаданных - родительский чанк и номер предложения: сам текст
+        не хранится, окно вокруг предложения берется из чанка в SQLite.
+        ids - ID эмбеддингов чанков (по одному на чанк), как в add_chunks.
+        Возвращает число записанных предложений.
+        """
+        sentence_ids, texts, metadatas = [], [], []
+        for i, chunk in enumerate(chunks):
+            chunk_index = chunk.get("chunk_index", i)
+            parent_id = ids[i] if ids else self.make_embedding_id(doc_id, chunk_index)
+            parent_meta = self.chunk_metadata(chunk, doc_id, chunk_index)
+            for j, sentence in self.indexable_sentences(chunk["content"]):
+                sentence_ids.append(self.make_sentence_id(parent_id, j))
+                texts.append(sentence)
+                metadatas.append({
+                    "doc_id": parent_meta["doc_id"],
+                    "chunk_index": parent_meta["chunk_index"],
+                    "chapter": parent_meta["chapter"],
+                    "paragraph": parent_meta["paragraph"],
+                    "section_id": parent_meta["section_id"],
+                    "chunk_id": parent_meta.get("chunk_id", ""),
+                    "parent_id": parent_id,
+                    "sentence_index": str(j)
+                })
+        if not sentence_ids:
+            return 0
+        
+        print(f"🔄 Индексируем {len(sentence_ids)} предложений...")
+        with span("embed_sentences"):
+            embeddings = self.embed_texts(texts)
+        
+        batch_size = 500
+        added = 0
+        with span("sentence_upsert"):
+            for i in range(0, len(sentence_ids), batch_size):
+                try:
+                    self.sentence_collection.upsert(
+                        ids=sentence_ids[i:i + batch_size],
+                        embeddings=embeddings[i:i + batch_size],
+                        metadatas=metadatas[i:i + batch_size]
+                    )
+                    added += len(sentence_ids[i:i + batch_size])
+                except Exception as e:
+                    print(f"  ✗ Ошибка добавления предложений: {e}")
+        print(f"✅ Предложений в индексе: {added}/{len(sentence_ids)}")
+        return added
+    
+    @staticmethod
+    def indexable_sentences(content: str) -> List[tuple]:
+        """Предложения чанка, которые попадают в индекс: [(номер, текст)]"""
+        return [
+            (j, sentence) for j, sentence in enumerate(split_sentences(content))
+            if len(sentence) >= SENTENCE_MIN_CHARS
+        ]
+    
+    def index_coverage(self, doc_id: int) -> Dict[str, int]:
+        """
+        Векторы документа в производных коллекциях: чанков, покрытых центроидами
+        разделов (сумма chunk_count), и предложений.
+        """
+        where = {"doc_id": str(doc_id)}
+        metadatas = self.section_collection.get(where=where, include=["metadatas"])["metadatas"]
+        return {
+            "section_chunks": sum(int(m.get("chunk_count", 0)) for m in metadatas),
+            "sentences": len(collection_ids(self.sentence_collection, where=where))
+        }
+    
+    def get_all_ids(self, doc_id: Optional[int] = None, page_size: int = 5000) -> List[str]:
+        """Возвращает все ID эмбеддингов коллекции (или одного документа) постранично"""
+        where = {"doc_id": str(doc_id)} if doc_id is not None else None
+        return collection_ids(self.collection, where=where, page_size=page_size)
+    
+    def delete_ids(self, ids: List[str], batch_size: int = 500):
+        """Удаляет эмбеддинги по ID (центроиды разделов обновляет index_sections)"""
+        for i in range(0, len(ids), batch_size):
+            self.collection.delete(ids=ids[i:i + batch_size])
+            self.sentence_collection.delete(where={"parent_id": {"$in": ids[i:i + batch_size]}})
+    
+    def index_sections(self, doc_id: Optional[int] = None) -> int:
+        """Центроиды разделов документа (или всех документов) по векторам его чанков"""
+        with span("index_sections"):
+            count = index_sections(self.collection, self.section_collection, doc_id)
+        print(f"🧭 Разделов в индексе{'' if doc_id is None else f' документа {doc_id}'}: {count}")
+        return count
+    
+    def sections_ready(self) -> bool:
+        """
+        Разделы покрывают все чанки коллекции (сумма chunk_count = числу векторов).
+        Иначе (индекс до появления разделов, прерванная индексация) - плоский поиск.
+        Результат кэшируется, пока не изменится число чанков или разделов.
+        """
+        counts = (self.collection.count(), self.section_collection.count())
+        if self._sections_state is not None and self._sections_state[0] == counts:
+            return self._sections_state[1]
+        
+        ready = False
+        if counts[1]:
+            metadatas = self.section_collection.get(include=["metadatas"])["metadatas"]
+            ready = sum(int(m.get("chunk_count", 0)) for m in metadatas) == counts[0]
+        self._sections_state = (counts, ready)
+        return ready
     
     def get_collection_stats(self):
         """Возвращает статистику коллекции"""
@@ -130,28 +562,140 @@ class VectorStore:
             count = self.collection.count()
             return {
                 "total_chunks": count,
+                "total_sections": self.section_collection.count(),
+                "total_sentences": self.sentence_collection.count(),
+                "hierarchical_search": (HIERARCHICAL_SEARCH and self.sections_ready() and
+                                        self.section_collection.count() >= HIERARCHICAL_MIN_SECTIONS),
                 "collection_name": self.collection.name,
                 "status": "active"
             }
         except Exception as e:
             return {
                 "total_chunks": 0,
-                "collection_name": "history_textbooks",
+                "collection_name": COLLECTION_NAME,
                 "status": f"error: {e}"
             }
     
-    def search(self, query: str, n_results: int = 5) -> Optional[Dict]:
-        """Поиск похожих чанков"""
+    @staticmethod
+    def scope_where(scope: Optional[Dict[str, str]]) -> Optional[Dict]:
+        """Область поиска (structure_parser.make_scope) -> фильтр where ChromaDB"""
+        if not scope:
+            return None
+        conditions = [{key: value} for key, value in scope.items()]
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+    
+    @staticmethod
+    def scope_filters(scope: Optional[Dict[str, str]]) -> list:
+        """Область поиска -> условия SQLAlchemy для таблицы chunks"""
+        from .database import Chunk
+        
+        if not scope:
+            return []
+        filters = []
+        if "doc_id" in scope:
+            filters.append(Chunk.doc_id == int(scope["doc_id"]))
+        if "chapter" in scope:
+            filters.append(Chunk.chapter == scope["chapter"])
+        if "paragraph" in scope:
+            filters.append(Chunk.paragraph == scope["paragraph"])
+        return filters
+    
+    @staticmethod
+    def _query_batch(collection, query_embeddings: List[List[float]], n_results: int,
+                     where: Optional[Dict] = None, include: Optional[List[str]] = None) -> Optional[Dict]:
+        """
+        Запрос к коллекции сразу по нескольким эмбеддингам (строка результата на эмбеддинг);
+        с фильтром where - не больше соседей, чем подходящих записей
+        """
+        include = ["metadatas", "documents", "distances"] if include is None else include
         try:
-            # Создаем эмбеддинг запроса
-            query_embedding = self.embedding_model.encode(query).tolist()
-            
-            # Ищем похожие чанки
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
+            return collection.query(
+                query_embeddings=query_embeddings,
                 n_results=n_results,
-                include=["metadatas", "documents", "distances"]
+                where=where,
+                include=include
+            )
+        except RuntimeError:
+            if where is None:
+                raise
+            # hnswlib не отдает больше соседей, чем записей под фильтром
+            available = len(collection_ids(collection, where=where))
+            if not available:
+                return None
+            return collection.query(
+                query_embeddings=query_embeddings,
+                n_results=min(n_results, available),
+                where=where,
+                include=include
             )
+    
+    @classmethod
+    def _query(cls, collection, query_embedding: List[float], n_results: int,
+               where: Optional[Dict] = None, include: Optional[List[str]] = None) -> Optional[Dict]:
+        return cls._query_batch(collection, [query_embedding], n_results, where=where, include=include)
+    
+    def _select_sections(self, query_embedding: List[float], where: Optional[Dict],
+                         fanout: int) -> Optional[List[str]]:
+        """
+        Первый уровень: fanout ближайших к запросу разделов.
+        None - разделов не больше fanout, и отбор ничего не сокращает.
+        """
+        if self.section_collection.count() <= fanout:
+            return None
+        with span("section_query"):
+            sections = self._query(self.section_collection, query_embedding, fanout, where=where, include=[])
+        if not sections or not sections["ids"][0]:
+            return None
+        return sections["ids"][0]
+    
+    def search(self, query: str, n_results: int = 5,
+               scope: Optional[Dict[str, str]] = None,
+               hierarchical: Optional[bool] = None,
+               fanout: Optional[int] = None, db=None,
+               query_embedding: Optional[List[float]] = None) -> Optional[Dict]:
+        """
+        Поиск похожих чанков.
+        scope - область поиска (документ, глава, параграф): ChromaDB сравнивает
+        запрос только с чанками раздела, а не со всем корпусом.
+        hierarchical - сначала fanout ближайших разделов (центроиды параграфов),
+        затем чанки только внутри них. None - по HIERARCHICAL_SEARCH, когда разделов
+        в индексе не меньше HIERARCHICAL_MIN_SECTIONS; fanout по умолчанию SECTION_FANOUT.
+        Если в выбранных разделах чанков меньше n_results - обычный поиск.
+        Без текста в индексе (VECTOR_STORE_TEXT = False) тексты и метаданные найденных
+        чанков читаются из SQLite (db - сессия запроса; если не передана, открывается своя).
+        query_embedding - готовый эмбеддинг запроса (search_batch).
+        """
+        try:
+            # Создаем эмбеддинг запроса
+            if query_embedding is None:
+                with span("embed"):
+                    query_embedding = self.embedding_model.encode(query).tolist()
+            
+            where = self.scope_where(scope)
+            
+            if hierarchical is None:
+                hierarchical = self.hierarchical_default()
+            section_ids = None
+            if hierarchical and self.sections_ready():
+                section_ids = self._select_sections(query_embedding, where, fanout or SECTION_FANOUT)
+            
+            results = None
+            if section_ids:
+                # Разделы уже отобраны с учетом scope - фильтр только по ним
+                with span("vector_query"):
+                    results = self._query(self.collection, query_embedding, n_results,
+                                          where={"section_id": {"$in": section_ids}})
+                if not results or len(results["ids"][0]) < n_results:
+                    results = None
+            
+            if results is None:
+                # Ищем похожие чанки по всему корпусу (области поиска)
+                with span("vector_query"):
+                    results = self._query(self.collection, query_embedding, n_results, where=where)
+            
+            # Тексты - только для итогового топа, одним запросом
+            if results and not VECTOR_STORE_TEXT:
+                results = self.hydrate_results(results, db=db)
             
             return results
         except Exception as e:
@@ -160,12 +704,134 @@ class VectorStore:
             traceback.print_exc()
             return None
     
+    def hierarchical_default(self) -> bool:
+        """Двухуровневый поиск по умолчанию: включен в config и разделов достаточно"""
+        return HIERARCHICAL_SEARCH and self.section_collection.count() >= HIERARCHICAL_MIN_SECTIONS
+    
+    def search_batch(self, queries: List[str], n_results: int = 5,
+                     scope: Optional[Dict[str, str]] = None, db=None,
+                     embeddings: Optional[List[List[float]]] = None) -> List[Optional[Dict]]:
+        """
+        Векторный поиск для списка вопросов (одна область поиска): эмбеддинги -
+        одним батчем, соседи - одним запросом к ChromaDB, тексты - одним чтением SQLite.
+        При двухуровневом поиске разделы у каждого вопроса свои - запросы по одному,
+        но без повторного вычисления эмбеддингов. Результаты - в формате search.
+        """
+        if not queries:
+            return []
+        try:
+            if embeddings is None:
+                embeddings = self.embed_queries(queries)
+            if self.hierarchical_default() and self.sections_ready():
+                return [
+                    self.search(query, n_results, scope=scope, db=db, query_embedding=embedding)
+                    for query, embedding in zip(queries, embeddings)
+                ]
+            
+            with span("vector_query"):
+                results = self._query_batch(self.collection, embeddings, n_results,
+                                            where=self.scope_where(scope))
+            if results and not VECTOR_STORE_TEXT:
+                results = self.hydrate_results(results, db=db)
+            return self.split_results(results, len(queries))
+        except Exception as e:
+            print(f"❌ Ошибка пакетного поиска: {e}")
+            import traceback
+            traceback.print_exc()
+            return [None] * len(queries)
+    
+    def search_sentences(self, query: str, n_results: int = SENTENCE_TOP_K,
+                         scope: Optional[Dict[str, str]] = None,
+                         window: int = SENTENCE_WINDOW, db=None) -> List[Dict]:
+        """
+        Small-to-big: ближайшие к запросу предложения, сгруппированные по родительским чанкам.
+        Для каждого чанка - только найденные предложения и window соседних с каждой
+        стороны (разрывы - «…»), в порядке близости лучшего предложения.
+        Результаты в формате чанков поиска: content, metadata, distance.
+        db - сессия запроса; если не передана, открывается своя.
+        """
+        if not self.sentence_collection.count():
+            return []
+        with span("embed"):
+            query_embedding = self.embedding_model.encode(query).tolist()
+        return self.search_sentences_batch([query], n_results, scope=scope, window=window,
+                                           db=db, embeddings=[query_embedding])[0]
+    
+    def search_sentences_batch(self, queries: List[str], n_results: int = SENTENCE_TOP_K,
+                               scope: Optional[Dict[str, str]] = None,
+                               window: int = SENTENCE_WINDOW, db=None,
+                               embeddings: Optional[List[List[float]]] = None) -> List[List[Dict]]:
+        """
+        search_sentences для списка вопросов: один запрос к коллекции предложений
+        и одно чтение родительских чанков из SQLite на все вопросы.
+        """
+        if not queries or not self.sentence_collection.count():
+            return [[] for _ in queries]
+        
+        if embeddings is None:
+            embeddings = self.embed_queries(queries)
+        with span("sentence_query"):
+            results = self._query_batch(self.sentence_collection, embeddings, n_results,
+                                        where=self.scope_where(scope), include=["metadatas", "distances"])
+        if not results:
+            return [[] for _ in queries]
+        
+        # Родительский чанк -> лучшее расстояние и номера найденных предложений (по вопросам)
+        groups: List[Dict[str, Dict[str, Any]]] = []
+        parent_meta: Dict[str, Dict[str, Any]] = {}
+        for metas, distances in zip(results["metadatas"], results["distances"]):
+            parents: Dict[str, Dict[str, Any]] = {}
+            for meta, distance in zip(metas, distances):
+                parent = parents.setdefault(meta["parent_id"], {"distance": distance, "hits": []})
+                parent["distance"] = min(parent["distance"], distance)
+                parent["hits"].append(int(meta["sentence_index"]))
+                parent_meta.setdefault(meta["parent_id"], meta)
+            groups.append(parents)
+        
+        with span("hydrate"):
+            rows = self.load_chunks(list(parent_meta.values()), db=db)
+        chunks = dict(zip(parent_meta.keys(), rows))
+        
+        batch = []
+        for parents in groups:
+            passages = []
+            for parent_id, parent in parents.items():
+                chunk = chunks[parent_id]
+                if chunk is None:
+                    continue
+                sentences = split_sentences(chunk.content)
+                selected = sorted({
+                    i for hit in parent["hits"]
+                    for i in range(max(0, hit - window), min(len(sentences), hit + window + 1))
+                })
+                pieces = []
+                for n, i in enumerate(selected):
+                    if n and i != selected[n - 1] + 1:
+                        pieces.append("…")
+                    pieces.append(sentences[i])
+                passages.append({
+                    'content': " ".join(pieces),
+                    'metadata': self.result_metadata(chunk),
+                    'distance': parent["distance"],
+                    'sentences': sorted(parent["hits"]),
+                    'source': 'sentence'
+                })
+            passages.sort(key=lambda p: p['distance'])
+            batch.append(passages)
+        return batch
+    
     def delete_document(self, doc_id: int):
         """Удаляет все чанки документа"""
         try:
             self.collection.delete(
                 where={"doc_id": str(doc_id)}
             )
+            self.section_collection.delete(
+                where={"doc_id": str(doc_id)}
+            )
+            self.sentence_collection.delete(
+                where={"doc_id": str(doc_id)}
+            )
             print(f"✅ Удалены чанки документа {doc_id} из ChromaDB")
         except Exception as e:
             print(f"❌ Ошибка удаления документа {doc_id}: {e}")
@@ -176,11 +842,13 @@ class VectorStore:
             print(f"🔄 Загружаем модель эмбеддингов: {EMBEDDING_MODEL}")
             try:
                 self.embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+                self.embedding_model_name = EMBEDDING_MODEL
                 print(f"✅ Модель загружена, размерность: {self.embedding_model.get_sentence_embedding_dimension()}")
             except Exception as e:
                 print(f"⚠️ Ошибка загрузки модели: {e}")
                 print("🔄 Пробуем загрузить английскую модель...")
                 self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+                self.embedding_model_name = 'all-MiniLM-L6-v2'
                 print("✅ Загружена английская модель")
         return self.embedding_model
     
@@ -197,95 +865,169 @@ class VectorStore:
         # Разбиваем на слова
         words = query_lower.split()
         
-        # Стоп-слова (короткие и частотные)
-        stop_words = {'когда', 'где', 'какой', 'какая', 'какое', 'какие', 'что', 'кто', 
-                     'как', 'почему', 'зачем', 'сколько', 'этот', 'эта', 'это', 'эти',
-                     'весь', 'вся', 'все', 'был', 'была', 'было', 'были', 'при', 'для',
-                     'чтобы', 'чрез', 'через', 'около', 'почти', 'уже', 'еще', 'ещё'}
-        
         # Оставляем слова длиннее 3 символов и не в стоп-листе
-        keywords = [word for word in words if len(word) > 3 and word not in stop_words]
-        
-        # Добавляем вариации для имен (Цезарь -> цезар, юлий)
-        variations = []
-        for word in keywords:
-            if word in ['цезарь', 'цезаря', 'цезарю', 'цезарем']:
-                variations.extend(['цезар', 'юлий'])
-            if word in ['юлий', 'юлия']:
-                variations.append('юлий')
-                
-        keywords.extend(variations)
+        keywords = [word for word in words if len(word) > 3 and word not in STOP_WORDS]
+        
+        # Основы слов (любые падежи) и части имен из словаря псевдонимов:
+        # цезаря -> цезар, юли (Гай Юлий Цезарь)
+        keywords.extend(self.query_expander.keyword_variants(keywords))
         
         return list(set(keywords))  # Убираем дубликаты
     
-    def _keyword_search_sql(self, keywords: List[str], n_results: int) -> List[Dict]:
+    def _keyword_search_sql(self, keywords: List[str], n_results: int, db=None,
+                            scope: Optional[Dict[str, str]] = None) -> List[Dict]:
         """
-        Поиск по ключевым словам через SQL с ранжированием
+        Поиск по ключевым словам через SQL с ранжированием.
+        db - сессия запроса; если не передана, открывается своя.
+        scope - область поиска (документ, глава, параграф).
         """
-        from .database import get_db, Chunk
-        from sqlalchemy import or_, and_
+        from .database import SessionLocal, Chunk
+        from sqlalchemy import or_
         
-        db = get_db()
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
         try:
-            if not keywords:
+            terms = self._keyword_terms(keywords)
+            if not terms:
                 return []
             
-            # Создаем условия для каждого ключевого слова
-            conditions = []
-            for word in keywords:
-                # Ищем разные формы слова
-                conditions.append(Chunk.content.ilike(f'%{word}%'))
-                conditions.append(Chunk.content.ilike(f'%{word.capitalize()}%'))
+            # Одно условие на слово: search_text уже в нижнем регистре,
+            # дубли с word.capitalize() и ilike не нужны
+            conditions = [Chunk.search_text.like(like_pattern(term), escape=LIKE_ESCAPE) for term in terms]
             
             # Выполняем поиск
-            chunks = db.query(Chunk).filter(
-                or_(*conditions)
-            ).limit(n_results * 2).all()  # Берем с запасом
+            with span("lexical_query"):
+                chunks = db.query(Chunk).filter(
+                    or_(*conditions), *self.scope_filters(scope)
+                ).limit(n_results * 2).all()  # Берем с запасом
             
-            # Ранжируем по частоте вхождений
-            ranked_chunks = []
-            for chunk in chunks:
-                content_lower = chunk.content.lower()
-                score = 0
-                
-                # Считаем сколько ключевых слов найдено
-                found_keywords = []
-                for word in keywords:
-                    if word in content_lower:
+            return self._rank_keyword_chunks(chunks, terms, n_results)
+            
+        finally:
+            if own_session:
+                db.close()
+    
+    @staticmethod
+    def _keyword_terms(keywords: List[str]) -> List[str]:
+        """Ключевые слова - в нормализации колонки search_text (регистр, ё, пунктуация)"""
+        return [t for t in dict.fromkeys(normalize_term(word) for word in keywords) if t]
+    
+    def _rank_keyword_chunks(self, chunks: List[Any], terms: List[str], n_results: int) -> List[Dict]:
+        """Ранжирует по частоте вхождений: все ключевые слова - за один проход по чанку"""
+        return [
+            self._keyword_result(chunk, chunk.content, score, found_keywords)
+            for score, found_keywords, chunk in self._score_keyword_chunks(chunks, terms, n_results)
+        ]
+    
+    def _score_keyword_chunks(self, chunks: List[Any], terms: List[str], n_results: int) -> List[tuple]:
+        """
+        Лучшие n_results чанков по скору: [(score, keywords_found, chunk)].
+        Ранжирование - только по колонке search_text, текст чанка не нужен.
+        """
+        matcher = get_matcher(terms)
+        entity_keywords = {term for term in terms if self.query_expander.is_entity(term)}
+        scored = []
+        for chunk in chunks:
+            search_text = chunk.search_text
+            if not search_text:
+                # Не заполнен (_backfill_search_text при init_db): LIKE по NULL и так не находит
+                continue
+            found = matcher.scan(search_text)
+            score = 0
+            
+            # Считаем сколько ключевых слов найдено
+            found_keywords = []
+            for term in terms:
+                positions = found.get(term)
+                if positions:
+                    score += 1
+                    found_keywords.append(term)
+                    # Дополнительный вес за точное совпадение
+                    if matcher.is_whole_word(search_text, term, positions):
                         score += 1
-                        found_keywords.append(word)
-                        # Дополнительный вес за точное совпадение
-                        if f" {word} " in f" {content_lower} ":
-                            score += 1
-                
-                # Особый вес для имен
-                if 'юлий' in found_keywords or 'цезар' in found_keywords:
-                    score += 3
-                
-                if score > 0:
-                    ranked_chunks.append({
-                        'content': chunk.content,
-                        'metadata': {
-                            'doc_id': str(chunk.doc_id),
-                            'page_number': str(chunk.page_number),
-                            'chapter': chunk.chapter or '',
-                            'paragraph': chunk.paragraph or '',
-                            'id': chunk.id
-                        },
-                        'score': score,
-                        'source': 'keyword',
-                        'keywords_found': found_keywords
-                    })
             
-            # Сортируем по убыванию скора
-            ranked_chunks.sort(key=lambda x: x['score'], reverse=True)
+            # Особый вес для имен из словаря псевдонимов
+            if entity_keywords.intersection(found_keywords):
+                score += 3
             
-            return ranked_chunks[:n_results]
+            if score > 0:
+                scored.append((score, found_keywords, chunk))
+        
+        # Сортируем по убыванию скора
+        scored.sort(key=lambda x: x[0], reverse=True)
+        
+        return scored[:n_results]
+    
+    def _keyword_result(self, chunk, content: str, score: int, found_keywords: List[str]) -> Dict:
+        """Результат лексического поиска по строке chunks и ее тексту"""
+        return {
+            'content': content,
+            'metadata': self.result_metadata(chunk),
+            'score': score,
+            'source': 'keyword',
+            'keywords_found': found_keywords
+        }
+    
+    def _keyword_search_sql_batch(self, keyword_lists: List[List[str]], n_results: int, db=None,
+                                  scope: Optional[Dict[str, str]] = None) -> List[List[Dict]]:
+        """
+        _keyword_search_sql для списка вопросов одним запросом: UNION ALL отдельных
+        запросов вопросов, у каждого свой LIMIT n_results * 2 - редкое слово одного
+        вопроса не заставляет читать всю таблицу. Читаются только колонки для скора,
+        тексты - одним запросом для попавших в выдачу чанков.
+        """
+        from .database import SessionLocal, Chunk
+        from sqlalchemy import literal, or_, select, union_all
+        
+        term_lists = [self._keyword_terms(keywords) for keywords in keyword_lists]
+        queries = [i for i, terms in enumerate(term_lists) if terms]
+        if not queries:
+            return [[] for _ in keyword_lists]
+        
+        columns = (Chunk.id, Chunk.doc_id, Chunk.chunk_index, Chunk.page_number,
+                   Chunk.chapter, Chunk.paragraph, Chunk.section_title, Chunk.search_text)
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            # SQLite не разрешает LIMIT в частях UNION ALL - каждая часть в подзапросе
+            parts = [
+                select(
+                    select(literal(i).label("query_index"), *columns).where(
+                        or_(*[Chunk.search_text.like(like_pattern(term), escape=LIKE_ESCAPE)
+                              for term in term_lists[i]]),
+                        *self.scope_filters(scope)
+                    ).limit(n_results * 2).subquery()  # Берем с запасом
+                )
+                for i in queries
+            ]
+            with span("lexical_query"):
+                rows = db.execute(union_all(*parts) if len(parts) > 1 else parts[0]).all()
+            
+            buckets: List[List[Any]] = [[] for _ in term_lists]
+            for row in rows:
+                buckets[row.query_index].append(row)
+            ranked = [
+                self._score_keyword_chunks(chunks, terms, n_results) if terms else []
+                for chunks, terms in zip(buckets, term_lists)
+            ]
             
+            top_ids = {chunk.id for scored in ranked for _, _, chunk in scored}
+            contents = dict(
+                db.execute(select(Chunk.id, Chunk.content).where(Chunk.id.in_(top_ids))).all()
+            ) if top_ids else {}
+            return [
+                [self._keyword_result(chunk, contents.get(chunk.id, ''), score, found_keywords)
+                 for score, found_keywords, chunk in scored]
+                for scored in ranked
+            ]
         finally:
-            db.close()
+            if own_session:
+                db.close()
     
-    def hybrid_search(self, query: str, n_results: int = 5, vector_weight: float = 0.4):
+    def hybrid_search(self, query: str, n_results: int = 5, vector_weight: float = 0.4, db=None,
+                      scope: Optional[Dict[str, str]] = None):
         """
         Улучшенный гибридный поиск
         """
@@ -294,18 +1036,27 @@ class VectorStore:
         print(f"🔑 Ключевые слова: {keywords}")
         
         # 2. Поиск по ключевым словам (SQL)
-        keyword_results = self._keyword_search_sql(keywords, n_results)
+        keyword_results = self._keyword_search_sql(keywords, n_results, db=db, scope=scope)
         
         # 3. Векторный поиск
-        vector_results = self.search(query, n_results=n_results * 2)
+        vector_results = self.search(query, n_results=n_results * 2, scope=scope, db=db)
         
         # 4. Комбинируем результаты
+        with span("merge"):
+            combined_chunks = self._merge_hybrid(keyword_results, vector_results, vector_weight)
+        
+        # 6. Возвращаем топ результатов
+        return combined_chunks[:n_results]
+    
+    def _merge_hybrid(self, keyword_results: List[Dict], vector_results: Optional[Dict],
+                      vector_weight: float) -> List[Dict]:
+        """Объединяет и ранжирует результаты ключевого и векторного поиска"""
         combined_chunks = []
         seen_ids = set()
         
         # Сначала добавляем результаты из ключевого поиска (высокий приоритет для имен)
         for chunk in keyword_results:
-            chunk_id = chunk['metadata'].get('id')
+            chunk_id = self.merge_key(chunk['metadata'])
             if chunk_id not in seen_ids:
                 # Нормализуем score в диапазон 0-1
                 max_keyword_score = max([c['score'] for c in keyword_results]) if keyword_results else 1
@@ -319,12 +1070,14 @@ class VectorStore:
                     'keywords': chunk.get('keywords_found', [])
                 })
                 seen_ids.add(chunk_id)
+                # Векторы старого индекса без chunk_id узнаются по позиции в документе
+                seen_ids.add(self.merge_key({k: v for k, v in chunk['metadata'].items() if k != 'chunk_id'}))
         
         # Затем добавляем результаты из векторного поиска
         if vector_results and vector_results.get('documents'):
             for i, doc in enumerate(vector_results['documents'][0]):
                 meta = vector_results['metadatas'][0][i]
-                chunk_id = meta.get('id', i)
+                chunk_id = self.merge_key(meta)
                 
                 if chunk_id not in seen_ids:
                     distance = vector_results['distances'][0][i] if vector_results.get('distances') else 0
@@ -348,9 +1101,7 @@ class VectorStore:
                 chunk['final_score'] = chunk['score'] * vector_weight
         
         combined_chunks.sort(key=lambda x: x['final_score'], reverse=True)
-        
-        # 6. Возвращаем топ результатов
-        return combined_chunks[:n_results]
+        return combined_chunks
 
     def rerank_with_llm(self, query: str, candidates: List[Dict], llm_client) -> List[Dict]:
         """
@@ -378,11 +1129,13 @@ class VectorStore:
     Ответь ТОЛЬКО числом."""
             
             try:
-                score_text = llm_client.generate(
-                    prompt=prompt,
-                    system_message="Ты - эксперт по оценке релевантности. Отвечай только числом.",
-                    temperature=0.0
-                )
+                with span("rerank"):
+                    score_text = llm_client.generate(
+                        prompt=prompt,
+                        system_message="Ты - эксперт по оценке релевантности. Отвечай только числом.",
+                        temperature=0.0,
+                        task="rerank"
+                    )
                 
                 # Извлекаем число из ответа
                 import re
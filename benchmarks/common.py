@@ -0,0 +1,168 @@
+# benchmarks/common.py
+"""
+Общие утилиты бенчмарков.
+
+Модули app/* читают пути из app/config.py при импорте, поэтому
+setup_data_dir() нужно вызывать ДО импорта app.
+"""
+from typing import List, Dict, Any, Optional
+from pathlib import Path
+from datetime import datetime
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+# Нейтральные предложения для «шумовых» чанков при масштабировании корпуса
+FILLER_SENTENCES = [
+    "Историки до сих пор спорят о причинах этих событий.",
+    "Источники того времени сохранились лишь частично.",
+    "Население занималось земледелием, ремеслом и торговлей.",
+    "Важную роль в жизни общества играли религиозные обряды.",
+    "Археологи обнаружили остатки жилищ, орудий труда и украшений.",
+    "Отношения с соседними народами были то мирными, то враждебными.",
+    "Правители стремились укрепить свою власть и расширить владения.",
+    "Большинство жителей не умели читать и писать.",
+    "Торговые пути связывали между собой отдаленные земли.",
+    "Многие обычаи сохранялись на протяжении столетий.",
+    "Налоги собирались зерном, скотом и ремесленными изделиями.",
+    "Города окружали стенами для защиты от набегов.",
+    "Учебник рассказывает о повседневной жизни простых людей.",
+    "Знать владела большими участками земли и имела много слуг.",
+    "С течением времени хозяйство становилось все более сложным."
+]
+
+
+def setup_data_dir(data_dir: Optional[str] = None) -> Path:
+    """Направляет БД, ChromaDB и кэш эмбеддингов в отдельную директорию"""
+    path = Path(data_dir) if data_dir else Path(tempfile.mkdtemp(prefix="history_tutor_bench_"))
+    path.mkdir(parents=True, exist_ok=True)
+    os.environ["HISTORY_TUTOR_DATA_DIR"] = str(path)
+    return path
+
+
+def load_corpus(scale: int = 0, seed: int = 42) -> Dict[str, Any]:
+    """
+    Фикстурный корпус. scale > 0 добавляет scale шумовых чанков
+    на каждый фикстурный, чтобы мерить поведение на больших учебниках.
+    """
+    corpus = json.loads((FIXTURES_DIR / "history_corpus.json").read_text(encoding="utf-8"))
+    rng = random.Random(seed)
+
+    chunks = []
+    for item in corpus["chunks"]:
+        chunks.append(dict(item))
+        for n in range(scale):
+            sentences = rng.sample(FILLER_SENTENCES, k=6)
+            chunks.append({
+                "key": None,
+                "chapter": item["chapter"],
+                "paragraph": item["paragraph"],
+                "page": item["page"],
+                "content": " ".join(sentences)
+            })
+
+    for i, chunk in enumerate(chunks):
+        chunk["chunk_index"] = i
+        chunk["page_number"] = chunk.pop("page")
+        chunk["section_title"] = ""
+
+    return {"filename": corpus["filename"], "chunks": chunks}
+
+
+def load_questions() -> List[Dict[str, Any]]:
+    return json.loads((FIXTURES_DIR / "questions.json").read_text(encoding="utf-8"))
+
+
+class StubLLMClient:
+    """
+    Детерминированная замена LLMClient без Ollama.
+    latency - искусственная задержка на вызов (сек).
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.model_name = "stub"
+        self.use_mock = False
+        self.calls = 0
+        self.prompt_chars = 0
+
+    def generate(self, prompt: str, system_message: str = "", temperature: float = 0.0, **kwargs) -> str:
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+
+        # Расширение запроса: одна формулировка без вопросительных слов
+        match = re.search(r"Исходный вопрос: (.+)", prompt)
+        if match:
+            question = match.group(1).strip()
+            stripped = re.sub(r"^(когда|кто|как|где|что|почему|сколько|в каком году)\s+", "",
+                              question.lower()).rstrip("?")
+            return stripped
+
+        # Ответ: первое предложение первого фрагмента
+        match = re.search(r"\]\n(.+?[.!?])", prompt, re.S)
+        if match:
+            return match.group(1).strip()
+
+        return "5"
+
+    def is_available(self) -> bool:
+        return True
+
+    def get_available_models(self) -> list:
+        return [self.model_name]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль с линейной интерполяцией (q от 0 до 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """Сводка латентности в миллисекундах"""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(1000 * sum(samples) / len(samples), 3),
+        "p50_ms": round(1000 * percentile(samples, 50), 3),
+        "p95_ms": round(1000 * percentile(samples, 95), 3),
+        "p99_ms": round(1000 * percentile(samples, 99), 3),
+        "max_ms": round(1000 * max(samples), 3)
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def write_report(report: Dict[str, Any], output: Optional[str], prefix: str) -> Path:
+    """Пишет JSON-отчет (по умолчанию benchmarks/results/<prefix>_<время>.json)"""
+    if output:
+        path = Path(output)
+    else:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = Path(__file__).parent / "results" / f"{prefix}_{stamp}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"📝 Отчет: {path}")
+    return path
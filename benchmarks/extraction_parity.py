@@ -0,0 +1,205 @@
+# benchmarks/extraction_parity.py
+"""
+Сверка бэкендов извлечения текста PDF (app/pdf_extraction.py).
+
+Оба бэкенда прогоняются по одним и тем же PDF; сравнивается текст,
+который реально попадает в индекс: разбор глав и параграфов
+(StructureParser.split_page - строки заголовков и оглавление в текст
+не входят), затем clean_text и normalize_text. Сверка - по словам на
+каждой странице и по итоговым чанкам process_document вместе с их главой
+и параграфом (--raw - сырой текст страниц). В отчете - доля совпадающих
+страниц и чанков, худшие страницы с фрагментами расхождений и ускорение.
+
+Синтетический учебник без --pdf пишет сам pypdfium2 (строка - один
+текстовый объект), поэтому его сверка проверяет только обвязку: решение
+о PDF_EXTRACTOR - по настоящим учебникам (колонки, переносы, лигатуры).
+
+    python -m benchmarks.extraction_parity --pdf book.pdf
+    python -m benchmarks.extraction_parity --pages 100 --font /path/to/DejaVuSans.ttf
+"""
+from typing import List, Dict, Any, Tuple
+from pathlib import Path
+import argparse
+import difflib
+import tempfile
+import time
+
+from .common import setup_data_dir, git_revision, write_report
+from .ingestion_benchmark import find_font, write_synthetic_pdf
+
+
+def extract(processor, backend, path: Path, raw: bool = False) -> Tuple[List[str], float]:
+    """
+    Текст страниц в том виде, в каком он идет в чанки (или сырой),
+    и время извлечения (только бэкенд)
+    """
+    from app.structure_parser import StructureParser
+
+    started = time.perf_counter()
+    raw_pages = list(backend.extract_pages(str(path)))
+    elapsed = time.perf_counter() - started
+    if raw:
+        return [" ".join(text.split()) for text in raw_pages], elapsed
+
+    # Как в process_document: куски страницы по разделам, каждый - clean + normalize
+    parser = StructureParser()
+    pages = []
+    for text in raw_pages:
+        segments = [
+            processor.normalize_text(processor.clean_text(segment["text"]))
+            for segment in parser.split_page(text)
+        ]
+        pages.append(" ".join(segment for segment in segments if segment))
+    return pages, elapsed
+
+
+def indexed_chunks(processor, backend, path: Path) -> List[Tuple[str, str, str]]:
+    """Чанки, которые попали бы в индекс: (глава, параграф, текст)"""
+    processed = processor.process_document(str(path), path.name, extractor=backend.name)
+    return [(c["chapter"], c["paragraph"], c["content"]) for c in processed["chunks"]]
+
+
+def word_diff(baseline: str, candidate: str, context: int = 5, limit: int = 3) -> List[Dict[str, str]]:
+    """Фрагменты расхождений по словам: что было в эталоне и что стало"""
+    a, b = baseline.split(), candidate.split()
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    diffs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        diffs.append({
+            "op": tag,
+            "context": " ".join(a[max(0, i1 - context):i1]),
+            "baseline": " ".join(a[i1:i2]),
+            "candidate": " ".join(b[j1:j2])
+        })
+        if len(diffs) >= limit:
+            break
+    return diffs
+
+
+def similarity(baseline: str, candidate: str) -> float:
+    if baseline == candidate:
+        return 1.0
+    return difflib.SequenceMatcher(None, baseline.split(), candidate.split(), autojunk=False).ratio()
+
+
+def compare(processor, baseline, candidate, path: Path, repeat: int,
+            min_similarity: float, worst: int, raw: bool = False) -> Dict[str, Any]:
+    times = {baseline.name: [], candidate.name: []}
+    for _ in range(repeat):
+        base_pages, base_time = extract(processor, baseline, path, raw)
+        cand_pages, cand_time = extract(processor, candidate, path, raw)
+        times[baseline.name].append(base_time)
+        times[candidate.name].append(cand_time)
+
+    pages = []
+    for n in range(max(len(base_pages), len(cand_pages))):
+        base = base_pages[n] if n < len(base_pages) else ""
+        cand = cand_pages[n] if n < len(cand_pages) else ""
+        pages.append({"page": n + 1, "similarity": round(similarity(base, cand), 4),
+                      "baseline": base, "candidate": cand})
+
+    if raw:
+        base_chunks = processor.semantic_chunking("\n\n".join(p for p in base_pages if p))
+        cand_chunks = processor.semantic_chunking("\n\n".join(p for p in cand_pages if p))
+    else:
+        base_chunks = indexed_chunks(processor, baseline, path)
+        cand_chunks = indexed_chunks(processor, candidate, path)
+    cand_set = set(cand_chunks)
+    same_chunks = sum(1 for chunk in base_chunks if chunk in cand_set)
+
+    base_time = min(times[baseline.name])
+    cand_time = min(times[candidate.name])
+    below = sorted((p for p in pages if p["similarity"] < min_similarity), key=lambda p: p["similarity"])
+
+    return {
+        "file": str(path),
+        "pages": len(pages),
+        "page_count_match": len(base_pages) == len(cand_pages),
+        "identical_pages": sum(1 for p in pages if p["similarity"] == 1.0),
+        "pages_below_threshold": len(below),
+        "mean_similarity": round(sum(p["similarity"] for p in pages) / max(1, len(pages)), 4),
+        "chunks": {
+            baseline.name: len(base_chunks),
+            candidate.name: len(cand_chunks),
+            "identical": same_chunks
+        },
+        "seconds": {baseline.name: round(base_time, 3), candidate.name: round(cand_time, 3)},
+        "pages_per_sec": {
+            baseline.name: round(len(base_pages) / base_time, 1) if base_time else None,
+            candidate.name: round(len(cand_pages) / cand_time, 1) if cand_time else None
+        },
+        "speedup": round(base_time / cand_time, 2) if cand_time else None,
+        "worst_pages": [
+            {"page": p["page"], "similarity": p["similarity"], "diffs": word_diff(p["baseline"], p["candidate"])}
+            for p in below[:worst]
+        ]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка бэкендов извлечения текста PDF")
+    parser.add_argument("--pdf", action="append", default=[], help="PDF учебника (можно несколько раз)")
+    parser.add_argument("--pages", type=int, default=100, help="страниц в синтетическом учебнике без --pdf")
+    parser.add_argument("--font", default=None, help="TTF-шрифт с кириллицей для генерации")
+    parser.add_argument("--baseline", default="pdfplumber")
+    parser.add_argument("--candidate", default="pypdfium2")
+    parser.add_argument("--repeat", type=int, default=1, help="повторов замера (берется лучший)")
+    parser.add_argument("--min-similarity", type=float, default=0.98,
+                        help="страницы с меньшей похожестью попадают в отчет")
+    parser.add_argument("--worst", type=int, default=5, help="сколько худших страниц показать")
+    parser.add_argument("--raw", action="store_true",
+                        help="сравнивать сырой текст страниц, без clean_text (все строки, не только русский текст)")
+    parser.add_argument("--output", default=None, help="путь к JSON-отчету")
+    args = parser.parse_args()
+
+    setup_data_dir()
+
+    pdf_paths = [Path(p) for p in args.pdf]
+    if not pdf_paths:
+        path = Path(tempfile.mkdtemp(prefix="history_tutor_pdf_")) / f"synthetic_{args.pages}p.pdf"
+        written = write_synthetic_pdf(path, args.pages, find_font(args.font))
+        print(f"📄 {path.name}: {written} стр.")
+        pdf_paths.append(path)
+
+    # Импорт app - только после setup_data_dir
+    from app.document_processor import DocumentProcessor
+    from app.pdf_extraction import get_extractor
+
+    processor = DocumentProcessor()
+    baseline = get_extractor(args.baseline)
+    candidate = get_extractor(args.candidate)
+
+    runs = []
+    for path in pdf_paths:
+        run = compare(processor, baseline, candidate, path, args.repeat, args.min_similarity, args.worst, args.raw)
+        runs.append(run)
+        print(f"📊 {path.name}: {run['pages']} стр., совпало {run['identical_pages']}, "
+              f"ниже {args.min_similarity}: {run['pages_below_threshold']}, "
+              f"похожесть {run['mean_similarity']}, чанков {run['chunks']} | "
+              f"{baseline.name} {run['seconds'][baseline.name]} сек, "
+              f"{candidate.name} {run['seconds'][candidate.name]} сек, x{run['speedup']}")
+        for page in run["worst_pages"]:
+            for diff in page["diffs"]:
+                print(f"   стр. {page['page']} ({page['similarity']}): …{diff['context']} "
+                      f"[{diff['baseline']}] -> [{diff['candidate']}]")
+
+    report = {
+        "benchmark": "extraction_parity",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "config": {
+            "baseline": baseline.name,
+            "candidate": candidate.name,
+            "repeat": args.repeat,
+            "min_similarity": args.min_similarity,
+            "raw": args.raw
+        },
+        "runs": runs
+    }
+    write_report(report, args.output, "extraction_parity")
+
+
+if __name__ == "__main__":
+    main()
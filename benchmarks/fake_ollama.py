@@ -0,0 +1,257 @@
+# benchmarks/fake_ollama.py
+"""
+Детерминированная замена Ollama для нагрузочного тестирования без GPU.
+
+Реализует /api/tags, /api/chat и /api/generate (потоковые и нет) с моделью задержек:
+    - очередь: не больше --concurrency одновременных генераций (как OLLAMA_NUM_PARALLEL)
+    - загрузка модели: --load-time при первом запросе или после истечения keep_alive
+      (запрос без сообщений/промпта только загружает модель, как в Ollama)
+    - time-to-first-token: --ttft + токены промпта / --prefill-tps
+    - генерация: --tps токенов в секунду, не больше num_predict
+
+Запуск:
+    python -m benchmarks.fake_ollama --port 11435 --ttft 0.2 --tps 25 --concurrency 1
+    OLLAMA_BASE_URL=http://localhost:11435 python main.py
+"""
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .common import StubLLMClient
+
+
+class FakeOllama:
+    """Модель задержек и состояние загруженных моделей"""
+
+    def __init__(self, models: List[str], ttft: float, tps: float, prefill_tps: float,
+                 concurrency: int, load_time: float, default_keep_alive: float):
+        self.models = models
+        self.ttft = ttft
+        self.tps = tps
+        self.prefill_tps = prefill_tps
+        self.load_time = load_time
+        self.default_keep_alive = default_keep_alive
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.loaded_until: Dict[str, float] = {}
+        self.responder = StubLLMClient()
+        self.in_flight = 0
+        self.queued = 0
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """Грубая оценка: ~4 символа на токен"""
+        return max(1, len(text) // 4)
+
+    @staticmethod
+    def parse_keep_alive(value: Any, default: float) -> float:
+        """keep_alive Ollama: секунды числом или строка вида 5m / 30s / 1h; -1 - навсегда"""
+        if value is None:
+            return default
+        if isinstance(value, (int, float)):
+            return float("inf") if value < 0 else float(value)
+        match = re.fullmatch(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?", str(value).strip())
+        if not match:
+            return default
+        number = float(match.group(1))
+        if number < 0:
+            return float("inf")
+        factor = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[match.group(2)]
+        return number * factor
+
+    def build_answer(self, prompt: str) -> List[str]:
+        text = self.responder.generate(prompt) or "Ответ"
+        # Токен - слово с пробелом, как в потоке Ollama
+        words = text.split(" ")
+        return [w + (" " if i < len(words) - 1 else "") for i, w in enumerate(words)]
+
+    async def load(self, model: str, keep_alive: Any) -> Dict[str, Any]:
+        """Запрос без сообщений: только загрузка модели (как warm-up в Ollama)"""
+        load_duration = 0.0
+        if time.time() > self.loaded_until.get(model, 0):
+            load_duration = self.load_time
+            await asyncio.sleep(load_duration)
+        keep = self.parse_keep_alive(keep_alive, self.default_keep_alive)
+        self.loaded_until[model] = time.time() + keep
+        return {"total_duration": int(load_duration * 1e9), "load_duration": int(load_duration * 1e9)}
+
+    async def run(self, model: str, prompt: str, options: Dict[str, Any], keep_alive: Any):
+        """
+        Асинхронный генератор событий: ("token", str) ... ("done", stats).
+        Время очереди, загрузки и prefill моделируется через asyncio.sleep.
+        """
+        request_start = time.perf_counter()
+        self.queued += 1
+        async with self.semaphore:
+            self.queued -= 1
+            self.in_flight += 1
+            try:
+                start = time.perf_counter()
+
+                load_duration = 0.0
+                if time.time() > self.loaded_until.get(model, 0):
+                    load_duration = self.load_time
+                    await asyncio.sleep(load_duration)
+
+                prompt_tokens = self.count_tokens(prompt)
+                prefill = self.ttft + prompt_tokens / self.prefill_tps
+                await asyncio.sleep(prefill)
+
+                tokens = self.build_answer(prompt)
+                num_predict = options.get("num_predict")
+                if num_predict and num_predict > 0:
+                    tokens = tokens[:num_predict]
+
+                eval_started = time.perf_counter()
+                for token in tokens:
+                    await asyncio.sleep(1.0 / self.tps)
+                    yield "token", token
+                eval_duration = time.perf_counter() - eval_started
+
+                keep = self.parse_keep_alive(keep_alive, self.default_keep_alive)
+                self.loaded_until[model] = time.time() + keep
+
+                yield "done", {
+                    "total_duration": int((time.perf_counter() - start) * 1e9),
+                    "load_duration": int(load_duration * 1e9),
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(prefill * 1e9),
+                    "eval_count": len(tokens),
+                    "eval_duration": int(eval_duration * 1e9),
+                    "queue_duration": int((start - request_start) * 1e9)
+                }
+            finally:
+                self.in_flight -= 1
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _messages_to_prompt(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(m.get("content", "") for m in messages)
+
+
+def create_app(fake: FakeOllama) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {
+            "models": [
+                {"name": name, "model": name, "size": 0, "details": {"family": "fake"}}
+                for name in fake.models
+            ]
+        }
+
+    @app.get("/api/ps")
+    async def ps():
+        now = time.time()
+        return {
+            "models": [
+                {"name": name, "expires_at": until}
+                for name, until in fake.loaded_until.items() if until > now
+            ],
+            "in_flight": fake.in_flight,
+            "queued": fake.queued
+        }
+
+    async def _handle(request: Request, chat: bool):
+        payload = await request.json()
+        model = payload.get("model", "")
+        if model not in fake.models:
+            return JSONResponse({"error": f"model '{model}' not found"}, status_code=404)
+
+        if chat:
+            prompt = _messages_to_prompt(payload.get("messages", []))
+        else:
+            prompt = (payload.get("system") or "") + "\n" + payload.get("prompt", "")
+        options = payload.get("options") or {}
+        keep_alive = payload.get("keep_alive")
+        stream = payload.get("stream", True)  # как в Ollama: поток по умолчанию
+
+        if not (payload.get("messages") if chat else payload.get("prompt")):
+            stats = await fake.load(model, keep_alive)
+            body: Dict[str, Any] = {"model": model, "created_at": _now(), "done": True, "done_reason": "load"}
+            if chat:
+                body["message"] = {"role": "assistant", "content": ""}
+            else:
+                body["response"] = ""
+            body.update(stats)
+            return body
+
+        def frame(content: str, done: bool, stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+            body: Dict[str, Any] = {"model": model, "created_at": _now(), "done": done}
+            if chat:
+                body["message"] = {"role": "assistant", "content": content}
+            else:
+                body["response"] = content
+            if stats:
+                body.update(stats)
+                body["done_reason"] = "stop"
+            return body
+
+        if stream:
+            async def events():
+                async for kind, value in fake.run(model, prompt, options, keep_alive):
+                    if kind == "token":
+                        yield json.dumps(frame(value, False), ensure_ascii=False) + "\n"
+                    else:
+                        yield json.dumps(frame("", True, value), ensure_ascii=False) + "\n"
+            return StreamingResponse(events(), media_type="application/x-ndjson")
+
+        parts = []
+        stats: Dict[str, Any] = {}
+        async for kind, value in fake.run(model, prompt, options, keep_alive):
+            if kind == "token":
+                parts.append(value)
+            else:
+                stats = value
+        return frame("".join(parts), True, stats)
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        return await _handle(request, chat=True)
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        return await _handle(request, chat=False)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama для нагрузочных тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", default="gemma3:4b", help="через запятую")
+    parser.add_argument("--ttft", type=float, default=0.2, help="базовая задержка первого токена, сек")
+    parser.add_argument("--tps", type=float, default=25.0, help="токенов в секунду при генерации")
+    parser.add_argument("--prefill-tps", type=float, default=1000.0, help="токенов промпта в секунду")
+    parser.add_argument("--concurrency", type=int, default=1, help="параллельных генераций")
+    parser.add_argument("--load-time", type=float, default=0.0, help="время загрузки модели, сек")
+    parser.add_argument("--keep-alive", type=float, default=300.0, help="keep_alive по умолчанию, сек")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    fake = FakeOllama(
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+        ttft=args.ttft,
+        tps=args.tps,
+        prefill_tps=args.prefill_tps,
+        concurrency=args.concurrency,
+        load_time=args.load_time,
+        default_keep_alive=args.keep_alive
+    )
+    uvicorn.run(create_app(fake), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
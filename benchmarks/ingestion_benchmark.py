@@ -0,0 +1,255 @@
+# benchmarks/ingestion_benchmark.py
+"""
+Бенчмарк индексации: сколько времени учебник проводит в каждой стадии.
+
+Синтетический учебник (главы, параграфы, фикстурный и шумовой текст)
+генерируется в PDF через pypdfium2; шрифт нужен с кириллицей (--font).
+Можно передать и готовые PDF (--pdf).
+
+    python -m benchmarks.ingestion_benchmark --pages 300
+    python -m benchmarks.ingestion_benchmark --pdf book.pdf --profile ingest.prof
+
+Стадии: extract, structure, clean, normalize, chunk, find_page (DocumentProcessor),
+sql_write (ingest_chunks), embed_chunks, vector_upsert (VectorStore.add_chunks).
+Итог: pages/sec, chunks/sec, пиковый RSS. Профиль cProfile открывается
+в snakeviz, а flamegraph строится через flameprof / gprof2dot.
+"""
+from typing import List, Dict, Any, Optional
+from pathlib import Path
+import argparse
+import ctypes
+import json
+import random
+import sys
+import tempfile
+import time
+
+from .common import (
+    FIXTURES_DIR, FILLER_SENTENCES, setup_data_dir, git_revision, write_report
+)
+
+# Шрифты с кириллицей, которые обычно есть в системе
+DEFAULT_FONTS = [
+    "C:/Windows/Fonts/arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf"
+]
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+FONT_SIZE = 11.0
+LINE_HEIGHT = 14
+MARGIN = 50
+LINES_PER_PAGE = 50
+CHARS_PER_LINE = 85
+
+
+def find_font(font: Optional[str]) -> Path:
+    candidates = [font] if font else DEFAULT_FONTS
+    for candidate in candidates:
+        if candidate and Path(candidate).exists():
+            return Path(candidate)
+    raise SystemExit("❌ Не найден TTF-шрифт с кириллицей, укажите --font")
+
+
+def _wrap(text: str, width: int) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def synthetic_book_lines(pages: int, seed: int = 42) -> List[str]:
+    """
+    Строки учебника: «Глава N», «§ M», абзацы из фикстурных и шумовых
+    предложений, пустая строка между абзацами. Объем - примерно pages страниц.
+    """
+    rng = random.Random(seed)
+    corpus = json.loads((FIXTURES_DIR / "history_corpus.json").read_text(encoding="utf-8"))
+    facts = [chunk["content"] for chunk in corpus["chunks"]]
+
+    target = pages * LINES_PER_PAGE
+    lines: List[str] = []
+    chapter = paragraph = 0
+    while len(lines) < target:
+        if paragraph % 5 == 0:
+            chapter += 1
+            lines += [f"Глава {chapter}. Страницы истории", ""]
+        paragraph += 1
+        lines += [f"§ {paragraph}. Тема параграфа {paragraph}", ""]
+        for _ in range(rng.randint(3, 6)):
+            sentences = rng.sample(FILLER_SENTENCES, k=rng.randint(3, 6))
+            if rng.random() < 0.3:
+                sentences.insert(rng.randint(0, len(sentences)), rng.choice(facts))
+            lines += _wrap(" ".join(sentences), CHARS_PER_LINE)
+            lines.append("")
+    return lines
+
+
+def write_synthetic_pdf(path: Path, pages: int, font_path: Path, seed: int = 42) -> int:
+    """Пишет текстовый PDF через pypdfium2 (без лишних зависимостей). Возвращает число страниц"""
+    import pypdfium2 as pdfium
+    import pypdfium2.raw as pdfium_c
+
+    lines = synthetic_book_lines(pages, seed)
+    pdf = pdfium.PdfDocument.new()
+
+    font_data = font_path.read_bytes()
+    font_buffer = (ctypes.c_uint8 * len(font_data)).from_buffer_copy(font_data)
+    font = pdfium_c.FPDFText_LoadFont(
+        pdf.raw, font_buffer, len(font_data), pdfium_c.FPDF_FONT_TRUETYPE, True
+    )
+    if not font:
+        raise SystemExit(f"❌ pdfium не смог загрузить шрифт {font_path}")
+
+    written = 0
+    for start in range(0, len(lines), LINES_PER_PAGE):
+        page = pdf.new_page(PAGE_WIDTH, PAGE_HEIGHT)
+        page_lines = lines[start:start + LINES_PER_PAGE] + ["", str(written + 1)]
+        for n, line in enumerate(page_lines):
+            if not line:
+                continue
+            text_obj = pdfium_c.FPDFPageObj_CreateTextObj(pdf.raw, font, FONT_SIZE)
+            encoded = ctypes.create_string_buffer((line + "\x00").encode("utf-16-le"))
+            pdfium_c.FPDFText_SetText(text_obj, ctypes.cast(encoded, ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+            pdfium_c.FPDFPageObj_Transform(
+                text_obj, 1, 0, 0, 1, MARGIN, PAGE_HEIGHT - MARGIN - n * LINE_HEIGHT
+            )
+            pdfium_c.FPDFPage_InsertObject(page.raw, text_obj)
+        page.gen_content()
+        page.close()
+        written += 1
+
+    pdf.save(str(path))
+    pdf.close()
+    return written
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковый RSS процесса (МБ); на Windows resource недоступен"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def ingest_one(processor, vector_store, pdf_path: Path, extractor: Optional[str] = None) -> Dict[str, Any]:
+    """Полный путь /upload для одного файла под трассой; возвращает стадии и итоги"""
+    from app.database import SessionLocal
+    from app.ingestion import ingest_chunks
+    from app.tracing import start_trace
+
+    db = SessionLocal()
+    try:
+        with start_trace("ingest") as trace:
+            processed = processor.process_document(str(pdf_path), pdf_path.name, extractor=extractor)
+            ingested = ingest_chunks(
+                db, vector_store, pdf_path.name, str(pdf_path), processed["chunks"]
+            )
+    finally:
+        db.close()
+
+    total = trace.total
+    pages = processed["total_pages"]
+    chunks = processed["total_chunks"]
+    return {
+        "file": str(pdf_path),
+        "extractor": processed["extractor"],
+        "pages": pages,
+        "chunks": chunks,
+        "indexed_chunks": ingested["indexed_chunks"],
+        "seconds": round(total, 3),
+        "pages_per_sec": round(pages / total, 3) if total else None,
+        "chunks_per_sec": round(chunks / total, 3) if total else None,
+        "stages": trace.as_dict()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк индексации PDF по стадиям")
+    parser.add_argument("--pdf", action="append", default=[], help="готовый PDF (можно несколько раз)")
+    parser.add_argument("--pages", default="300", help="страниц в синтетических учебниках, через запятую")
+    parser.add_argument("--font", default=None, help="TTF-шрифт с кириллицей для генерации")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--extractor", default=None, help="бэкенд извлечения PDF (pypdfium2, pdfplumber)")
+    parser.add_argument("--profile", default=None, help="записать профиль cProfile в файл")
+    parser.add_argument("--data-dir", default=None, help="директория индексов (по умолчанию временная)")
+    parser.add_argument("--output", default=None, help="путь к JSON-отчету")
+    args = parser.parse_args()
+
+    data_dir = setup_data_dir(args.data_dir)
+
+    pdf_paths = [Path(p) for p in args.pdf]
+    if not pdf_paths:
+        font = find_font(args.font)
+        work_dir = Path(tempfile.mkdtemp(prefix="history_tutor_pdf_"))
+        for pages in [int(p) for p in args.pages.split(",") if p.strip()]:
+            path = work_dir / f"synthetic_{pages}p.pdf"
+            t0 = time.perf_counter()
+            written = write_synthetic_pdf(path, pages, font, args.seed)
+            print(f"📄 {path.name}: {written} стр. за {time.perf_counter() - t0:.1f} сек")
+            pdf_paths.append(path)
+
+    # Импорт app - только после setup_data_dir
+    from app.database import init_db
+    from app.document_processor import DocumentProcessor
+    from app.vector_store import VectorStore
+
+    init_db()
+    processor = DocumentProcessor()
+    vs = VectorStore()
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    runs = []
+    for path in pdf_paths:
+        if profiler:
+            profiler.enable()
+        run = ingest_one(processor, vs, path, args.extractor)
+        if profiler:
+            profiler.disable()
+        runs.append(run)
+
+        stages = " ".join(f"{k}={v}" for k, v in run["stages"].items())
+        print(f"📊 {Path(run['file']).name} [{run['extractor']}]: {run['pages']} стр., {run['chunks']} чанков, "
+              f"{run['pages_per_sec']} стр/с, {run['chunks_per_sec']} чанков/с | {stages}")
+
+    if profiler:
+        import pstats
+        profiler.dump_stats(args.profile)
+        print(f"🔬 Профиль: {args.profile} (snakeviz {args.profile})")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+    report = {
+        "benchmark": "ingestion",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "config": {
+            "embedding_model": vs.embedding_model_name,
+            "min_chunk_len": processor.min_chunk_len,
+            "max_chunk_len": processor.max_chunk_len,
+            "data_dir": str(data_dir),
+            "profile": args.profile
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "runs": runs
+    }
+    write_report(report, args.output, "ingestion")
+
+
+if __name__ == "__main__":
+    main()
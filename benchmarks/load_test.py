@@ -0,0 +1,154 @@
+# benchmarks/load_test.py
+"""
+Нагрузочный генератор для запущенного API (main.py).
+
+Открытая модель нагрузки: запросы стартуют по расписанию с заданным RPS,
+независимо от того, успели ли ответить предыдущие - так видно реальные хвосты.
+
+    python -m benchmarks.fake_ollama --port 11435 &
+    OLLAMA_BASE_URL=http://localhost:11435 python main.py &
+    python -m benchmarks.load_test --rps 5 --duration 60 --mix ask=0.95,upload=0.05 --pdf book.pdf
+"""
+from typing import Dict, Any, List, Optional
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import random
+import threading
+import time
+
+import requests
+
+from .common import load_questions, latency_summary, git_revision, write_report
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, pdf_path: Optional[str], timeout: float, seed: int = 42):
+        self.base_url = base_url.rstrip("/")
+        self.pdf_path = pdf_path
+        self.timeout = timeout
+        self.questions = [q["question"] for q in load_questions()]
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.lateness: List[float] = []
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=256)
+        self.session.mount("http://", adapter)
+
+    def _ask(self):
+        question = self.rng.choice(self.questions)
+        return self.session.post(
+            f"{self.base_url}/ask",
+            json={"query": question},
+            timeout=self.timeout
+        )
+
+    def _upload(self):
+        with open(self.pdf_path, "rb") as f:
+            return self.session.post(
+                f"{self.base_url}/upload",
+                files={"file": ("load_test.pdf", f, "application/pdf")},
+                timeout=self.timeout
+            )
+
+    def fire(self, kind: str, scheduled_at: float):
+        started = time.perf_counter()
+        try:
+            response = self._ask() if kind == "ask" else self._upload()
+            status = str(response.status_code)
+        except requests.exceptions.Timeout:
+            status = "timeout"
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[kind].append(elapsed)
+            self.statuses[kind][status] += 1
+            self.lateness.append(started - scheduled_at)
+
+    def run(self, rps: float, duration: float, mix: Dict[str, float], max_workers: int) -> Dict[str, Any]:
+        kinds = list(mix.keys())
+        weights = [mix[k] for k in kinds]
+        interval = 1.0 / rps
+        total = int(rps * duration)
+
+        print(f"🚀 {total} запросов, {rps} RPS, {duration} сек, смесь {mix}")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for i in range(total):
+                scheduled_at = started + i * interval
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                kind = self.rng.choices(kinds, weights)[0]
+                pool.submit(self.fire, kind, scheduled_at)
+        elapsed = time.perf_counter() - started
+
+        endpoints = {}
+        for kind in kinds:
+            samples = self.latencies.get(kind, [])
+            ok = self.statuses[kind].get("200", 0)
+            endpoints[kind] = {
+                "latency": latency_summary(samples),
+                "statuses": dict(self.statuses[kind]),
+                "error_rate": round(1 - ok / len(samples), 4) if samples else None
+            }
+            summary = endpoints[kind]["latency"]
+            if samples:
+                print(f"📊 {kind:7s} n={summary['count']} p50={summary['p50_ms']}ms "
+                      f"p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms "
+                      f"errors={endpoints[kind]['error_rate']}")
+
+        completed = sum(len(v) for v in self.latencies.values())
+        return {
+            "target_rps": rps,
+            "achieved_rps": round(completed / elapsed, 3) if elapsed else None,
+            "duration_seconds": round(elapsed, 3),
+            "scheduler_lateness": latency_summary(self.lateness),
+            "endpoints": endpoints
+        }
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("ask", "upload"):
+            raise argparse.ArgumentTypeError(f"Неизвестный тип запроса: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /ask и /upload")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--rps", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=30.0, help="сек")
+    parser.add_argument("--mix", type=_parse_mix, default={"ask": 1.0})
+    parser.add_argument("--pdf", default=None, help="PDF для /upload")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--max-workers", type=int, default=256)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if "upload" in args.mix and not args.pdf:
+        parser.error("для upload нужен --pdf")
+
+    generator = LoadGenerator(args.base_url, args.pdf, args.timeout)
+    result = generator.run(args.rps, args.duration, args.mix, args.max_workers)
+
+    write_report({
+        "benchmark": "load",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "base_url": args.base_url,
+        "mix": args.mix,
+        **result
+    }, args.output, "load")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# benchmarks/retrieval_benchmark.py
+"""
+Офлайн-бенчмарк поиска: скорость и качество на размеченном наборе вопросов.
+
+Корпус и вопросы - benchmarks/fixtures. Индексы строятся во временной
+директории, LLM заменена детерминированной заглушкой (StubLLMClient).
+
+    python -m benchmarks.retrieval_benchmark
+    python -m benchmarks.retrieval_benchmark --scale 20 --k 5 --output base.json
+
+Для каждой системы (vector, vector_sections, sentence, hybrid, fact, intelligent,
+intelligent_answer)
+считаются p50/p95 латентности, пропускная способность, recall@k и MRR.
+Результаты пишутся в JSON, чтобы сравнивать прогоны между собой.
+vector_sections - двухуровневый поиск (разделы, затем чанки; --fanout) на любом размере корпуса.
+sentence - индекс предложений (чанки найденных предложений); у систем с LLM
+в отчете средняя длина промпта (llm_prompt_chars); у intelligent_answer -
+сколько ответов дано без LLM (extractive_answers).
+"""
+from typing import List, Dict, Any, Callable, Optional, Tuple
+import argparse
+import time
+
+from .common import (
+    setup_data_dir, load_corpus, load_questions, StubLLMClient,
+    latency_summary, git_revision, write_report
+)
+
+
+def _keys_from_metadatas(metadatas: List[Dict[str, Any]], key_map: Dict[Tuple[str, str], str]) -> List[Optional[str]]:
+    return [key_map.get((str(m.get("doc_id")), str(m.get("chunk_index")))) for m in metadatas]
+
+
+def _score(ranked: List[Optional[str]], relevant: List[str], k: int) -> Dict[str, float]:
+    top = ranked[:k]
+    found = [key for key in relevant if key in top]
+    reciprocal_rank = 0.0
+    for rank, key in enumerate(ranked, start=1):
+        if key in relevant:
+            reciprocal_rank = 1.0 / rank
+            break
+    return {"recall": len(found) / len(relevant), "rr": reciprocal_rank}
+
+
+def run_system(name: str, search: Callable[[str], List[Optional[str]]],
+               questions: List[Dict[str, Any]], k: int, repeat: int) -> Dict[str, Any]:
+    """Прогоняет вопросы через одну систему и агрегирует метрики"""
+    # Прогрев (кэши, ленивые инициализации)
+    search(questions[0]["question"])
+
+    latencies = []
+    recalls = []
+    reciprocal_ranks = []
+    per_question = []
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for q in questions:
+            t0 = time.perf_counter()
+            ranked = search(q["question"])
+            latencies.append(time.perf_counter() - t0)
+
+            if ranked is None:
+                continue
+            scores = _score(ranked, q["relevant"], k)
+            recalls.append(scores["recall"])
+            reciprocal_ranks.append(scores["rr"])
+            per_question.append({
+                "question": q["question"],
+                "recall": scores["recall"],
+                "rr": round(scores["rr"], 4),
+                "top": ranked[:k]
+            })
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "latency": latency_summary(latencies),
+        "throughput_qps": round(len(latencies) / elapsed, 3) if elapsed else None
+    }
+    if recalls:
+        result[f"recall@{k}"] = round(sum(recalls) / len(recalls), 4)
+        result["mrr"] = round(sum(reciprocal_ranks) / len(reciprocal_ranks), 4)
+        result["per_question"] = per_question[:len(questions)]
+
+    quality = f"recall@{k}={result.get(f'recall@{k}', '-')} mrr={result.get('mrr', '-')}"
+    print(f"📊 {name:20s} p50={result['latency']['p50_ms']}ms "
+          f"p95={result['latency']['p95_ms']}ms qps={result['throughput_qps']} {quality}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк поиска")
+    parser.add_argument("--k", type=int, default=3, help="глубина для recall@k")
+    parser.add_argument("--scale", type=int, default=0,
+                        help="шумовых чанков на каждый фикстурный")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов набора вопросов")
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="искусственная задержка заглушки LLM, сек")
+    parser.add_argument("--fanout", type=int, default=None,
+                        help="разделов на первом уровне поиска (по умолчанию SECTION_FANOUT)")
+    parser.add_argument("--systems", default="vector,vector_sections,sentence,hybrid,fact,intelligent,intelligent_answer")
+    parser.add_argument("--data-dir", default=None, help="директория индексов (по умолчанию временная)")
+    parser.add_argument("--output", default=None, help="путь к JSON-отчету")
+    args = parser.parse_args()
+
+    data_dir = setup_data_dir(args.data_dir)
+
+    # Импорт app - только после setup_data_dir
+    from app.database import init_db, SessionLocal
+    from app.vector_store import VectorStore
+    from app.ingestion import ingest_chunks
+    from app.fact_retrieval import FactRetrievalEngine
+    from app.intelligent_search import IntelligentSearch
+
+    init_db()
+    vs = VectorStore()
+    llm = StubLLMClient(latency=args.llm_latency)
+    fact_engine = FactRetrievalEngine(vs)
+    searcher = IntelligentSearch(vs, llm)
+
+    corpus = load_corpus(scale=args.scale)
+    questions = load_questions()
+
+    # Индексация через тот же путь записи, что и /upload
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    try:
+        ingested = ingest_chunks(db, vs, corpus["filename"], corpus["filename"], corpus["chunks"])
+        doc_id = ingested["document"].id
+    finally:
+        db.close()
+    ingest_seconds = time.perf_counter() - t0
+
+    key_map = {
+        (str(doc_id), str(chunk["chunk_index"])): chunk["key"]
+        for chunk in corpus["chunks"] if chunk["key"]
+    }
+    k = args.k
+
+    def vector_search(query):
+        results = vs.search(query, n_results=k)
+        return _keys_from_metadatas(results["metadatas"][0], key_map) if results else []
+
+    def vector_sections_search(query):
+        results = vs.search(query, n_results=k, hierarchical=True, fanout=args.fanout)
+        return _keys_from_metadatas(results["metadatas"][0], key_map) if results else []
+
+    def sentence_search(query):
+        return _keys_from_metadatas([p["metadata"] for p in vs.search_sentences(query)], key_map)
+
+    def hybrid_search(query):
+        return _keys_from_metadatas([r["metadata"] for r in vs.hybrid_search(query, n_results=k)], key_map)
+
+    def fact_search(query):
+        return _keys_from_metadatas([r["metadata"] for r in fact_engine.retrieve(query)], key_map)
+
+    def intelligent(query):
+        return _keys_from_metadatas([r["metadata"] for r in searcher.intelligent_search(query, n_results=k)], key_map)
+
+    def intelligent_answer(query):
+        searcher.answer_question(query)
+        return None  # только латентность полного цикла
+
+    systems = {
+        "vector": vector_search,
+        "vector_sections": vector_sections_search,
+        "sentence": sentence_search,
+        "hybrid": hybrid_search,
+        "fact": fact_search,
+        "intelligent": intelligent,
+        "intelligent_answer": intelligent_answer
+    }
+
+    results = {}
+    for name in args.systems.split(","):
+        name = name.strip()
+        if name not in systems:
+            print(f"⚠️ Неизвестная система: {name}")
+            continue
+        llm_calls_before = llm.calls
+        prompt_chars_before = llm.prompt_chars
+        extractive_before = searcher.answer_stats["extractive"]
+        results[name] = run_system(name, systems[name], questions, k, args.repeat)
+        results[name]["llm_calls"] = llm.calls - llm_calls_before
+        if name == "intelligent_answer":
+            results[name]["extractive_answers"] = searcher.answer_stats["extractive"] - extractive_before
+        if results[name]["llm_calls"]:
+            results[name]["llm_prompt_chars"] = round(
+                (llm.prompt_chars - prompt_chars_before) / results[name]["llm_calls"]
+            )
+
+    report = {
+        "benchmark": "retrieval",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "config": {
+            "k": k,
+            "scale": args.scale,
+            "fanout": args.fanout,
+            "sections": vs.section_collection.count(),
+            "repeat": args.repeat,
+            "llm_latency": args.llm_latency,
+            "embedding_model": vs.embedding_model_name,
+            "corpus_chunks": len(corpus["chunks"]),
+            "questions": len(questions),
+            "data_dir": str(data_dir)
+        },
+        "ingest_seconds": round(ingest_seconds, 3),
+        "systems": results
+    }
+    write_report(report, args.output, "retrieval")
+
+
+if __name__ == "__main__":
+    main()
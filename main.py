@@ -1,20 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import anyio
 import shutil
 from pathlib import Path
 import uuid
 import os
+import json
+from typing import Optional
 import warnings
 warnings.filterwarnings("ignore")
 
-from app.config import UPLOAD_DIR
-from app.database import init_db, Document, Chunk, QALog
+from app.config import (
+    UPLOAD_DIR, THREADPOOL_SIZE, OLLAMA_BASE_URL, OLLAMA_MODEL, LLM_WARMUP, QUESTION_BANK_PREFILL,
+    ASK_BATCH_MAX_QUESTIONS
+)
+from app.database import init_db, get_db, Document, Chunk, QALog
 from app.document_processor import DocumentProcessor
+from app.pdf_extraction import available_extractors
+from app.outline import get_document_outline
+from app.ingestion import ingest_chunks
 from app.vector_store import VectorStore
 
-from app.schemas import QuestionRequest, QuestionResponse, GenerateQuestionsRequest, GenerateQuestionsResponse
+from app.schemas import (
+    QuestionRequest, QuestionResponse, BatchQuestionRequest, BatchAnswerItem,
+    GenerateQuestionsRequest, GenerateQuestionsResponse
+)
 from app.agent import HistoryRAGAgent
 from app.llm_client import LLMClient
+from app.tracing import start_trace, metrics
+import contextvars
 import time
 
 
@@ -22,8 +38,8 @@ import time
 app = FastAPI(title="History AI Tutor - Document Processor")
 
 # ПОРЯДОК ИНИЦИАЛИЗАЦИИ ВАЖЕН!
-# 1. Сначала БД
-get_db = init_db()
+# 1. Сначала БД (сессии - через зависимость Depends(get_db))
+init_db()
 
 # 2. Потом процессор документов
 doc_processor = DocumentProcessor()
@@ -34,8 +50,8 @@ vector_store = VectorStore()
 # 4. ПОТОМ клиент LLM (БЕЗ api_key!)
 print("🔄 Инициализация Ollama клиента...")
 llm_client = LLMClient(
-    model_name="gemma3:4b",  # или "mistral", "gemma:7b"
-    base_url="http://localhost:11434"
+    model_name=OLLAMA_MODEL,
+    base_url=OLLAMA_BASE_URL
 )
 
 # 5. Проверяем доступность Ollama
@@ -51,35 +67,125 @@ rag_agent = HistoryRAGAgent(
     llm_client=llm_client
 )
 
-# Получаем функцию для создания сессий БД
-get_db = init_db()  # init_db() возвращает функцию get_db
-doc_processor = DocumentProcessor()
-vector_store = VectorStore()
+# Обработчики объявлены через def, а не async def: FastAPI выполняет их
+# в пуле потоков, и блокирующие вызовы (SQLAlchemy, эмбеддинги, Ollama)
+# не останавливают event loop.
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Гистограмма латентности HTTP по шаблону пути (без id в метках)"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe(
+        "http_request_duration_seconds",
+        time.perf_counter() - started,
+        {
+            "method": request.method,
+            "path": getattr(route, "path", "unmatched"),
+            "status": str(response.status_code)
+        },
+        "Время обработки HTTP запроса"
+    )
+    return response
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Метрики латентности (по стадиям и запросам) в формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 # --- ЭНДПОИНТЫ ДЛЯ AI АГЕНТА ---
 @app.post("/ask", response_model=QuestionResponse)
-async def ask_question(request: QuestionRequest):
+def ask_question(request: QuestionRequest):
     """
     Задать фактологический вопрос по учебнику.
     """
     try:
-        result = rag_agent.answer_fact(
-            query=request.query,
-            document_id=request.document_id,
-            top_k=request.top_k
-        )
+        with start_trace("ask") as trace:
+            result = rag_agent.answer_fact(
+                query=request.query,
+                document_id=request.document_id,
+                top_k=request.top_k,
+                chapter=request.chapter,
+                paragraph=request.paragraph
+            )
+        if request.include_timings:
+            result["timings"] = trace.as_dict()
         return QuestionResponse(**result)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(500, f"Ошибка при обработке вопроса: {str(e)}")
 
+@app.post("/ask/batch")
+def ask_batch(request: BatchQuestionRequest):
+    """
+    Список вопросов (контрольная, домашнее задание) одним запросом.
+    Поиск по всем вопросам - пакетами, ответы LLM - параллельно (ASK_BATCH_CONCURRENCY).
+    Ответ - NDJSON: строка на вопрос по мере готовности (порядок - по index),
+    ошибка одного вопроса - в его строке, остальные продолжаются.
+    """
+    if not request.queries:
+        raise HTTPException(400, "Список вопросов пуст")
+    if len(request.queries) > ASK_BATCH_MAX_QUESTIONS:
+        raise HTTPException(400, f"Не больше {ASK_BATCH_MAX_QUESTIONS} вопросов за запрос")
+    
+    def answers():
+        with start_trace("ask_batch"):
+            answered = set()
+            try:
+                for index, result in rag_agent.answer_batch(
+                    request.queries,
+                    document_id=request.document_id,
+                    chapter=request.chapter,
+                    paragraph=request.paragraph
+                ):
+                    item = BatchAnswerItem(index=index, query=request.queries[index])
+                    if isinstance(result, Exception):
+                        print(f"⚠️ Вопрос {index}: {result}")
+                        item.error = f"Ошибка при обработке вопроса: {result}"
+                    else:
+                        item.result = QuestionResponse(**result)
+                    answered.add(index)
+                    yield item.json(ensure_ascii=False) + "\n"
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                # Пакетный поиск не удался - ошибка в строке каждого вопроса без ответа
+                for index, query in enumerate(request.queries):
+                    if index not in answered:
+                        item = BatchAnswerItem(index=index, query=query, error=f"Ошибка при обработке вопроса: {e}")
+                        yield item.json(ensure_ascii=False) + "\n"
+    
+    def stream():
+        # Starlette продолжает синхронный генератор в потоках пула, каждый шаг - в новой
+        # копии контекста; трасса открывается и закрывается в одном Context
+        context = contextvars.copy_context()
+        lines = answers()
+        try:
+            while True:
+                try:
+                    yield context.run(next, lines)
+                except StopIteration:
+                    return
+        finally:
+            # Клиент отключился - генератор закрывается там же, где открыта трасса
+            context.run(lines.close)
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/generate-questions", response_model=GenerateQuestionsResponse)
-async def generate_questions(request: GenerateQuestionsRequest):
+def generate_questions(request: GenerateQuestionsRequest):
     """
-    Сгенерировать вопросы по конкретному параграфу.
+    Сгенерировать вопросы по конкретному параграфу (из банка вопросов,
+    заполненного после загрузки; недостающие генерирует LLM).
+    Без параграфа - вопросы по всей главе.
     """
+    if not request.chapter and not request.paragraph:
+        raise HTTPException(400, "Укажите главу или параграф")
     try:
         result = rag_agent.generate_questions(
             document_id=request.document_id,
@@ -100,61 +206,79 @@ async def generate_questions(request: GenerateQuestionsRequest):
         raise HTTPException(500, f"Ошибка при генерации вопросов: {str(e)}")
 
 @app.get("/documents")
-async def list_documents():
+def list_documents(db: Session = Depends(get_db)):
     """
     Список всех загруженных учебников.
     """
-    db = get_db()
-    try:
-        docs = db.query(Document).all()
-        return {
-            "documents": [
-                {
-                    "id": d.id,
-                    "filename": d.filename,
-                    "upload_date": d.upload_date.isoformat() if d.upload_date else None,
-                    "chunks": d.total_chunks,
-                    "chapters": []  # Здесь можно добавить структуру
-                }
-                for d in docs
-            ]
-        }
-    finally:
-        db.close()
+    docs = db.query(Document).all()
+    return {
+        "documents": [
+            {
+                "id": d.id,
+                "filename": d.filename,
+                "upload_date": d.upload_date.isoformat() if d.upload_date else None,
+                "chunks": d.total_chunks,
+                "chapters": []  # Здесь можно добавить структуру
+            }
+            for d in docs
+        ]
+    }
 
 @app.get("/documents/{doc_id}/structure")
-async def get_document_structure(doc_id: int):
+def get_document_structure(doc_id: int, db: Session = Depends(get_db)):
     """
-    Получить структуру учебника (главы, параграфы).
+    Получить структуру учебника (главы, параграфы) из предрассчитанного оглавления.
     """
-    db = get_db()
-    try:
-        chunks = db.query(Chunk).filter(Chunk.doc_id == doc_id).all()
-        
-        chapters = set()
-        paragraphs = set()
-        
-        for chunk in chunks:
-            if chunk.chapter:
-                chapters.add(chunk.chapter)
-            if chunk.paragraph:
-                paragraphs.add(chunk.paragraph)
-        
-        return {
-            "document_id": doc_id,
-            "chapters": sorted(list(chapters)),
-            "paragraphs": sorted(list(paragraphs)),
-            "total_chunks": len(chunks)
-        }
-    finally:
-        db.close()
+    sections = get_document_outline(db, doc_id)
+    if sections is None:
+        raise HTTPException(404, "Документ не найден")
+    
+    chapters = []
+    outline = []
+    total_chunks = 0
+    for section in sections:
+        if not outline or outline[-1]["chapter"] != section.chapter:
+            outline.append({"chapter": section.chapter, "paragraphs": []})
+            if section.chapter:
+                chapters.append(section.chapter)
+        chunk_ids = json.loads(section.chunk_ids_json or "[]")
+        total_chunks += len(chunk_ids)
+        outline[-1]["paragraphs"].append({
+            "paragraph": section.paragraph,
+            "section_title": section.section_title,
+            "page_start": section.page_start,
+            "page_end": section.page_end,
+            "chunk_ids": chunk_ids
+        })
+    
+    paragraphs = [s.paragraph for s in sections if s.paragraph]
+    
+    return {
+        "document_id": doc_id,
+        "chapters": list(dict.fromkeys(chapters)),
+        "paragraphs": list(dict.fromkeys(paragraphs)),
+        "total_chunks": total_chunks,
+        "outline": outline
+    }
 
 
 @app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Загружает PDF учебник, обрабатывает и индексирует его."""
+def upload_document(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    extractor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Загружает PDF учебник, обрабатывает и индексирует его.
+    extractor - бэкенд извлечения текста (pypdfium2, pdfplumber), по умолчанию из config.
+    Банк вопросов по параграфам заполняется в фоне после ответа.
+    """
     if not file.filename.endswith('.pdf'):
         raise HTTPException(400, "Только PDF файлы поддерживаются")
+    if extractor and extractor not in available_extractors():
+        raise HTTPException(400, f"Неизвестный бэкенд извлечения: {extractor}. "
+                                 f"Доступны: {', '.join(available_extractors())}")
     
     temp_file_path = None
     
@@ -170,144 +294,149 @@ async def upload_document(file: UploadFile = File(...)):
         
         print(f"💾 Файл сохранен: {file_path}")
         
-        # 2. Создаем запись в БД - ВЫЗЫВАЕМ get_db() КАК ФУНКЦИЮ
-        db = get_db()
-        try:
-            document = Document(
-                filename=file.filename,
-                file_path=str(file_path)
-            )
-            db.add(document)
-            db.commit()
-            db.refresh(document)
-            
-            # 3. Обрабатываем документ
+        # Стадии загрузки (extract, clean, chunk, embed_chunks, ...) пишутся в лог трассы
+        with start_trace("upload"):
+            # 2. Обрабатываем документ (до открытия транзакции)
             processed_data = doc_processor.process_document(
                 file_path=str(file_path),
-                filename=file.filename
+                filename=file.filename,
+                extractor=extractor
             )
-            
-            # 4. Сохраняем чанки в SQL
-            for chunk_data in processed_data["chunks"]:
-                chunk = Chunk(
-                    doc_id=document.id,
-                    content=chunk_data["content"],
-                    page_number=chunk_data.get("page_number", 1),
-                    chapter=chunk_data.get("chapter", ""),
-                    paragraph=chunk_data.get("paragraph", ""),
-                    section_title=chunk_data.get("section_title", ""),
-                    chunk_index=chunk_data["chunk_index"]
-                )
-                db.add(chunk)
-            db.commit()
-            
-            # 5. Добавляем в векторную БД
-            embedding_ids = vector_store.add_chunks(
-                processed_data["chunks"],
-                document.id
+            chunks = processed_data["chunks"]
+        
+            # 3. Документ, чанки и оглавление - одной транзакцией, затем векторы
+            ingested = ingest_chunks(
+                db, vector_store,
+                filename=file.filename,
+                file_path=str(file_path),
+                chunks=chunks
             )
-            
-            # 6. Обновляем чанки с ID эмбеддингов
-            if embedding_ids:
-                for chunk_data, emb_id in zip(processed_data["chunks"], embedding_ids):
-                    db.query(Chunk).filter(
-                        Chunk.doc_id == document.id,
-                        Chunk.chunk_index == chunk_data["chunk_index"]
-                    ).update({"embedding_id": emb_id})
-                db.commit()
-            
-            # 7. Обновляем статистику документа
-            document.total_chunks = len(processed_data["chunks"])
-            db.commit()
-            
-            return JSONResponse({
-                "status": "success",
-                "document_id": document.id,
-                "filename": file.filename,
-                "total_pages": processed_data["total_pages"],
-                "total_chunks": len(processed_data["chunks"]),
-                "chapters_found": len(processed_data.get("chapters", [])),
-                "paragraphs_found": len(processed_data.get("paragraphs", [])),
-                "message": "Учебник успешно загружен и проиндексирован"
-            })
-            
-        finally:
-            db.close()
+        document = ingested["document"]
+        # Документ и чанки уже записаны - файл остается, индексацию доводит
+        # python -m app.consistency resume (повторная загрузка создала бы дубликат)
+        temp_file_path = None
+        
+        question_bank = QUESTION_BANK_PREFILL and not llm_client.use_mock
+        if question_bank:
+            background_tasks.add_task(rag_agent.question_bank.prefill, document.id)
+        
+        return JSONResponse({
+            "status": "success" if document.status == "indexed" else "partial",
+            "document_id": document.id,
+            "filename": file.filename,
+            "total_pages": processed_data["total_pages"],
+            "extractor": processed_data["extractor"],
+            "total_chunks": len(chunks),
+            "indexed_chunks": ingested["indexed_chunks"],
+            "index_status": document.status,
+            "chapters_found": len(processed_data.get("chapters", [])),
+            "paragraphs_found": len(processed_data.get("paragraphs", [])),
+            "question_bank": "scheduled" if question_bank else "off",
+            "message": "Учебник успешно загружен и проиндексирован" if document.status == "indexed" else
+                       f"Учебник сохранен, индексация не завершена ({ingested['error'] or 'не все векторы добавлены'}): "
+                       f"python -m app.consistency resume"
+        })
             
     except Exception as e:
         import traceback
         traceback.print_exc()
-        # Очищаем файл при ошибке
+        db.rollback()
+        # Очищаем файл при ошибке (до записи документа в БД)
         if temp_file_path and temp_file_path.exists():
             temp_file_path.unlink()
         raise HTTPException(500, f"Ошибка при обработке: {str(e)}")
 
 
 @app.get("/stats")
-async def get_stats():
+def get_stats(db: Session = Depends(get_db)):
     """Возвращает статистику по загруженным документам"""
-    db = get_db()
+    docs = db.query(Document).all()
+    total_chunks = db.query(Chunk).count()
     
-    try:
-        docs = db.query(Document).all()
-        total_chunks = db.query(Chunk).count()
-        
-        vector_stats = vector_store.get_collection_stats()
-        
-        return {
-            "documents": [
-                {
-                    "id": d.id,
-                    "filename": d.filename,
-                    "upload_date": d.upload_date.isoformat() if d.upload_date else None,
-                    "chunks": d.total_chunks
-                }
-                for d in docs
-            ],
-            "total_documents": len(docs),
-            "total_chunks_sql": total_chunks,
-            "vector_db": vector_stats
-        }
-    finally:
-        db.close()  # Важно закрывать сессию!
+    vector_stats = vector_store.get_collection_stats()
+    
+    return {
+        "documents": [
+            {
+                "id": d.id,
+                "filename": d.filename,
+                "upload_date": d.upload_date.isoformat() if d.upload_date else None,
+                "chunks": d.total_chunks
+            }
+            for d in docs
+        ],
+        "total_documents": len(docs),
+        "total_chunks_sql": total_chunks,
+        "vector_db": vector_stats,
+        "query_expansion": dict(rag_agent.intelligent_search.expansion_stats),
+        "answers": dict(rag_agent.intelligent_search.answer_stats),
+        "question_bank": dict(rag_agent.question_bank.stats),
+        "llm_last_call": llm_client.last_stats
+    }
 
 @app.get("/documents/{doc_id}/chunks")
-async def get_document_chunks(doc_id: int, skip: int = 0, limit: int = 10):
-    """Получает чанки документа для просмотра"""
-    db = get_db()  # БЫЛО: db = db_session()
+def get_document_chunks(
+    doc_id: int,
+    after_index: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 10,
+    db: Session = Depends(get_db)
+):
+    """
+    Получает чанки документа для просмотра.
+    Пагинация по ключу: передайте next_after_index из предыдущего ответа в after_index.
+    skip оставлен для совместимости (OFFSET медленнее на больших учебниках).
+    """
+    document = db.query(Document.total_chunks).filter(Document.id == doc_id).first()
+    if document is None:
+        raise HTTPException(404, "Документ не найден")
     
-    try:
-        chunks = db.query(Chunk).filter(
-            Chunk.doc_id == doc_id
-        ).offset(skip).limit(limit).all()
-        
-        total = db.query(Chunk).filter(Chunk.doc_id == doc_id).count()
-        
-        return {
-            "total": total,
-            "skip": skip,
-            "limit": limit,
-            "chunks": [
-                {
-                    "id": c.id,
-                    "content_preview": c.content[:200] + "..." if len(c.content) > 200 else c.content,
-                    "page": c.page_number,
-                    "chapter": c.chapter,
-                    "paragraph": c.paragraph,
-                    "title": c.section_title
-                }
-                for c in chunks
-            ]
-        }
-    finally:
-        db.close()
+    # Только нужные колонки: превью вместо полного текста
+    query = db.query(
+        Chunk.id, Chunk.chunk_index, Chunk.page_number,
+        Chunk.chapter, Chunk.paragraph, Chunk.section_title,
+        func.substr(Chunk.content, 1, 200).label("preview"),
+        func.length(Chunk.content).label("content_length")
+    ).filter(Chunk.doc_id == doc_id)
+    
+    if after_index is not None:
+        query = query.filter(Chunk.chunk_index > after_index)
+    
+    query = query.order_by(Chunk.chunk_index)
+    if after_index is None and skip:
+        query = query.offset(skip)
+    rows = query.limit(limit).all()
+    
+    return {
+        "total": document.total_chunks,
+        "skip": skip,
+        "limit": limit,
+        "next_after_index": rows[-1].chunk_index if rows and len(rows) == limit else None,
+        "chunks": [
+            {
+                "id": r.id,
+                "chunk_index": r.chunk_index,
+                "content_preview": r.preview + "..." if r.content_length > 200 else r.preview,
+                "page": r.page_number,
+                "chapter": r.chapter,
+                "paragraph": r.paragraph,
+                "title": r.section_title
+            }
+            for r in rows
+        ]
+    }
 
 @app.on_event("startup")
 async def startup_event():
     """Действия при запуске"""
+    # Размер пула потоков для синхронных обработчиков
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
     print("🚀 Запуск History AI Tutor")
     print(f"📁 Директория загрузок: {UPLOAD_DIR}")
     print(f"🗄️ Векторная БД: {vector_store.get_collection_stats()}")
+    # Модель загружается до первого вопроса, а не на нем
+    if LLM_WARMUP:
+        await anyio.to_thread.run_sync(llm_client.warm_up)
 
 if __name__ == "__main__":
     import uvicorn
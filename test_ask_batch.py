@@ -0,0 +1,104 @@
+# test_ask_batch.py
+"""
+/ask/batch: NDJSON по строке на вопрос, ответы как у /ask по одному,
+и отключение клиента посреди потока.
+
+    python test_ask_batch.py    или    pytest test_ask_batch.py
+
+Работает во временной директории данных на фикстурном корпусе, LLM - заглушка.
+"""
+import json
+import time
+
+from benchmarks.common import setup_data_dir, load_corpus, load_questions, StubLLMClient
+
+setup_data_dir()  # до импорта app: пути читаются из app/config.py
+
+from fastapi.testclient import TestClient
+
+from app.database import init_db, SessionLocal
+from app.ingestion import ingest_chunks
+from app.intelligent_search import IntelligentSearch
+from app.schemas import QuestionResponse
+from app.structure_parser import make_scope
+import main
+
+init_db()
+vs = main.vector_store
+db = SessionLocal()
+try:
+    DOC_ID = ingest_chunks(db, vs, "batch.pdf", "batch.pdf", load_corpus(0)["chunks"])["document"].id
+finally:
+    db.close()
+
+QUESTIONS = [q["question"] for q in load_questions()][:8]
+# Вопросы без даты и имени в ответе - идут до LLM
+LLM_QUESTIONS = [
+    "Почему распалась Римская империя?",
+    "Чем закончилась Куликовская битва?",
+    "Как была устроена афинская демократия?",
+    "Почему Спартак поднял восстание?",
+    "Зачем братья Гракхи предлагали земельный закон?",
+    "Чем известен поход Александра Македонского?"
+]
+
+
+def without_time(result):
+    return {k: v for k, v in result.items() if k != "processing_time"}
+
+
+def test_ndjson_matches_single_answers():
+    main.rag_agent.intelligent_search.llm = StubLLMClient()
+    client = TestClient(main.app)
+
+    response = client.post("/ask/batch", json={"queries": QUESTIONS, "document_id": DOC_ID})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(row["index"] for row in rows) == list(range(len(QUESTIONS)))
+
+    searcher = main.rag_agent.intelligent_search
+    scope = make_scope(document_id=DOC_ID)
+    for row in rows:
+        assert row["error"] is None, row
+        assert row["query"] == QUESTIONS[row["index"]]
+        single = searcher.answer_question(row["query"], scope=scope)
+        assert without_time(row["result"]) == without_time(QuestionResponse(**single).dict())
+
+    metrics = client.get("/metrics").text
+    assert 'request_duration_seconds_count{request="ask_batch"}' in metrics
+
+
+def test_batch_limits():
+    client = TestClient(main.app)
+    assert client.post("/ask/batch", json={"queries": []}).status_code == 400
+    too_many = ["вопрос"] * (main.ASK_BATCH_MAX_QUESTIONS + 1)
+    assert client.post("/ask/batch", json={"queries": too_many}).status_code == 400
+
+
+def test_disconnect_cancels_queued_llm_calls():
+    latency = 0.3
+    llm = StubLLMClient(latency=latency)
+    searcher = IntelligentSearch(vs, llm)
+
+    answers = searcher.answer_batch(LLM_QUESTIONS, concurrency=1)
+    index, first = next(answers)
+    assert not isinstance(first, Exception), first
+    assert first["mode"] == "llm"
+    calls = llm.calls
+
+    # Клиент отключился: закрытие не ждет очередь, оставшиеся вопросы не отправляются в LLM
+    started = time.perf_counter()
+    answers.close()
+    assert time.perf_counter() - started < latency
+
+    time.sleep(latency * 4)
+    # Дойти может только вызов, уже начатый в потоке пула (расширение + ответ одного вопроса)
+    assert llm.calls <= calls + 2, (calls, llm.calls)
+
+
+if __name__ == "__main__":
+    for test in (test_ndjson_matches_single_answers, test_batch_limits,
+                 test_disconnect_cancels_queued_llm_calls):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,80 @@
+# test_chunk_pagination.py
+"""
+/documents/{id}/chunks: пагинация по ключу (after_index / next_after_index)
+отдает те же чанки, что и skip/limit, без пропусков и повторов.
+
+    python test_chunk_pagination.py    или    pytest test_chunk_pagination.py
+
+Работает во временной директории данных на фикстурном корпусе benchmarks/fixtures.
+"""
+from benchmarks.common import setup_data_dir, load_corpus
+
+setup_data_dir()  # до импорта app: пути читаются из app/config.py
+
+from fastapi.testclient import TestClient
+
+from app.database import init_db, SessionLocal
+from app.ingestion import ingest_chunks
+import main
+
+init_db()
+db = SessionLocal()
+try:
+    DOC_ID = ingest_chunks(db, main.vector_store, "pages.pdf", "pages.pdf", load_corpus(0)["chunks"])["document"].id
+finally:
+    db.close()
+
+client = TestClient(main.app)
+
+
+def get_chunks(**params):
+    response = client.get(f"/documents/{DOC_ID}/chunks", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_keyset_pages_match_offset_pages():
+    limit = 3
+    keyset, after_index = [], None
+    while True:
+        params = {"limit": limit}
+        if after_index is not None:
+            params["after_index"] = after_index
+        page = get_chunks(**params)
+        keyset.extend(page["chunks"])
+        after_index = page["next_after_index"]
+        if after_index is None:
+            break
+        assert after_index == page["chunks"][-1]["chunk_index"]
+
+    total = get_chunks()["total"]
+    offset = []
+    for skip in range(0, total, limit):
+        offset.extend(get_chunks(skip=skip, limit=limit)["chunks"])
+
+    indexes = [c["chunk_index"] for c in keyset]
+    assert len(keyset) == total == len(load_corpus(0)["chunks"])
+    assert indexes == sorted(set(indexes))
+    assert keyset == offset
+
+
+def test_last_page_has_no_next():
+    total = get_chunks()["total"]
+    page = get_chunks(limit=total)
+    assert page["next_after_index"] is not None  # страница полная - следующая может быть пустой
+    assert get_chunks(after_index=page["next_after_index"])["chunks"] == []
+    assert get_chunks(limit=total + 1)["next_after_index"] is None
+    assert get_chunks(limit=0)["chunks"] == []
+
+
+def test_preview_and_missing_document():
+    chunk = get_chunks(limit=1)["chunks"][0]
+    assert len(chunk["content_preview"]) <= 203
+    assert client.get("/documents/999999/chunks").status_code == 404
+
+
+if __name__ == "__main__":
+    for test in (test_keyset_pages_match_offset_pages, test_last_page_has_no_next,
+                 test_preview_and_missing_document):
+        test()
+        print(f"✅ {test.__name__}")
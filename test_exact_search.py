@@ -1,16 +1,16 @@
 # test_exact_search.py
-from app.database import get_db, Chunk
+from app.database import SessionLocal, Chunk
 from sqlalchemy import or_
 
-db = get_db()
+db = SessionLocal()
 try:
-    # Ищем точные упоминания Цезаря
+    # Ищем точные упоминания Цезаря (search_text - в нижнем регистре, без пунктуации)
     chunks = db.query(Chunk).filter(
         or_(
-            Chunk.content.ilike('%Цезарь%'),
-            Chunk.content.ilike('%Гай Юлий%'),
-            Chunk.content.ilike('%Юлий Цезарь%'),
-            Chunk.content.ilike('%кесарь%')
+            Chunk.search_text.like('%цезарь%'),
+            Chunk.search_text.like('%гай юлий%'),
+            Chunk.search_text.like('%юлий цезарь%'),
+            Chunk.search_text.like('%кесарь%')
         )
     ).all()
     
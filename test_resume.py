@@ -0,0 +1,95 @@
+# test_resume.py
+"""
+Документ в статусе partial после сбоя индексации и его доиндексация
+(python -m app.consistency resume).
+
+    python test_resume.py    или    pytest test_resume.py
+
+Работает во временной директории данных на фикстурном корпусе benchmarks/fixtures.
+"""
+from benchmarks.common import setup_data_dir, load_corpus
+
+setup_data_dir()  # до импорта app: пути читаются из app/config.py
+
+from app.config import SENTENCE_INDEX
+from app.consistency import IndexConsistencyChecker
+from app.database import init_db, SessionLocal, Document
+from app.ingestion import ingest_chunks
+from app.vector_store import VectorStore
+
+init_db()
+vs = VectorStore()
+checker = IndexConsistencyChecker(vs)
+
+
+def ingest_with_failure(stage: str) -> int:
+    """Загружает корпус, пока метод vs.<stage> падает; возвращает id документа"""
+    def fail(*args, **kwargs):
+        raise RuntimeError(f"сбой ChromaDB в {stage}")
+
+    setattr(vs, stage, fail)
+    db = SessionLocal()
+    try:
+        ingested = ingest_chunks(db, vs, "resume.pdf", "resume.pdf", load_corpus(0)["chunks"])
+        assert ingested["error"], "сбой должен вернуться в error"
+        return ingested["document"].id
+    finally:
+        db.close()
+        delattr(vs, stage)
+
+
+def status(doc_id: int) -> str:
+    db = SessionLocal()
+    try:
+        return db.query(Document.status).filter(Document.id == doc_id).scalar()
+    finally:
+        db.close()
+
+
+def assert_complete(doc_id: int):
+    vectors = len(vs.get_all_ids(doc_id))
+    coverage = vs.index_coverage(doc_id)
+    assert vectors == len(load_corpus(0)["chunks"])
+    assert coverage["section_chunks"] == vectors, coverage
+    if SENTENCE_INDEX:
+        assert coverage["sentences"] > 0, coverage
+    assert status(doc_id) == "indexed"
+
+
+def test_resume_after_chunks_failure():
+    doc_id = ingest_with_failure("add_chunks")
+    assert status(doc_id) == "partial"
+
+    checker.resume_pending()
+    assert_complete(doc_id)
+
+
+def test_resume_after_sentences_failure():
+    doc_id = ingest_with_failure("add_sentences")
+    assert status(doc_id) == "partial"
+
+    # Векторы чанков на месте, но без предложений документ не считается полным
+    report = checker.repair(doc_id, remove_orphans=False)
+    assert report["reembedded"] == 0
+    if SENTENCE_INDEX:
+        assert status(doc_id) == "partial"
+
+    results = checker.resume_pending()
+    assert any(r["doc_id"] == doc_id for r in results)
+    assert_complete(doc_id)
+
+
+def test_resume_after_sections_failure():
+    doc_id = ingest_with_failure("index_sections")
+    assert status(doc_id) == "partial"
+    assert vs.index_coverage(doc_id) == {"section_chunks": 0, "sentences": 0}
+
+    checker.resume_pending()
+    assert_complete(doc_id)
+
+
+if __name__ == "__main__":
+    for test in (test_resume_after_chunks_failure, test_resume_after_sentences_failure,
+                 test_resume_after_sections_failure):
+        test()
+        print(f"✅ {test.__name__}")
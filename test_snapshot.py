@@ -0,0 +1,130 @@
+# test_snapshot.py
+"""
+Снапшот индекса: экспорт и восстановление (python -m app.snapshot) без
+повторной векторизации, проверка контрольных сумм.
+
+    python test_snapshot.py    или    pytest test_snapshot.py
+
+Работает во временной директории данных на фикстурном корпусе benchmarks/fixtures.
+"""
+import io
+import tarfile
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from benchmarks.common import setup_data_dir, load_corpus
+
+setup_data_dir()  # до импорта app: пути читаются из app/config.py
+
+from app.config import SENTENCE_INDEX
+from app.database import init_db, engine, SessionLocal, Chunk
+from app.ingestion import ingest_chunks
+from app.snapshot import restore_snapshot, export_snapshot, IDS_MEMBER
+from app.vector_store import VectorStore, collection_ids
+
+init_db()
+vs = VectorStore()
+db = SessionLocal()
+try:
+    DOC_ID = ingest_chunks(db, vs, "snapshot.pdf", "snapshot.pdf", load_corpus(0)["chunks"])["document"].id
+finally:
+    db.close()
+
+
+def chunk_count(doc_id=None) -> int:
+    db = SessionLocal()
+    try:
+        query = db.query(Chunk)
+        if doc_id is not None:
+            query = query.filter(Chunk.doc_id == doc_id)
+        return query.count()
+    finally:
+        db.close()
+
+
+def collection_state(collection):
+    ids = collection_ids(collection)
+    data = collection.get(ids=ids, include=["embeddings", "metadatas"])
+    return {
+        emb_id: ([round(float(x), 5) for x in vector], meta)
+        for emb_id, vector, meta in zip(data["ids"], data["embeddings"], data["metadatas"])
+    }
+
+
+def test_snapshot_round_trip():
+    archive = Path(tempfile.mkdtemp()) / "snapshot.tar.gz"
+    chunks_before = collection_state(vs.collection)
+    sentences_before = collection_state(vs.sentence_collection)
+    chunks_in_sql = chunk_count()
+
+    manifest = export_snapshot(archive, vs)
+    assert manifest["embedding_model"] == vs.embedding_model_name
+    assert manifest["vector_count"] == len(chunks_before)
+    assert manifest["sentence_count"] == len(sentences_before)
+
+    # Восстановление не векторизует заново: модель эмбеддингов не должна вызываться
+    def no_embedding(*args, **kwargs):
+        raise AssertionError("восстановление вызвало модель эмбеддингов")
+    VectorStore.embed_texts, original = no_embedding, VectorStore.embed_texts
+    try:
+        result = restore_snapshot(archive, force=True, vector_store=vs)
+    finally:
+        VectorStore.embed_texts = original
+    engine.dispose()  # SQLite заменена файлом из архива
+
+    assert result["restored_vectors"] == chunks_in_sql
+    assert result["restored_sentences"] == len(sentences_before)
+    if SENTENCE_INDEX:
+        assert sentences_before, "фикстурный корпус должен дать предложения"
+
+    restored = VectorStore()
+    assert collection_state(restored.sentence_collection) == sentences_before
+    assert set(collection_state(restored.collection)) == set(chunks_before)
+    assert restored.index_coverage(DOC_ID)["section_chunks"] == chunk_count(DOC_ID)
+    if SENTENCE_INDEX:
+        assert restored.search_sentences("Когда произошла Куликовская битва?")
+
+
+def test_restore_rejects_corrupted_archive():
+    archive = Path(tempfile.mkdtemp()) / "snapshot.tar.gz"
+    export_snapshot(archive, vs)
+
+    # Тот же манифест, но подмененный список ID векторов
+    corrupted = archive.with_name("corrupted.tar.gz")
+    with tarfile.open(str(archive), mode="r:gz") as src, tarfile.open(str(corrupted), mode="w:gz") as dst:
+        for member in src.getmembers():
+            data = src.extractfile(member).read()
+            if member.name == IDS_MEMBER:
+                data = data.replace(b'"', b"'", 2)
+            info = tarfile.TarInfo(member.name)
+            info.size = len(data)
+            dst.addfile(info, io.BytesIO(data))
+
+    try:
+        restore_snapshot(corrupted, force=True, vector_store=vs)
+    except RuntimeError as e:
+        assert "Контрольная сумма" in str(e)
+    else:
+        raise AssertionError("поврежденный архив восстановлен")
+
+
+def test_restore_checks_loaded_model():
+    archive = Path(tempfile.mkdtemp()) / "snapshot.tar.gz"
+    export_snapshot(archive, vs)
+
+    # Модель из конфига не загрузилась - VectorStore работает на запасной
+    fallback = SimpleNamespace(embedding_model_name="all-MiniLM-L6-v2")
+    try:
+        restore_snapshot(archive, vector_store=fallback)
+    except RuntimeError as e:
+        assert "all-MiniLM-L6-v2" in str(e)
+    else:
+        raise AssertionError("снапшот другой модели восстановлен")
+
+
+if __name__ == "__main__":
+    for test in (test_snapshot_round_trip, test_restore_rejects_corrupted_archive,
+                 test_restore_checks_loaded_model):
+        test()
+        print(f"✅ {test.__name__}")
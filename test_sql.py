@@ -1,18 +1,18 @@
 # test_sql.py
-from app.database import get_db, Chunk
+from app.database import SessionLocal, Chunk
 from sqlalchemy import text
 
-db = get_db()
+db = SessionLocal()
 try:
     # Прямой SQL запрос
     result = db.execute(
         text("""
         SELECT page_number, chapter, paragraph, substr(content, 1, 300) as preview 
         FROM chunks 
-        WHERE content LIKE '%Цез%' 
-           OR content LIKE '%Юлий%' 
-           OR content LIKE '%кесар%'
-           OR content LIKE '%Caesar%'
+        WHERE search_text LIKE '%цез%' 
+           OR search_text LIKE '%юлий%' 
+           OR search_text LIKE '%кесар%'
+           OR search_text LIKE '%caesar%'
         ORDER BY page_number
         """)
     ).fetchall()
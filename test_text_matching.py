@@ -0,0 +1,55 @@
+# test_text_matching.py
+"""
+Нормализация search_text и поиск по ней: одна и та же нормализация
+при записи чанка и для терминов запроса, поиск LIKE без учета регистра кириллицы.
+
+    python test_text_matching.py    или    pytest test_text_matching.py
+"""
+from sqlalchemy import create_engine, literal, select
+
+from app.text_matching import normalize_search_text, normalize_term
+
+
+def test_normalize_search_text():
+    cases = {
+        "Гай Юлий ЦЕЗАРЬ": " гай юлий цезарь ",
+        "Ёлка и ещё": " елка и еще ",
+        "импера-\nтор": " император ",          # перенос строки в учебнике
+        "импе\u00ad\nратор": " император ",  # мягкий перенос на границе строки
+        "импе\u00adратор": " император ",
+        "Цезарь, Брут; (Рим)!": " цезарь брут рим ",
+        "Северо-Запад": " северо запад ",
+        "a_b 50%": " a b 50 ",
+        "  много \t пробелов\n": " много пробелов ",
+        "": "  ",
+    }
+    for text, expected in cases.items():
+        assert normalize_search_text(text) == expected, (text, normalize_search_text(text))
+
+
+def test_terms_match_normalized_text():
+    # Пробелы по краям search_text: ' цезар' - начало слова, ' цезарь ' - слово целиком
+    search_text = normalize_search_text("Убийство Цезаря в мартовские иды.")
+    assert " " + normalize_term("ЦЕЗАР") in search_text
+    assert normalize_term("Цезаря.") == "цезаря"
+    assert " " + normalize_term("иды") + " " in search_text
+    assert normalize_term(" ?! ") == ""
+
+
+def test_like_on_normalized_text_ignores_cyrillic_case():
+    # SQLite LIKE не знает регистра кириллицы - поэтому он снимается при записи
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        raw = conn.execute(select(literal("Цезарь").like("%цезарь%"))).scalar()
+        normalized = conn.execute(
+            select(literal(normalize_search_text("Цезарь")).like(f"%{normalize_term('ЦЕЗАРЬ')}%"))
+        ).scalar()
+    assert not raw
+    assert normalized
+
+
+if __name__ == "__main__":
+    for test in (test_normalize_search_text, test_terms_match_normalized_text,
+                 test_like_on_normalized_text_ignores_cyrillic_case):
+        test()
+        print(f"✅ {test.__name__}")